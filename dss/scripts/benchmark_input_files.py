@@ -0,0 +1,78 @@
+"""
+Compares the time it takes to update the inputs of a run with the streaming input patcher,
+against the previous csv.DictReader/DictWriter implementation, on the bundled models.
+
+Usage (from the repository root):
+    PYTHONPATH=dss/src python dss/scripts/benchmark_input_files.py
+"""
+import argparse
+import csv
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+from wqdss.input_files import patch_input_file
+
+DATA_DIR = 'data'
+INPUTS = [
+    ('mock_stream_A', 'qin_br8.csv', 'QWD', 30.0),
+    ('mock_stream_A', 'hangq01.csv', 'Q', 1.5),
+    ('mock_stream_B', 'qin_br8.npt', 'QWD', 30.0),
+    ('mock_stream_B', 'hangq01.npt', 'Q', 1.5),
+]
+
+
+def dict_writer_update(input_file, column, value):
+    """ The previous implementation of update_inputs_for_run, which only supports csv inputs """
+    with open(input_file, 'r') as ifile:
+        contents = ifile.readlines()
+
+    reader = csv.DictReader(contents[2:])
+    with open(input_file, 'w') as ofile:
+        ofile.writelines(contents[:2])
+        writer = csv.DictWriter(ofile, reader.fieldnames)
+        for row in reader:
+            row[column] = value
+            writer.writerow(row)
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data_dir', default=DATA_DIR, help='The directory containing the bundled models')
+    parser.add_argument('--repeat', type=int, default=5, help='The number of times each update is timed')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='wqdss-bench')
+    try:
+        print(f"{'input file':<28}{'lines':>8}{'DictWriter (ms)':>18}{'patcher (ms)':>15}{'speedup':>10}")
+        for model, input_file, column, value in INPUTS:
+            source = os.path.join(args.data_dir, model, input_file)
+            target = os.path.join(work_dir, input_file)
+            with open(source, 'rb') as f:
+                num_lines = sum(1 for _ in f)
+
+            patcher_time = min(timeit.repeat(lambda: patch_input_file(source, target, column, value),
+                                             number=1, repeat=args.repeat))
+
+            if input_file.endswith('.csv'):
+                def legacy():
+                    shutil.copyfile(source, target)
+                    dict_writer_update(target, column, value)
+                copy_time = min(timeit.repeat(lambda: shutil.copyfile(source, target), number=1, repeat=args.repeat))
+                legacy_time = min(timeit.repeat(legacy, number=1, repeat=args.repeat)) - copy_time
+                print(f"{model + '/' + input_file:<28}{num_lines:>8}{legacy_time * 1000:>18.1f}"
+                      f"{patcher_time * 1000:>15.1f}{legacy_time / patcher_time:>9.1f}x")
+            else:
+                print(f"{model + '/' + input_file:<28}{num_lines:>8}{'unsupported':>18}{patcher_time * 1000:>15.1f}"
+                      f"{'-':>10}")
+    finally:
+        shutil.rmtree(work_dir)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,60 @@
+"""
+Compares the time it takes to load the analysed columns of a model output file with the vectorised parser,
+against parsing the rows with np.loadtxt, on generated output files of increasing length.
+
+Usage (from the repository root):
+    PYTHONPATH=dss/src python dss/scripts/benchmark_scoring.py
+"""
+import argparse
+import sys
+import timeit
+
+import numpy as np
+
+from wqdss.scoring import TRAILING_SEPARATOR, load_output_columns
+
+ROWS = [100, 1000, 10000]
+COLUMNS = 23
+ANALYSED = ['C3', 'C11', 'C17']
+
+
+def output_contents(num_rows, num_columns):
+    """ An output file in the format of the model: a header and a row of values for each time step """
+    rng = np.random.default_rng(0)
+    header = ['JDAY'] + [f'C{i}' for i in range(1, num_columns)]
+    contents = [','.join(header) + ',\n']
+    for day, row in enumerate(rng.uniform(0, 100, (num_rows, num_columns - 1))):
+        contents.append(','.join([f'{day:.3f}'] + [f'{v:.4f}' for v in row]) + ',\n')
+    return contents
+
+
+def loadtxt_columns(contents, names):
+    """ Parsing the rows with np.loadtxt, which only converts the analysed columns """
+    header = [c.strip() for c in TRAILING_SEPARATOR.sub('', contents[0].rstrip('\r\n')).split(',')]
+    indices = [header.index(name) for name in names]
+    rows = [TRAILING_SEPARATOR.sub('', line.rstrip('\r\n')) for line in contents[1:] if line.strip()]
+    table = np.loadtxt(rows, delimiter=',', usecols=[0] + indices, ndmin=2)
+    return table[:, 0], {name: table[:, i + 1] for i, name in enumerate(names)}
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--columns', type=int, default=COLUMNS, help='The number of columns in the output file')
+    parser.add_argument('--repeat', type=int, default=5, help='The number of times each load is timed')
+    args = parser.parse_args()
+
+    print(f"{'rows':>8}{'loadtxt (ms)':>15}{'vectorised (ms)':>18}{'runs/s':>10}{'speedup':>10}")
+    for num_rows in ROWS:
+        contents = output_contents(num_rows, args.columns)
+        loadtxt_time = min(timeit.repeat(lambda: loadtxt_columns(contents, ANALYSED), number=1, repeat=args.repeat))
+        vectorised_time = min(timeit.repeat(lambda: load_output_columns(contents, ANALYSED),
+                                            number=1, repeat=args.repeat))
+        print(f"{num_rows:>8}{loadtxt_time * 1000:>15.2f}{vectorised_time * 1000:>18.2f}"
+              f"{1 / vectorised_time:>10.0f}{loadtxt_time / vectorised_time:>9.1f}x")
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
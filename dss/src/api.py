@@ -1,10 +1,12 @@
 import asyncio
+import hashlib
 import json
 import os
 
 import responder
 import logging
 
+import wqdss.execution_store
 import wqdss.model_registry
 import wqdss.processing
 
@@ -12,10 +14,22 @@ logger = logging.getLogger()
 logger.setLevel(logging.DEBUG)
 
 
+# seconds between comments that are sent on an event stream while there are no events
+EVENTS_KEEPALIVE = float(os.environ.get("WQDSS_EVENTS_KEEPALIVE", "15"))
+
 api = responder.API()
 model_registry_client = wqdss.model_registry.ModelRegistryClient()
 
 
+@api.on_event("startup")
+async def resume_executions():
+    """
+    Continue the executions that were interrupted when the API stopped, from their last checkpoint
+    """
+    tasks = wqdss.processing.resume_executions()
+    logger.info(f"resuming {len(tasks)} executions")
+
+
 @api.route("/status/{exec_id}")
 async def status(req, resp, *, exec_id):
     try:
@@ -43,6 +57,44 @@ async def status(req, resp, *, exec_id):
             resp.media["result"] = str(e)
 
 
+def server_sent_event(event_type, data):
+    return f"event: {event_type}\ndata: {json.dumps(data)}\n\n"
+
+
+@api.route("/status/{exec_id}/events")
+async def status_events(req, resp, *, exec_id):
+    """
+    Stream the progress of an execution as server-sent events: a progress event with the current state of the
+    execution, followed by iteration, run and iteration_complete events, until a completed event
+    """
+    resp.headers["Content-Type"] = "text/event-stream"
+    resp.headers["Cache-Control"] = "no-cache"
+
+    @resp.stream
+    async def events():
+        with wqdss.processing.EXECUTION_EVENTS.subscribe(exec_id) as queue:
+            try:
+                progress = wqdss.processing.get_progress(exec_id)
+            except KeyError:
+                progress = {"id": exec_id, "status": "NOT_FOUND"}
+
+            yield server_sent_event("progress", progress)
+            if progress["status"] != wqdss.processing.ExectuionState.RUNNING.value:
+                return
+
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), EVENTS_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    # keeps proxies from closing an idle connection during long runs
+                    yield ": keepalive\n\n"
+                    continue
+
+                yield server_sent_event(event["type"], event)
+                if event["type"] == "completed":
+                    return
+
+
 @api.route("/best_run/{exec_id}")
 async def run_zip(req, resp, *, exec_id):
     try:
@@ -83,8 +135,37 @@ async def exec_dss(req, resp):
 
 @api.route("/executions")
 async def completed_executions(req, resp):
+    """
+    List executions a page at a time. Supported query parameters are limit, cursor (from the next_cursor
+    of the previous page), model_name, state, since (returns only executions that were updated after
+    that timestamp) and fields (a comma separated list of fields to return for each execution)
+    """
     logger.info("fetching previous executions")
-    resp.media = wqdss.processing.get_executions()
+    query = {key: req.params[key] for key in req.params}
+
+    # the executions only need to be listed if they changed since the client last fetched them
+    etag = '"{}"'.format(hashlib.sha256(
+        json.dumps([wqdss.processing.get_executions_version(), query], sort_keys=True).encode()).hexdigest())
+    resp.headers['ETag'] = etag
+    if req.headers.get('If-None-Match') == etag:
+        resp.status_code = 304
+        resp.content = b''
+        return
+
+    kwargs = {key: query[key] for key in ('cursor', 'model_name', 'state', 'since') if key in query}
+    try:
+        if 'limit' in query:
+            kwargs['limit'] = int(query['limit'])
+            if kwargs['limit'] < 1:
+                raise ValueError(f"invalid limit {query['limit']}")
+        if 'since' in query:
+            kwargs['since'] = float(query['since'])
+        if 'fields' in query:
+            kwargs['fields'] = query['fields'].split(',')
+        resp.media = wqdss.processing.get_executions(**kwargs)
+    except (ValueError, wqdss.execution_store.InvalidCursorError) as e:
+        resp.status_code = 400
+        resp.media = {'error': str(e)}
 
 
 @api.route("/models")
@@ -1,9 +1,12 @@
+import asyncio
 import os
+import re
 
 import responder
 import logging
 
 import wqdss
+import wqdss.blobs
 import wqdss.model_registry
 
 logger = logging.getLogger()
@@ -12,16 +15,200 @@ logger.setLevel(logging.DEBUG)
 api = responder.API()
 
 
+# the number of seconds after which a client should retry fetching a model that is still being imported
+RETRY_AFTER = 10
+
+# the routes that stream files: model archives and blobs
+STREAMED_PATHS = re.compile(r"^/(models/[^/]+|blobs/[^/]+)/?$")
+
+
+class IdentityEncodingMiddleware:
+    """
+    Streamed files are sent as they are, so that their Content-Length and byte ranges match the bytes that are
+    sent. responder compresses every response the client accepts compressed, so for these routes the client's
+    Accept-Encoding is dropped
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and STREAMED_PATHS.match(scope["path"]):
+            scope = dict(scope, headers=[(k, v) for k, v in scope["headers"] if k.lower() != b"accept-encoding"])
+        await self.app(scope, receive, send)
+
+
+api.add_middleware(IdentityEncodingMiddleware)
+
+
 @api.on_event('startup')
 async def load_models():
+    # models are imported and archived in the background, so the registry starts serving right away
     wqdss.model_registry.load_models()
 
 
+def not_ready(resp):
+    resp.status_code = 503
+    resp.headers["Retry-After"] = str(RETRY_AFTER)
+
+
+def etag_matches(if_none_match, etag):
+    if if_none_match is None:
+        return False
+    return any(tag.strip() in (etag, '*') for tag in if_none_match.split(','))
+
+
+async def stream_file(req, resp, path, etag, content_type):
+    """
+    Stream the file from disk. A client that already has this version of the file (If-None-Match) gets a 304,
+    and a single byte range (Range) resumes a download that was interrupted
+    """
+    size = os.path.getsize(path)
+    # the mimetype of the response isn't applied to a streamed body
+    resp.headers["Content-Type"] = content_type
+    resp.headers["ETag"] = etag
+    resp.headers["Accept-Ranges"] = "bytes"
+    if etag_matches(req.headers.get("If-None-Match"), etag):
+        resp.status_code = 304
+        resp.content = b""
+        return
+
+    first, last = 0, size - 1
+    range_header = req.headers.get("Range")
+    # the range is ignored if the file changed since the client fetched the start of it
+    if range_header is not None and req.headers.get("If-Range", etag) == etag:
+        try:
+            byte_range = wqdss.model_registry.parse_range(range_header, size)
+        except wqdss.model_registry.InvalidRangeError:
+            resp.status_code = 416
+            resp.headers["Content-Range"] = f"bytes */{size}"
+            resp.content = b""
+            return
+        if byte_range is not None:
+            first, last = byte_range
+            resp.status_code = 206
+            resp.headers["Content-Range"] = f"bytes {first}-{last}/{size}"
+
+    resp.headers["Content-Length"] = str(last - first + 1)
+
+    @resp.stream
+    async def contents():
+        # the file is read in the thread pool, so a slow disk doesn't hold up other requests
+        loop = asyncio.get_event_loop()
+        chunks = wqdss.model_registry.read_archive(path, first, last)
+        while True:
+            chunk = await loop.run_in_executor(None, next, chunks, None)
+            if chunk is None:
+                return
+            yield chunk
+
+
 @api.route("/models/{name}")
 async def get_model_by_name(req, resp, *, name):
+    """
+    Stream the zip archive of the model, of the current version or of the version in the version parameter
+    """
+    version = req.params.get("version")
+    try:
+        # the archive of a version is built on first use
+        archive_path = await asyncio.get_event_loop().run_in_executor(
+            None, wqdss.model_registry.get_model_archive, name, version)
+        version = version or wqdss.model_registry.get_model_version(name)
+    except wqdss.model_registry.ModelNotReadyError:
+        not_ready(resp)
+        return
+    except wqdss.model_registry.ModelNotFoundError:
+        resp.status_code = api.status_codes.not_found
+        return
+
+    await stream_file(req, resp, archive_path, f'"{version}"', "application/zip")
+
+
+@api.route("/models/{name}/manifest")
+class ManifestResource:
+    async def on_get(self, req, resp, *, name):
+        """
+        Return the files of the model and the digests of their contents, of the current version or of the version
+        in the version parameter
+        """
+        try:
+            manifest = wqdss.model_registry.get_manifest(name, req.params.get("version"))
+        except wqdss.model_registry.ModelNotReadyError:
+            not_ready(resp)
+            return
+        except wqdss.model_registry.ModelNotFoundError:
+            resp.status_code = api.status_codes.not_found
+            return
+
+        etag = f'"{manifest["version"]}"'
+        resp.headers["ETag"] = etag
+        if etag_matches(req.headers.get("If-None-Match"), etag):
+            resp.status_code = 304
+            resp.content = b""
+            return
+        resp.media = manifest
+
+    async def on_post(self, req, resp, *, name):
+        """
+        Add a version of the model from the digests of its files, {"files": {path: digest}}.
+        If some of the files weren't uploaded to /blobs yet, their digests are returned with a 409
+        """
+        manifest = await req.media()
+        try:
+            version = wqdss.model_registry.save_manifest(name, manifest["files"])
+        except wqdss.model_registry.MissingBlobsError as e:
+            resp.status_code = 409
+            resp.media = {"missing": e.missing}
+            return
+        except (KeyError, TypeError, wqdss.model_registry.InvalidManifestError) as e:
+            resp.status_code = 400
+            resp.media = {"error": str(e)}
+            return
+
+        logger.info("Added version %s of model %s", version, name)
+        resp.media = {"model_name": name, "version": version}
+
+
+@api.route("/blobs/{digest}")
+class BlobResource:
+    async def on_get(self, req, resp, *, digest):
+        store = wqdss.model_registry.blob_store()
+        if not store.has(digest):
+            resp.status_code = api.status_codes.not_found
+            return
+
+        # the contents of a blob never change
+        resp.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        await stream_file(req, resp, store.path(digest), f'"{digest}"', "application/octet-stream")
+
+    async def on_put(self, req, resp, *, digest):
+        try:
+            wqdss.model_registry.blob_store().put(await req.content, digest)
+        except wqdss.blobs.InvalidBlobError as e:
+            resp.status_code = 400
+            resp.media = {"error": str(e)}
+            return
+        resp.media = {"digest": digest}
+
+
+@api.route("/models/{name}/version")
+async def get_model_version(req, resp, *, name):
+    try:
+        resp.media = {"model_name": name, "version": wqdss.model_registry.get_model_version(name)}
+    except wqdss.model_registry.ModelNotReadyError:
+        not_ready(resp)
+    except wqdss.model_registry.ModelNotFoundError:
+        resp.status_code = api.status_codes.not_found
+
+
+@api.route("/models/{name}/status")
+async def get_model_status(req, resp, *, name):
+    """
+    Return the readiness of the model: IMPORTING, ARCHIVING (its manifest and files can already be fetched),
+    READY or FAILED
+    """
     try:
-        resp.content = wqdss.model_registry.get_model_by_name(name)
-        resp.mimetype = "application/zip"
+        resp.media = wqdss.model_registry.get_model_status(name)
     except wqdss.model_registry.ModelNotFoundError:
         resp.status_code = api.status_codes.not_found
 
@@ -42,9 +229,9 @@ class ModelsResource:
         files = await req.media('files')
         model_contents = files['model']['content']
         model_name = files['model']['filename']
-        wqdss.model_registry.add_model(model_name, model_contents)
-        logger.info("Added model %s", model_name)
-        resp.media = {"model_name": model_name}
+        version = wqdss.model_registry.add_model(model_name, model_contents)
+        logger.info("Added version %s of model %s", version, model_name)
+        resp.media = {"model_name": model_name, "version": version}
 
 
 if __name__ == "__main__":
@@ -42,20 +42,46 @@ function populateModelsInselect(selectElement) {
     });
 }
 
+// the latest update of the executions that are already listed, only executions updated after it are fetched
+let executionsLastUpdated = null;
+
 function createExecutionListItem(execution) {
   const li = document.createElement("li");
+  li.setAttribute("id", `execution-${execution.id}`);
   li.innerHTML = JSON.stringify(execution);
   return li;
 }
 
-function fetchPreviousResults(executionsListElement) {
-  return fetch("executions")
+function updateExecutionListItem(executionsListElement, execution) {
+  const li = createExecutionListItem(execution);
+  const existing = executionsListElement.querySelector(`#execution-${execution.id}`);
+  if (existing === null) {
+    executionsListElement.appendChild(li);
+  } else {
+    existing.replaceWith(li);
+  }
+  executionsLastUpdated = Math.max(executionsLastUpdated || 0, execution.updated_at);
+}
+
+function fetchPreviousResults(executionsListElement, cursor, since = executionsLastUpdated) {
+  const query = new URLSearchParams();
+  if (since !== null) {
+    query.set("since", since);
+  }
+  if (cursor) {
+    query.set("cursor", cursor);
+  }
+
+  return fetch(`executions?${query}`)
     .then(response => response.json())
     .then(data => {
       console.log(data);
       data["executions"].forEach(execution => {
-        executionsListElement.appendChild(createExecutionListItem(execution));
+        updateExecutionListItem(executionsListElement, execution);
       });
+      if (data["next_cursor"]) {
+        return fetchPreviousResults(executionsListElement, data["next_cursor"], since);
+      }
     });
 }
 
@@ -79,6 +105,37 @@ function executeDss(form) {
 }
 
 function monitorExecution(executionId, form) {
+  if (window.EventSource === undefined) {
+    return pollExecution(executionId, form);
+  }
+
+  const source = new EventSource(`status/${executionId}/events`);
+  let status = null;
+
+  function update(e) {
+    const data = JSON.parse(e.data);
+    console.log(data);
+    status = Object.assign(status || { id: executionId }, data);
+    if (data["type"] === "completed") {
+      console.log("Processing is complete");
+      source.close();
+      status["link"] = `best_run/${executionId}`;
+    }
+    form.dispatchEvent(new CustomEvent("dssUpdate", { detail: status }));
+  }
+
+  ["progress", "iteration", "run", "iteration_complete", "completed"].forEach(eventType => {
+    source.addEventListener(eventType, update);
+  });
+  source.addEventListener("error", e => {
+    // the stream can't be followed, so fall back to polling the status
+    console.log("Error while following the execution, polling its status");
+    source.close();
+    pollExecution(executionId, form);
+  });
+}
+
+function pollExecution(executionId, form) {
   function monitorThis() {
     fetch(`status/${executionId}`)
       .then(response => response.json())
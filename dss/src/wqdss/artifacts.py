@@ -0,0 +1,103 @@
+import hashlib
+import logging
+import os
+import tempfile
+from urllib.parse import urlparse
+
+logger = logging.getLogger()
+logger.setLevel(logging.DEBUG)
+
+# where workers store the files of each run, e.g. file:///artifacts on a volume shared with the API.
+# When empty, the files of each run are returned inline through the result backend
+ARTIFACT_STORE = os.environ.get("WQDSS_ARTIFACT_STORE", "")
+
+
+class ArtifactNotFoundError(Exception):
+    def __init__(self, ref):
+        self.ref = ref
+        super().__init__(f'artifact {ref} not found')
+
+
+class UnknownArtifactStoreError(Exception):
+    def __init__(self, uri):
+        self.uri = uri
+        super().__init__(f'artifact store {uri} is not supported')
+
+
+class ArtifactStore:
+    '''
+    Stores the files of runs, so only a reference to them is passed between the workers and the API
+    '''
+
+    def put(self, contents):
+        '''
+        Stores contents, and returns a reference that can be used to get them
+        '''
+        raise NotImplementedError()
+
+    def get(self, ref):
+        raise NotImplementedError()
+
+    def delete(self, ref):
+        raise NotImplementedError()
+
+
+class LocalArtifactStore(ArtifactStore):
+    '''
+    Stores artifacts as files in a directory, which is a stand-in for a volume that is shared by the pods.
+    Artifacts are content-addressed, so identical run files are only stored once
+    '''
+
+    def __init__(self, base_dir):
+        self.base_dir = base_dir
+
+    def _path(self, ref):
+        if os.path.basename(ref) != ref:
+            raise ArtifactNotFoundError(ref)
+        return os.path.join(self.base_dir, ref[:2], ref)
+
+    def put(self, contents):
+        ref = hashlib.sha256(contents).hexdigest()
+        path = self._path(ref)
+        if os.path.exists(path):
+            return ref
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix='.artifact', dir=os.path.dirname(path))
+        with open(fd, 'wb') as f:
+            f.write(contents)
+        os.replace(tmp_path, path)
+        return ref
+
+    def get(self, ref):
+        try:
+            with open(self._path(ref), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            raise ArtifactNotFoundError(ref)
+
+    def delete(self, ref):
+        try:
+            os.remove(self._path(ref))
+        except FileNotFoundError:
+            pass
+
+
+ARTIFACT_STORES = {
+    "file": lambda uri: LocalArtifactStore(uri.path),
+}
+
+
+def get_artifact_store(uri=None):
+    '''
+    Returns the artifact store configured by uri (WQDSS_ARTIFACT_STORE by default), or None if there isn't one
+    '''
+    uri = ARTIFACT_STORE if uri is None else uri
+    if not uri:
+        return None
+
+    parsed = urlparse(uri)
+    try:
+        return ARTIFACT_STORES[parsed.scheme or "file"](parsed)
+    except KeyError:
+        raise UnknownArtifactStoreError(uri)
@@ -0,0 +1,116 @@
+import asyncio
+import json
+import logging
+import os
+
+logger = logging.getLogger()
+logger.setLevel(logging.DEBUG)
+
+# the duration that a batch of runs should take on a worker, the number of runs in each batch is tuned to match it
+BATCH_TARGET_SECONDS = float(os.environ.get("WQDSS_BATCH_TARGET_SECONDS", "60"))
+BATCH_MAX_SIZE = int(os.environ.get("WQDSS_BATCH_MAX_SIZE", "16"))
+
+
+class RunFailedError(Exception):
+    pass
+
+
+class RunBatcher:
+    """
+    Sends runs to the workers in batches, so the overhead of a task is shared by all of the runs in it.
+    Runs that are submitted together (in the same iteration of the event loop) with the same model and
+    analysis are sent in the same batch, up to the batch size. The batch size is tuned from the observed
+    duration of runs, so each batch takes about target_seconds on a worker.
+    dispatch_batch(model_name, param_values_list, output_file, model_analysis, model_version) returns a record per run,
+    a record with an 'error' fails only its own run
+    """
+
+    def __init__(self, dispatch_batch, target_seconds=BATCH_TARGET_SECONDS, max_size=BATCH_MAX_SIZE,
+                 smoothing=0.2):
+        self.dispatch_batch = dispatch_batch
+        self.target_seconds = target_seconds
+        self.max_size = max_size
+        self.smoothing = smoothing
+        self.run_seconds = None
+        self._pending = {}
+        self._flush_scheduled = False
+
+    @property
+    def batch_size(self):
+        if self.run_seconds is None:
+            # nothing is known about the runs yet, so a single run can't hold up others
+            return 1
+        return max(1, min(self.max_size, int(self.target_seconds / max(self.run_seconds, 1e-6))))
+
+    def observe(self, duration, num_runs):
+        run_seconds = duration / num_runs
+        if self.run_seconds is None:
+            self.run_seconds = run_seconds
+        else:
+            self.run_seconds += self.smoothing * (run_seconds - self.run_seconds)
+
+    async def run(self, model_name, param_values, output_file, model_analysis=None, model_version=None):
+        loop = asyncio.get_event_loop()
+        key = (model_name, output_file, json.dumps(model_analysis, sort_keys=True), model_version)
+        entry = {'param_values': param_values, 'future': loop.create_future(), 'batch': None}
+        pending = self._pending.setdefault(key, [])
+        pending.append(entry)
+
+        if len(pending) >= self.batch_size:
+            self._flush(key)
+        elif not self._flush_scheduled:
+            self._flush_scheduled = True
+            loop.call_soon(self._flush_all)
+
+        try:
+            return await entry['future']
+        except asyncio.CancelledError:
+            self._cancel(key, entry)
+            raise
+
+    def _cancel(self, key, entry):
+        batch = entry['batch']
+        if batch is None:
+            self._pending[key].remove(entry)
+            if not self._pending[key]:
+                del self._pending[key]
+        elif all(e['future'].done() for e in batch['entries']):
+            # none of the runs in the batch are awaited anymore, so the whole task is cancelled
+            batch['task'].cancel()
+
+    def _flush_all(self):
+        self._flush_scheduled = False
+        for key in list(self._pending):
+            self._flush(key)
+
+    def _flush(self, key):
+        entries = self._pending.pop(key, [])
+        size = self.batch_size
+        for i in range(0, len(entries), size):
+            batch = {'entries': entries[i:i + size]}
+            for entry in batch['entries']:
+                entry['batch'] = batch
+            batch['task'] = asyncio.ensure_future(self._send(key, batch['entries']))
+
+    async def _send(self, key, entries):
+        model_name, output_file, model_analysis, model_version = key
+        loop = asyncio.get_event_loop()
+        start = loop.time()
+        try:
+            records = await self.dispatch_batch(model_name, [e['param_values'] for e in entries], output_file,
+                                                json.loads(model_analysis), model_version)
+        except Exception as e:
+            for entry in entries:
+                if not entry['future'].done():
+                    entry['future'].set_exception(e)
+            return
+
+        self.observe(loop.time() - start, len(entries))
+        logger.debug(f"batch of {len(entries)} runs completed, batch size is now {self.batch_size}")
+        for entry, record in zip(entries, records):
+            if entry['future'].done():
+                continue
+            if 'error' in record:
+                entry['future'].set_exception(RunFailedError(record['error']))
+            else:
+                entry['future'].set_result(record)
@@ -0,0 +1,62 @@
+import hashlib
+import logging
+import os
+import tempfile
+
+logger = logging.getLogger()
+logger.setLevel(logging.DEBUG)
+
+
+class InvalidBlobError(Exception):
+    def __init__(self, digest, actual_digest):
+        self.digest = digest
+        self.actual_digest = actual_digest
+        super().__init__(f'blob {digest} has the contents of {actual_digest}')
+
+
+def blob_digest(contents):
+    return hashlib.sha256(contents).hexdigest()
+
+
+class BlobStore:
+    """
+    Files stored on disk by the sha256 digest of their contents, so a file that is shared by several models,
+    or by several versions of a model, is only stored once. Blobs are immutable once they are stored
+    """
+
+    def __init__(self, base_dir):
+        self.base_dir = base_dir
+
+    def path(self, digest):
+        return os.path.join(self.base_dir, digest[:2], digest)
+
+    def has(self, digest):
+        return os.path.exists(self.path(digest))
+
+    def get(self, digest):
+        with open(self.path(digest), 'rb') as blob:
+            return blob.read()
+
+    def size(self, digest):
+        return os.path.getsize(self.path(digest))
+
+    def put(self, contents, digest=None):
+        '''
+        Stores the contents, unless they are already stored, returns their digest.
+        If the digest is given, the contents are verified against it
+        '''
+        actual_digest = blob_digest(contents)
+        if digest is not None and digest != actual_digest:
+            raise InvalidBlobError(digest, actual_digest)
+
+        path = self.path(actual_digest)
+        if os.path.exists(path):
+            return actual_digest
+
+        # the blob is renamed into place once it's complete, so a partial blob is never read
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as blob:
+            blob.write(contents)
+        os.replace(tmp_path, path)
+        return actual_digest
@@ -0,0 +1,47 @@
+import asyncio
+from collections import defaultdict
+import contextlib
+import logging
+import os
+
+logger = logging.getLogger()
+logger.setLevel(logging.DEBUG)
+
+# the number of events that are kept for a subscriber that doesn't keep up, older events are dropped
+MAX_QUEUED_EVENTS = int(os.environ.get("WQDSS_MAX_QUEUED_EVENTS", "1000"))
+
+
+class ExecutionEvents:
+    """
+    Publishes the progress of executions to the subscribers of each execution.
+    Events are dicts with a 'type', they are only delivered to subscribers that are subscribed when
+    the event is published, so a subscriber should get a snapshot of the execution after subscribing
+    """
+
+    def __init__(self, max_queued=MAX_QUEUED_EVENTS):
+        self.max_queued = max_queued
+        self._subscribers = defaultdict(set)
+
+    def publish(self, exec_id, event_type, **data):
+        event = dict(data, type=event_type)
+        for queue in self._subscribers.get(exec_id, ()):
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(event)
+
+    def num_subscribers(self, exec_id):
+        return len(self._subscribers.get(exec_id, ()))
+
+    @contextlib.contextmanager
+    def subscribe(self, exec_id):
+        '''
+        Returns a queue that receives the events of the execution, until the context is exited
+        '''
+        queue = asyncio.Queue(maxsize=self.max_queued)
+        self._subscribers[exec_id].add(queue)
+        try:
+            yield queue
+        finally:
+            self._subscribers[exec_id].discard(queue)
+            if not self._subscribers[exec_id]:
+                del self._subscribers[exec_id]
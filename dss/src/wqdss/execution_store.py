@@ -0,0 +1,316 @@
+import base64
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import urlparse
+
+from .model_execution import ModelExecutionPermutation
+
+logger = logging.getLogger()
+logger.setLevel(logging.DEBUG)
+
+# where executions and their runs are kept, so they outlive the API process
+EXECUTION_STORE = os.environ.get("WQDSS_EXECUTION_STORE", "sqlite:///executions/executions.db")
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS executions (
+    exec_id TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    model_name TEXT,
+    model_version TEXT,
+    start_time TEXT,
+    end_time TEXT,
+    result TEXT,
+    best TEXT,
+    updated_at REAL,
+    params TEXT
+);
+CREATE INDEX IF NOT EXISTS executions_page ON executions (start_time, exec_id);
+CREATE INDEX IF NOT EXISTS executions_updated_at ON executions (updated_at);
+CREATE INDEX IF NOT EXISTS executions_state ON executions (state);
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    exec_id TEXT NOT NULL,
+    iteration INTEGER NOT NULL,
+    permutation TEXT NOT NULL,
+    param_values TEXT,
+    score REAL,
+    artifact TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_exec_id ON runs (exec_id, iteration);
+'''
+
+# columns that were added to the executions table after it was created
+ADDED_COLUMNS = {
+    'updated_at': 'REAL',
+    'params': 'TEXT',
+}
+
+
+class InvalidCursorError(Exception):
+    def __init__(self, cursor):
+        self.cursor = cursor
+        super().__init__(f'invalid cursor {cursor}')
+
+
+class UnknownExecutionStoreError(Exception):
+    def __init__(self, uri):
+        self.uri = uri
+        super().__init__(f'execution store {uri} is not supported')
+
+
+def encode_cursor(start_time, exec_id):
+    return base64.urlsafe_b64encode(json.dumps([start_time, exec_id]).encode()).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        start_time, exec_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except Exception:
+        raise InvalidCursorError(cursor)
+    return start_time, exec_id
+
+
+def serialize_result(result):
+    '''
+    Converts the result of an execution (the best run of each iteration) to json
+    '''
+    if result is None:
+        return None
+    return json.dumps([dict(r, params=r['params'].as_dict()) if 'params' in r else r for r in result])
+
+
+def deserialize_result(result):
+    if result is None:
+        return None
+    return [dict(r, params=ModelExecutionPermutation.from_dict(r['params'])) if 'params' in r else r
+            for r in json.loads(result)]
+
+
+class ExecutionStore:
+    '''
+    Keeps executions, the runs they were made of and their scores
+    '''
+
+    def save_execution(self, execution):
+        '''
+        Stores the state and result of the execution, replacing what was stored for it before
+        '''
+        raise NotImplementedError()
+
+    def add_runs(self, exec_id, runs):
+        raise NotImplementedError()
+
+    def get_status(self, exec_id):
+        '''
+        Returns the state of the execution, raises KeyError if there is no such execution
+        '''
+        raise NotImplementedError()
+
+    def get_result(self, exec_id):
+        raise NotImplementedError()
+
+    def get_runs(self, exec_id):
+        raise NotImplementedError()
+
+    def get_execution(self, exec_id):
+        '''
+        Returns everything that is needed to resume the execution: its params, start time, model and result
+        '''
+        raise NotImplementedError()
+
+    def get_running_executions(self):
+        raise NotImplementedError()
+
+    def get_executions(self, limit=None, cursor=None, model_name=None, state=None, since=None):
+        '''
+        Returns a summary of the executions, with the best run that was found by each of them, ordered by
+        their start time. Executions can be filtered by model and state, or limited to those that were
+        updated after the timestamp `since`. When there are more than `limit` executions, a cursor for
+        the next page is returned along with them
+        '''
+        raise NotImplementedError()
+
+    def get_version(self):
+        '''
+        Returns a value that changes whenever an execution is added or updated
+        '''
+        raise NotImplementedError()
+
+
+class SqliteExecutionStore(ExecutionStore):
+    '''
+    Keeps executions in a SQLite database. The database is opened on first use
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            if self.path != ':memory:' and os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._migrate(self._conn)
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    def _migrate(self, conn):
+        columns = [row[1] for row in conn.execute('PRAGMA table_info(executions)')]
+        for column, column_type in ADDED_COLUMNS.items():
+            if columns and column not in columns:
+                conn.execute(f'ALTER TABLE executions ADD COLUMN {column} {column_type}')
+        if columns:
+            # executions that hadn't started were once stored with the start time 'None'
+            conn.execute("UPDATE executions SET start_time = NULL WHERE start_time = 'None'")
+
+    def save_execution(self, execution):
+        best = None
+        if execution.result:
+            best = json.loads(serialize_result(execution.result[-1:]))[0]
+        with self._lock, self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO executions (exec_id, state, model_name, model_version, start_time, end_time, '
+                'result, best, updated_at, params) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (execution.exec_id, execution.state.value, execution.model_name, execution.model_version,
+                 None if execution.start_time is None else str(execution.start_time),
+                 None if execution.end_time is None else str(execution.end_time),
+                 serialize_result(execution.result), None if best is None else json.dumps(best), time.time(),
+                 None if execution.params is None else json.dumps(execution.params)))
+
+    def add_runs(self, exec_id, runs):
+        with self._lock, self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [(run.run_id, exec_id, run.iteration, json.dumps(run.permutation.as_dict()),
+                  None if run.values is None else json.dumps(run.values), run.run_score, run.artifact)
+                 for run in runs])
+
+    def _get_execution_column(self, exec_id, column):
+        with self._lock:
+            row = self.conn.execute(f'SELECT {column} FROM executions WHERE exec_id = ?', (exec_id,)).fetchone()
+        if row is None:
+            raise KeyError(exec_id)
+        return row[0]
+
+    def get_status(self, exec_id):
+        return self._get_execution_column(exec_id, 'state')
+
+    def get_result(self, exec_id):
+        return deserialize_result(self._get_execution_column(exec_id, 'result'))
+
+    def get_runs(self, exec_id):
+        with self._lock:
+            rows = self.conn.execute(
+                'SELECT run_id, iteration, permutation, param_values, score, artifact FROM runs '
+                'WHERE exec_id = ? ORDER BY iteration', (exec_id,)).fetchall()
+        return [{
+            'run_id': run_id,
+            'iteration': iteration,
+            'params': json.loads(permutation),
+            'values': None if values is None else json.loads(values),
+            'score': score,
+            'artifact': artifact
+        } for run_id, iteration, permutation, values, score, artifact in rows]
+
+    def get_execution(self, exec_id):
+        with self._lock:
+            row = self.conn.execute(
+                'SELECT params, start_time, model_name, model_version, result FROM executions WHERE exec_id = ?',
+                (exec_id,)).fetchone()
+        if row is None:
+            raise KeyError(exec_id)
+
+        params, start_time, model_name, model_version, result = row
+        return {
+            'params': None if params is None else json.loads(params),
+            'start_time': start_time,
+            'model_name': model_name,
+            'model_version': model_version,
+            'result': deserialize_result(result)
+        }
+
+    def get_running_executions(self):
+        with self._lock:
+            rows = self.conn.execute("SELECT exec_id FROM executions WHERE state = 'RUNNING'").fetchall()
+        return [exec_id for exec_id, in rows]
+
+    def get_executions(self, limit=None, cursor=None, model_name=None, state=None, since=None):
+        conditions, args = [], []
+        if cursor is not None:
+            start_time, exec_id = decode_cursor(cursor)
+            if start_time is None:
+                # executions that haven't started come first
+                conditions.append('(start_time IS NULL AND exec_id > ?) OR start_time IS NOT NULL')
+                args.append(exec_id)
+            else:
+                conditions.append('(start_time, exec_id) > (?, ?)')
+                args.extend([start_time, exec_id])
+        if model_name is not None:
+            conditions.append('model_name = ?')
+            args.append(model_name)
+        if state is not None:
+            conditions.append('state = ?')
+            args.append(state)
+        if since is not None:
+            conditions.append('updated_at > ?')
+            args.append(float(since))
+
+        query = 'SELECT exec_id, state, model_name, start_time, best, updated_at FROM executions'
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(f'({c})' for c in conditions)
+        query += ' ORDER BY start_time, exec_id'
+        if limit is not None:
+            # one more execution is fetched, to know if there is a next page
+            query += ' LIMIT ?'
+            args.append(int(limit) + 1)
+
+        with self._lock:
+            rows = self.conn.execute(query, args).fetchall()
+
+        next_cursor = None
+        if limit is not None and len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1][3], rows[-1][0])
+
+        return [{
+            'id': exec_id,
+            'state': state,
+            'model_name': model_name,
+            'start_time': start_time,
+            'updated_at': updated_at,
+            'result': None if best is None else json.loads(best)
+        } for exec_id, state, model_name, start_time, best, updated_at in rows], next_cursor
+
+    def get_version(self):
+        with self._lock:
+            count, updated_at = self.conn.execute('SELECT COUNT(*), MAX(updated_at) FROM executions').fetchone()
+        return f'{count}-{updated_at}'
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+EXECUTION_STORES = {
+    "sqlite": lambda uri: SqliteExecutionStore(uri.path or ':memory:'),
+}
+
+
+def get_execution_store(uri=None):
+    '''
+    Returns the execution store configured by uri (WQDSS_EXECUTION_STORE by default)
+    '''
+    uri = EXECUTION_STORE if uri is None else uri
+    parsed = urlparse(uri)
+    try:
+        return EXECUTION_STORES[parsed.scheme or "sqlite"](parsed)
+    except KeyError:
+        raise UnknownExecutionStoreError(uri)
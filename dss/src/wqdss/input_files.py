@@ -0,0 +1,243 @@
+import os
+import tempfile
+
+import numpy as np
+
+# CE-QUAL-W2 input files start with a title line and a blank line, followed by the column names
+HEADER_LINES = 2
+
+# the width of each field in the fixed-width (.npt) input format
+NPT_FIELD_WIDTH = 8
+
+# W2 input files are ASCII, latin-1 maps every byte to a character so lines are written back unchanged
+ENCODING = 'latin-1'
+
+
+class InputColumnNotFoundError(Exception):
+    def __init__(self, input_file, column):
+        self.input_file = input_file
+        self.column = column
+        super().__init__(f'column {column} not found in input file {input_file}')
+
+
+def is_fixed_width(input_file):
+    return os.path.splitext(input_file)[1].lower() == '.npt'
+
+
+def _line_body(line):
+    return line.rstrip('\r\n')
+
+
+def _csv_column_index(header, column, input_file):
+    names = [name.strip() for name in _line_body(header).split(',')]
+    try:
+        return names.index(column)
+    except ValueError:
+        raise InputColumnNotFoundError(input_file, column)
+
+
+def _npt_column_index(header, column, input_file):
+    body = _line_body(header)
+    names = [body[i: i + NPT_FIELD_WIDTH].strip() for i in range(0, len(body), NPT_FIELD_WIDTH)]
+    try:
+        return names.index(column)
+    except ValueError:
+        raise InputColumnNotFoundError(input_file, column)
+
+
+def format_fixed_width(value, decimals, width=NPT_FIELD_WIDTH):
+    '''
+    Formats value right-aligned in a field of the given width, dropping decimals if it doesn't fit
+    '''
+    for d in range(decimals, -1, -1):
+        formatted = f'{value:{width}.{d}f}'
+        if len(formatted) <= width:
+            return formatted
+
+    raise ValueError(f'value {value} does not fit in a field of width {width}')
+
+
+def _field_decimals(field):
+    field = field.strip()
+    return len(field) - field.index('.') - 1 if '.' in field else 0
+
+
+def patch_csv_lines(lines, column_index, value):
+    '''
+    Yields the lines with the field at column_index replaced by value. Fields before the column are
+    located once per line, and the remainder of the line (including its terminator) is copied as is
+    '''
+    for line in lines:
+        fields = line.split(',', column_index + 1)
+        if len(fields) <= column_index or not _line_body(line):
+            yield line
+            continue
+
+        if len(fields) == column_index + 1:
+            # the column is the last one in the line, keep the original line terminator
+            body = fields[column_index]
+            fields[column_index] = value + body[len(_line_body(body)):]
+        else:
+            fields[column_index] = value
+        yield ','.join(fields)
+
+
+def patch_npt_lines(lines, column_index, value):
+    '''
+    Yields the lines with the fixed-width field at column_index replaced by value, keeping the precision
+    of the first data row
+    '''
+    start = column_index * NPT_FIELD_WIDTH
+    end = start + NPT_FIELD_WIDTH
+    formatted = None
+    for line in lines:
+        if len(_line_body(line)) <= start:
+            yield line
+            continue
+
+        if formatted is None:
+            formatted = format_fixed_width(value, _field_decimals(line[start:end]))
+        yield line[:start] + formatted + line[end:]
+
+
+def index_lines(contents, input_file=''):
+    '''
+    Returns the offsets of the lines of the data rows of the input file in its contents, as an int32 array
+    of the start of every data row followed by the end of the file. The index is computed without splitting
+    the file in Python, and it's enough to locate the fields of any column with csv_field_spans or npt_field_spans
+    '''
+    contents = np.asarray(contents, dtype=np.uint8)
+    # lines end with \n, \r\n or \r, the same as the universal newlines that patch_input_file reads
+    newline, carriage_return = contents == ord('\n'), contents == ord('\r')
+    lone_carriage_return = carriage_return & ~np.append(newline[1:], False)
+    line_ends = np.flatnonzero(newline | lone_carriage_return) + 1
+    line_starts = np.concatenate(([0], line_ends[line_ends < len(contents)], [len(contents)]))
+    if len(line_starts) - 1 <= HEADER_LINES + (len(contents) == 0):
+        raise ValueError(f'input file {input_file} has no header')
+    return line_starts[HEADER_LINES + 1:].astype(np.int32)
+
+
+def _body_ends(contents, line_index):
+    starts, ends = line_index[:-1].astype(np.int64), line_index[1:].astype(np.int64)
+    last, before_last = contents[np.maximum(ends - 1, 0)], contents[np.maximum(ends - 2, 0)]
+    terminated = (ends > starts) & ((last == ord('\n')) | (last == ord('\r')))
+    crlf = terminated & (last == ord('\n')) & (ends - 2 >= starts) & (before_last == ord('\r'))
+    return starts, ends, ends - terminated - crlf
+
+
+def csv_field_spans(contents, line_index, column_index):
+    '''
+    Returns the start and end offsets of the field at column_index of the data rows of a csv input file,
+    as an array of shape (rows, 2), for the rows whose field is replaced by patch_csv_lines
+    '''
+    starts, _, body_ends = _body_ends(contents, line_index)
+    commas = np.flatnonzero(contents[line_index[0]:] == ord(',')) + int(line_index[0])
+    comma_rows = np.searchsorted(starts, commas, side='right') - 1
+    commas_per_row = np.bincount(comma_rows, minlength=len(starts))
+    first_commas = np.concatenate(([0], np.cumsum(commas_per_row)[:-1])).astype(np.int64)
+
+    rows = np.flatnonzero((commas_per_row >= column_index) & (body_ends > starts))
+    if column_index == 0:
+        field_starts = starts[rows]
+    else:
+        field_starts = commas[first_commas[rows] + column_index - 1] + 1
+    # the field ends at the next comma, or at the end of the line if it's the last field
+    field_ends = body_ends[rows]
+    has_next_comma = commas_per_row[rows] > column_index
+    field_ends[has_next_comma] = commas[first_commas[rows[has_next_comma]] + column_index]
+    return np.stack([field_starts, field_ends], axis=1)
+
+
+def npt_field_spans(contents, line_index, column_index):
+    '''
+    Returns the start and end offsets of the fixed-width field at column_index of the data rows of an npt
+    input file, as an array of shape (rows, 2), for the rows whose field is replaced by patch_npt_lines
+    '''
+    starts, ends, body_ends = _body_ends(contents, line_index)
+    offset = column_index * NPT_FIELD_WIDTH
+    rows = body_ends - starts > offset
+    field_starts = starts[rows] + offset
+    return np.stack([field_starts, np.minimum(field_starts + NPT_FIELD_WIDTH, ends[rows])], axis=1)
+
+
+def patch_indexed(contents, spans, value):
+    '''
+    Returns the contents with the byte ranges of the spans replaced by value
+    '''
+    starts, ends = spans[:, 0], spans[:, 1]
+    if len(starts) == 0:
+        return contents.tobytes()
+
+    value = np.frombuffer(value.encode(ENCODING), dtype=np.uint8)
+    if np.all(ends - starts == len(value)):
+        # fields of a fixed width are overwritten in place
+        patched = np.array(contents)
+        patched[starts[:, None] + np.arange(len(value))] = value
+        return patched.tobytes()
+
+    removed = np.zeros(len(contents) + 1, dtype=np.int64)
+    np.add.at(removed, starts, 1)
+    np.add.at(removed, ends, -1)
+    kept = contents[np.cumsum(removed[:-1]) == 0]
+    positions = starts - np.concatenate(([0], np.cumsum(ends - starts)[:-1]))
+    return np.insert(kept, np.repeat(positions, len(value)), np.tile(value, len(starts))).tobytes()
+
+
+def map_file(path):
+    '''
+    Returns the contents of the file as a read-only memory-mapped array of bytes
+    '''
+    # an empty file can't be mapped
+    return np.memmap(path, dtype=np.uint8, mode='r') if os.path.getsize(path) else np.zeros(0, np.uint8)
+
+
+def _write_atomically(destination, write):
+    # write to a temporary file in the same directory, so the source can be replaced atomically
+    fd, tmp_path = tempfile.mkstemp(prefix='.wqdss-input', dir=os.path.dirname(os.path.abspath(destination)))
+    try:
+        with open(fd, 'wb') as ofile:
+            write(ofile)
+        os.replace(tmp_path, destination)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def patch_input_file(source, destination, column, value, line_index=None):
+    '''
+    Streams the input file at source to destination, overwriting the value of column in every data row.
+    Supports both the csv and the fixed-width npt formats, all other content is kept byte for byte.
+    With the line index of the source (see index_lines), the fields of the column are located and replaced
+    with vectorised operations instead of parsing every row. source and destination may be the same file
+    '''
+    with open(source, 'r', encoding=ENCODING, newline='') as ifile:
+        header = [ifile.readline() for _ in range(HEADER_LINES + 1)]
+        if is_fixed_width(source):
+            column_index = _npt_column_index(header[-1], column, source)
+        else:
+            column_index = _csv_column_index(header[-1], column, source)
+
+        if line_index is not None:
+            contents = map_file(source)
+            if is_fixed_width(source):
+                spans = npt_field_spans(contents, line_index, column_index)
+                if len(spans):
+                    first_field = contents[spans[0, 0]:spans[0, 1]].tobytes().decode(ENCODING)
+                    value = format_fixed_width(value, _field_decimals(first_field))
+            else:
+                spans = csv_field_spans(contents, line_index, column_index)
+            patched = patch_indexed(contents, spans, str(value))
+            _write_atomically(destination, lambda ofile: ofile.write(patched))
+            return
+
+        if is_fixed_width(source):
+            data_lines = patch_npt_lines(ifile, column_index, value)
+        else:
+            data_lines = patch_csv_lines(ifile, column_index, str(value))
+
+        def write(ofile):
+            ofile.write(''.join(header).encode(ENCODING))
+            for line in data_lines:
+                ofile.write(line.encode(ENCODING))
+
+        _write_atomically(destination, write)
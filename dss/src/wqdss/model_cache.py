@@ -0,0 +1,106 @@
+from collections import OrderedDict
+import logging
+import os
+import threading
+
+logger = logging.getLogger()
+logger.setLevel(logging.DEBUG)
+
+MODEL_CACHE_SIZE = int(os.environ.get("WQDSS_MODEL_CACHE_SIZE_MB", "512")) * 1024 * 1024
+
+
+class ModelCache:
+    """
+    A size-bounded LRU cache of model archives, which lives for the lifetime of the worker process.
+    Entries are keyed by the model name and the version reported by the registry,
+    so an updated model is fetched again while an unchanged model is served from memory.
+    The registry is asked for the archive only if it isn't the cached version, so a single request
+    checks that a cached model is current, and fetches a model that isn't. Executions pin the version of
+    their model, so several versions of a model may be in use at once, and they're all cached.
+    A version never changes, so a cached version that is asked for explicitly is served without a request
+    """
+
+    def __init__(self, registry_client, max_size=MODEL_CACHE_SIZE):
+        self.registry_client = registry_client
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._models = OrderedDict()
+        # the version of each model that the registry last reported as its current version
+        self._current = {}
+        self._lock = threading.Lock()
+
+    def get_model_by_name(self, model_name):
+        return self.get_model(model_name)[1]
+
+    def get_model(self, model_name, version=None):
+        '''
+        Returns a tuple of the version of the model, and the contents of its archive.
+        The current version of the model is returned, unless a version is given
+        '''
+        with self._lock:
+            if (model_name, version) in self._models:
+                return self._hit((model_name, version))
+            current = self._current.get(model_name)
+            cached_version = current if version is None and (model_name, current) in self._models else None
+
+        requested_version = version
+        version, model_contents = self.registry_client.get_model(model_name, cached_version, version)
+        key = (model_name, version)
+        if requested_version is None:
+            with self._lock:
+                self._current[model_name] = version
+        if model_contents is None:
+            with self._lock:
+                if key in self._models:
+                    return self._hit(key)
+
+            # the model was evicted while the registry was asked for it
+            version, model_contents = self.registry_client.get_model(model_name, version=version)
+            key = (model_name, version)
+
+        with self._lock:
+            self.misses += 1
+        logger.info(f"model cache miss for {model_name}@{version}, fetched from registry")
+        self._add(key, model_contents)
+        return version, model_contents
+
+    def _hit(self, key):
+        self.hits += 1
+        self._models.move_to_end(key)
+        logger.info(f"model cache hit for {key[0]}@{key[1]} ({self.stats()})")
+        return key[1], self._models[key]
+
+    def _add(self, key, model_contents):
+        if len(model_contents) > self.max_size:
+            logger.warning(f"model {key[0]} is larger than the cache, not caching it")
+            return
+
+        with self._lock:
+            if key in self._models:
+                return
+
+            while self._models and self.size + len(model_contents) > self.max_size:
+                self._evict(next(iter(self._models)))
+
+            self._models[key] = model_contents
+            self.size += len(model_contents)
+
+    def _evict(self, key):
+        logger.info(f"evicting model {key[0]}@{key[1]} from cache")
+        self.size -= len(self._models.pop(key))
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+            self.size = 0
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "models": len(self._models),
+            "size": self.size,
+            "max_size": self.max_size
+        }
@@ -1,27 +1,54 @@
 import asyncio
-import csv
+from collections import Counter, OrderedDict
+import contextlib
+import fcntl
+import fnmatch
+import functools
 from io import BytesIO, StringIO
 import logging
 import os
+import shutil
+import stat
 import subprocess
 import tempfile
+import threading
 import zipfile
 
+from .input_files import index_lines, map_file, patch_input_file
+
 MODEL_EXE = os.environ.get("WQDSS_MODEL_EXE", "/dss-bin/w2_exe_linux_par")
 DEFAULT_MODEL = "default"
 
+# "extract" unzips the whole model for every run, "template" links run directories to a pre-extracted model
+RUN_DIR_MODE = os.environ.get("WQDSS_RUN_DIR_MODE", "extract")
+TEMPLATES_DIR = os.environ.get("WQDSS_TEMPLATES_DIR", os.path.join(tempfile.gettempdir(), "wqdss-templates"))
+
+# the data files that the model only reads (bathymetry, meteorology and bypass), which run directories share
+# with the template as hardlinks. Every other file may be rewritten by the model, so it's cloned or copied
+LINKED_FILES = os.environ.get("WQDSS_TEMPLATE_LINKED_FILES", "bth*,bath*,met*,byp*").split(',')
+
+# the extracted templates of a worker are kept up to this size, in bytes of the files of the models
+TEMPLATES_SIZE = int(os.environ.get("WQDSS_TEMPLATES_SIZE_MB", "4096")) * 1024 * 1024
+
+# the number of input files of templates whose line indexes are kept in memory
+INPUT_INDEX_CACHE_SIZE = int(os.environ.get("WQDSS_INPUT_INDEX_CACHE_SIZE", "256"))
+
+# ioctl request number for cloning a file's extents (copy-on-write) on filesystems that support it
+FICLONE = 0x40049409
+
 logger = logging.getLogger()
 logger.setLevel(logging.DEBUG)
 
 
-def prepare_run_dir(param_values, model_contents):
+def prepare_run_dir(param_values, model_contents, run_dir=None):
     '''
-    Populates a temporary directory with the model files,
+    Populates a temporary directory (or the given empty run_dir) with the model files,
     along with inputs provided by the user
     '''
 
-    run_dir = tempfile.mkdtemp(prefix=f'wqdss-exec')
-    os.rmdir(run_dir)
+    if run_dir is None:
+        run_dir = tempfile.mkdtemp(prefix=f'wqdss-exec')
+        os.rmdir(run_dir)
 
     logger.info("going to get model by name")
     model_zip = zipfile.ZipFile(BytesIO(model_contents))
@@ -30,23 +57,211 @@ def prepare_run_dir(param_values, model_contents):
     return run_dir
 
 
-def update_inputs_for_run(run_dir, input_values):
-    # for each file in params that should be updated:
-    input_files = input_values.files
-    for i in input_files:
-        # read the first contents of the input
-        with open(os.path.join(run_dir, i), 'r') as ifile:
-            contents = ifile.readlines()
+def prepare_run_dir_from_template(param_values, template_dir, output_file=None, run_dir=None):
+    '''
+    Populates a temporary directory (or the given empty run_dir) from the files of an extracted model template.
+    The read-only data files of the model are hardlinked, other files are cloned or copied since the model may
+    write to them (the template isn't protected by its permissions from a worker that runs as root).
+    The input files that are updated for the run, and the output file, are written into the run directory
+    '''
+
+    if run_dir is None:
+        run_dir = tempfile.mkdtemp(prefix=f'wqdss-exec')
+    materialized = set(os.path.normpath(f) for f in param_values.files)
+    if output_file is not None:
+        materialized.add(os.path.normpath(output_file))
+
+    for root, dirs, files in os.walk(template_dir):
+        rel_root = os.path.relpath(root, template_dir)
+        for d in dirs:
+            # a reused run directory may already have the directories of the model
+            os.makedirs(os.path.join(run_dir, rel_root, d), exist_ok=True)
+        for f in files:
+            rel_path = os.path.normpath(os.path.join(rel_root, f))
+            if rel_path in materialized:
+                continue
+            if is_linked_file(rel_path):
+                link_file(os.path.join(template_dir, rel_path), os.path.join(run_dir, rel_path))
+            else:
+                clone_file(os.path.join(template_dir, rel_path), os.path.join(run_dir, rel_path))
+
+    update_inputs_for_run(run_dir, param_values, source_dir=template_dir)
+    return run_dir
+
+
+def is_linked_file(path, linked_files=None):
+    name = os.path.basename(path).lower()
+    return any(fnmatch.fnmatch(name, pattern.strip().lower()) for pattern in linked_files or LINKED_FILES)
+
+
+def link_file(src, dst):
+    '''
+    Creates dst as a hardlink to src, falling back to a clone when the files are on different devices,
+    or the filesystem doesn't support hardlinks
+    '''
+    try:
+        os.link(src, dst)
+        return
+    except OSError:
+        pass
+
+    clone_file(src, dst)
+
+
+def clone_file(src, dst):
+    '''
+    Creates dst as a reflink (copy-on-write clone) of src, falling back to a full copy when the filesystem
+    doesn't support reflinks. Writing to dst never changes src
+    '''
+    with open(src, 'rb') as src_file, open(dst, 'wb') as dst_file:
+        try:
+            fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+            return
+        except OSError:
+            shutil.copyfileobj(src_file, dst_file)
+
+
+class ModelTemplates:
+    '''
+    Read-only extracted copies of models, keyed by model name and version,
+    from which run directories are created via prepare_run_dir_from_template.
+    Executions pin the version of their model, so several versions of a model may be in use at once.
+    The templates are kept up to max_size bytes, the least recently used ones are removed first,
+    but never while a run directory is being created from them, by any of the worker processes sharing base_dir
+    '''
+
+    def __init__(self, base_dir=TEMPLATES_DIR, max_size=TEMPLATES_SIZE):
+        self.base_dir = base_dir
+        self.max_size = max_size
+        self.size = 0
+        self._templates = OrderedDict()
+        self._sizes = {}
+        self._in_use = Counter()
+        # the tasks of a worker run in threads, which may ask for a template at the same time
+        self._lock = threading.Lock()
+
+    def get_template(self, model_name, version, model_contents):
+        key = (model_name, version)
+        with self._lock:
+            if key in self._templates and not os.path.isdir(self._templates[key]):
+                # removed by another worker process
+                del self._templates[key]
+                self.size -= self._sizes.pop(key)
+            if key not in self._templates:
+                self._templates[key] = self._extract(model_name, version, model_contents)
+                self._sizes[key] = sum(i.file_size for i in zipfile.ZipFile(BytesIO(model_contents)).infolist())
+                self.size += self._sizes[key]
+                self._remove_unused_templates()
+            self._templates.move_to_end(key)
+            return self._templates[key]
+
+    @contextlib.contextmanager
+    def use(self, model_name, version, model_contents):
+        '''
+        Provides the template of the version of the model, which isn't removed until the block exits
+        '''
+        key = (model_name, version)
+        with self._lock:
+            self._in_use[key] += 1
+        try:
+            # the shared lock keeps other worker processes from removing the template
+            with self._file_lock(model_name, version, fcntl.LOCK_SH):
+                yield self.get_template(model_name, version, model_contents)
+        finally:
+            with self._lock:
+                self._in_use[key] -= 1
+                if not self._in_use[key]:
+                    del self._in_use[key]
+
+    def _template_dir(self, model_name, version):
+        return os.path.join(self.base_dir, model_name, version)
+
+    @contextlib.contextmanager
+    def _file_lock(self, model_name, version, operation):
+        '''
+        Locks the template of the version of the model with flock, yields whether the lock was taken.
+        The lock file is never removed, so every process locks the same file
+        '''
+        lock_path = f'{self._template_dir(model_name, version)}.lock'
+        os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+        with open(lock_path, 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file, operation)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
 
-        # copy 2 header lines, and for the rest update the contents of the QWD value
-        reader = csv.DictReader(contents[2:])
-        with open(os.path.join(run_dir, i), 'w') as ofile:
-            ofile.writelines(contents[:2])
-            writer = csv.DictWriter(ofile, reader.fieldnames)
-            out_param = input_values.columns[i]
-            for row in reader:
-                row[out_param] = input_values.values[i]
-                writer.writerow(row)
+    def _extract(self, model_name, version, model_contents):
+        template_dir = self._template_dir(model_name, version)
+        if os.path.isdir(template_dir):
+            # already extracted by another worker process
+            return template_dir
+
+        os.makedirs(os.path.dirname(template_dir), exist_ok=True)
+
+        # extract to a private directory and rename it, so a partially extracted template is never used
+        staging_dir = tempfile.mkdtemp(prefix=f'.{version}-', dir=os.path.dirname(template_dir))
+        logger.info(f"extracting template for model {model_name}@{version} into {template_dir}")
+        zipfile.ZipFile(BytesIO(model_contents)).extractall(staging_dir)
+        for root, _, files in os.walk(staging_dir):
+            for f in files:
+                path = os.path.join(root, f)
+                os.chmod(path, os.stat(path).st_mode & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+
+        try:
+            os.rename(staging_dir, template_dir)
+        except OSError:
+            # lost the race against another worker process, use its template
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+        return template_dir
+
+    def _remove_unused_templates(self):
+        # run directories hold their own links and copies of the template files, so once a run directory
+        # is created, removing its template is safe
+        for key in list(self._templates):
+            if self.size <= self.max_size:
+                return
+            if key in self._in_use or key == next(reversed(self._templates)):
+                continue
+            with self._file_lock(*key, fcntl.LOCK_EX | fcntl.LOCK_NB) as locked:
+                if not locked:
+                    # another worker process is creating a run directory from it
+                    continue
+                logger.info(f"removing template for model {key[0]}@{key[1]}")
+                template_dir = self._templates.pop(key)
+                self.size -= self._sizes.pop(key)
+                # move it away while locked, so the other processes either find the whole template or none of it
+                removed_dir = tempfile.mkdtemp(prefix=f'.{key[1]}-removed-', dir=os.path.dirname(template_dir))
+                try:
+                    os.rename(template_dir, os.path.join(removed_dir, key[1]))
+                except FileNotFoundError:
+                    # already removed by another worker process
+                    pass
+            shutil.rmtree(removed_dir, ignore_errors=True)
+
+
+def update_inputs_for_run(run_dir, input_values, source_dir=None):
+    # for each file in params that should be updated, overwrite the column with the run's value
+    for i in input_values.files:
+        source = os.path.join(source_dir or run_dir, i)
+        # the files of a template never change, so their lines are only indexed by the first run that updates them
+        line_index = template_line_index(source) if source_dir is not None else None
+        patch_input_file(source, os.path.join(run_dir, i), input_values.columns[i], input_values.values[i],
+                         line_index)
+
+
+@functools.lru_cache(maxsize=INPUT_INDEX_CACHE_SIZE)
+def template_line_index(path):
+    try:
+        return index_lines(map_file(path), path)
+    except ValueError:
+        # a file without a header is streamed, which reports the missing column
+        return None
 
 
 async def exec_model_async(run_dir):
@@ -58,7 +273,13 @@ async def exec_model_async(run_dir):
     logger.info(f'Finished executing {process}')
 
 
-def exec_model(run_dir):
+def exec_model(run_dir, process_pool=None):
+    if process_pool is not None:
+        # the pool pins the process to a cpu of its own, and limits its memory
+        process_pool.run([MODEL_EXE, run_dir])
+        logger.info(f'Finished executing {MODEL_EXE} in {run_dir}')
+        return
+
     process = subprocess.Popen([MODEL_EXE, run_dir], stdin=subprocess.DEVNULL,
                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
     logger.info(f'going to execute process {process}')
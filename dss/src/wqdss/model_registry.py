@@ -1,16 +1,52 @@
+from concurrent.futures import ThreadPoolExecutor, wait
+from enum import Enum
 from io import BytesIO
+import hashlib
+import json
 import logging
 import pathlib
 import os
-import shutil
+import tempfile
+import threading
+import time
 import zipfile
 
 import requests
 
+from .blobs import blob_digest, BlobStore
+
+# the index of the models: the current version of each model, its size and its files
 MODELS = {}
 BASE_MODEL_DIR = os.environ.get("WQDSS_BASE_MODEL_DIR", "/models")
 MODEL_REGISTRY_SERVICE = os.environ.get("MODEL_REGISTRY_SERVICE", "model-registry")
 
+# the files of all models are stored once by their digest, and each version of a model is a manifest of its files
+BLOBS_DIR = ".blobs"
+MANIFESTS_DIR = ".manifests"
+ARCHIVES_DIR = ".archives"
+CURRENT_VERSION = "current"
+INDEX_FILE = ".index.json"
+
+# the number of threads that import model directories and build model archives in the background
+REGISTRY_WORKERS = int(os.environ.get("WQDSS_REGISTRY_WORKERS", "2"))
+
+# model archives are streamed from disk in chunks of this size
+ARCHIVE_CHUNK_SIZE = int(os.environ.get("WQDSS_ARCHIVE_CHUNK_SIZE_KB", "256")) * 1024
+
+# the number of times a client resumes the download of a model archive that was interrupted
+DOWNLOAD_RETRIES = int(os.environ.get("WQDSS_MODEL_DOWNLOAD_RETRIES", "3"))
+
+# the blobs that workers fetched from the registry, so only the blobs that changed are fetched for a new version
+MODEL_BLOB_CACHE_DIR = os.environ.get("WQDSS_MODEL_BLOB_CACHE_DIR",
+                                      os.path.join(tempfile.gettempdir(), "wqdss-model-blobs"))
+
+REGISTRY_LOCK = threading.RLock()
+REGISTRY_EXECUTOR = None
+
+# the background imports of model directories, and the background builds of model archives by version
+MODEL_IMPORTS = {}
+ARCHIVE_BUILDS = {}
+
 logger = logging.getLogger()
 logger.setLevel(logging.DEBUG)
 
@@ -21,26 +57,321 @@ class ModelNotFoundError(Exception):
         super().__init__(f'model_name id: {model_name} not registered')
 
 
+class ModelState(Enum):
+    IMPORTING = 'IMPORTING'
+    ARCHIVING = 'ARCHIVING'
+    READY = 'READY'
+    FAILED = 'FAILED'
+
+
+class ModelNotReadyError(Exception):
+    def __init__(self, model_name):
+        self.model_name = model_name
+        super().__init__(f'model {model_name} is still being imported')
+
+
+class ModelVersionNotFoundError(ModelNotFoundError):
+    def __init__(self, model_name, version):
+        self.model_name = model_name
+        self.version = version
+        Exception.__init__(self, f'version {version} of model {model_name} not registered')
+
+
+class MissingBlobsError(Exception):
+    def __init__(self, missing):
+        self.missing = missing
+        super().__init__(f'{len(missing)} blobs of the model were not uploaded')
+
+
+class InvalidManifestError(Exception):
+    pass
+
+
+class InvalidRangeError(Exception):
+    def __init__(self, range_header, size):
+        self.range_header = range_header
+        self.size = size
+        super().__init__(f'range {range_header} is not satisfiable for {size} bytes')
+
+
+def blob_store():
+    return BlobStore(os.path.join(BASE_MODEL_DIR, BLOBS_DIR))
+
+
+def _manifest_dir(model_name):
+    return os.path.join(BASE_MODEL_DIR, MANIFESTS_DIR, model_name)
+
+
+def _write_file(path, contents):
+    '''
+    Writes the file next to its destination, and renames it into place once it's complete
+    '''
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, 'wb') as f:
+        f.write(contents)
+    os.replace(tmp_path, path)
+
+
+def _read_current_version(model_name):
+    try:
+        with open(os.path.join(_manifest_dir(model_name), CURRENT_VERSION)) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def _executor():
+    global REGISTRY_EXECUTOR
+    with REGISTRY_LOCK:
+        if REGISTRY_EXECUTOR is None:
+            REGISTRY_EXECUTOR = ThreadPoolExecutor(REGISTRY_WORKERS, thread_name_prefix="wqdss-registry")
+        return REGISTRY_EXECUTOR
+
+
+def _index_entry(manifest):
+    return {'version': manifest['version'], 'size': sum(f['size'] for f in manifest['files']),
+            'files': [f['path'] for f in manifest['files']]}
+
+
+def _save_index():
+    with REGISTRY_LOCK:
+        _write_file(os.path.join(BASE_MODEL_DIR, INDEX_FILE), json.dumps(MODELS).encode())
+
+
+def _rebuild_index():
+    '''
+    Returns the index of the models from their manifests, for a registry that doesn't have an index yet
+    '''
+    index = {}
+    manifests_dir = os.path.join(BASE_MODEL_DIR, MANIFESTS_DIR)
+    if os.path.isdir(manifests_dir):
+        for model in os.listdir(manifests_dir):
+            version = _read_current_version(model)
+            if version is not None:
+                with open(os.path.join(_manifest_dir(model), f"{version}.json")) as f:
+                    index[model] = _index_entry(json.load(f))
+    return index
+
+
 def load_models():
     '''
-    Populate the models DB, currently by walking the models directory
+    Populate the models DB from the index of the models. Models that were added as directories of files
+    are imported as a first version, and the archives of the models are built, in the background
     '''
+    try:
+        with open(os.path.join(BASE_MODEL_DIR, INDEX_FILE)) as f:
+            MODELS.update(json.load(f))
+    except FileNotFoundError:
+        logger.info("there is no index of the models, going to build it from their manifests")
+        MODELS.update(_rebuild_index())
+        _save_index()
 
-    models = next(os.walk(BASE_MODEL_DIR))[1]
+    models = [m for m in next(os.walk(BASE_MODEL_DIR))[1] if not m.startswith('.')]
     for model in models:
-        logger.info(f"Loading model {model}")
-        MODELS[model] = os.path.join(BASE_MODEL_DIR, model)
-        if not os.path.exists(f"{MODELS[model]}.zip"):
-            # if the zip archive doesn't exist - create it
-            shutil.make_archive(MODELS[model], "zip", MODELS[model])
+        if model not in MODELS and model not in MODEL_IMPORTS:
+            logger.info(f"going to import model {model} from its directory")
+            MODEL_IMPORTS[model] = _executor().submit(add_model_dir, model, os.path.join(BASE_MODEL_DIR, model))
 
+    for model in list(MODELS):
+        _schedule_archive(model, MODELS[model]['version'])
+    logger.info(f"loaded {len(MODELS)} models, importing {len(MODEL_IMPORTS)} models")
 
-def get_model_by_name(model_name):
+
+def wait_for_models(timeout=None):
+    '''
+    Waits until there are no background imports of models or builds of archives, an import of a model
+    starts the build of its archive once it completes
+    '''
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        with REGISTRY_LOCK:
+            pending = [f for f in list(MODEL_IMPORTS.values()) + list(ARCHIVE_BUILDS.values()) if not f.done()]
+        if not pending:
+            return
+        wait(pending, None if deadline is None else max(0.0, deadline - time.monotonic()))
+        if deadline is not None and time.monotonic() >= deadline:
+            return
+
+
+def get_model_status(model_name):
+    '''
+    Returns the readiness of the model: IMPORTING while its directory is imported, ARCHIVING while the
+    archive of its current version is built (its manifest and files can already be fetched), READY or FAILED
+    '''
+    model_import = MODEL_IMPORTS.get(model_name)
+    if model_name not in MODELS:
+        if model_import is None:
+            raise ModelNotFoundError(model_name)
+        if model_import.done() and model_import.exception() is not None:
+            return {'model_name': model_name, 'state': ModelState.FAILED.value,
+                    'error': str(model_import.exception())}
+        return {'model_name': model_name, 'state': ModelState.IMPORTING.value}
+
+    entry = MODELS[model_name]
+    status = {'model_name': model_name, 'version': entry['version'], 'size': entry['size'],
+              'files': len(entry['files']), 'state': ModelState.READY.value}
+    build = ARCHIVE_BUILDS.get(entry['version'])
+    if build is not None and not build.done():
+        status['state'] = ModelState.ARCHIVING.value
+    elif build is not None and build.exception() is not None:
+        status['state'] = ModelState.FAILED.value
+        status['error'] = str(build.exception())
+    return status
+
+
+def manifest_version(files):
+    '''
+    The version of a model is the digest of its file names and the digests of their contents
+    '''
+    entries = sorted((f['path'], f['digest']) for f in files)
+    return hashlib.sha256(json.dumps(entries).encode()).hexdigest()
+
+
+def _validate_path(path):
+    parts = pathlib.PurePosixPath(path).parts
+    if not parts or path.startswith('/') or '..' in parts:
+        raise InvalidManifestError(f'invalid file path {path}')
+
+
+def save_manifest(model_name, files):
+    '''
+    Adds a version of the model with the files, given as a dict of path to the digest of the contents.
+    All of the blobs must already be stored. The version becomes the current version of the model
+    '''
+    store = blob_store()
+    missing = sorted(set(digest for digest in files.values() if not store.has(digest)))
+    if missing:
+        raise MissingBlobsError(missing)
+
+    for path in files:
+        _validate_path(path)
+    manifest_files = [{'path': path, 'digest': digest, 'size': store.size(digest)}
+                      for path, digest in sorted(files.items())]
+    version = manifest_version(manifest_files)
+    manifest_path = os.path.join(_manifest_dir(model_name), f"{version}.json")
+    if not os.path.exists(manifest_path):
+        manifest = {'model_name': model_name, 'version': version, 'files': manifest_files}
+        _write_file(manifest_path, json.dumps(manifest).encode())
+
+    if model_name not in MODELS or MODELS[model_name]['version'] != version:
+        logger.info(f"model {model_name} is now at version {version}")
+        _write_file(os.path.join(_manifest_dir(model_name), CURRENT_VERSION), version.encode())
+        MODELS[model_name] = _index_entry({'version': version, 'files': manifest_files})
+        _save_index()
+        _schedule_archive(model_name, version)
+    return version
+
+
+def get_manifest(model_name, version=None):
+    '''
+    Returns the manifest of the version of the model, the current version if no version is given
+    '''
+    version = version or get_model_version(model_name)
     try:
-        model_zip = f"{MODELS[model_name]}.zip"
-        with open(model_zip, "rb") as model_contents:
-            return model_contents.read()
+        with open(os.path.join(_manifest_dir(model_name), f"{version}.json")) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise ModelVersionNotFoundError(model_name, version)
+
+
+def _archive_path(version):
+    return os.path.join(BASE_MODEL_DIR, ARCHIVES_DIR, f"{version}.zip")
+
+
+def _build_archive_file(model_name, version):
+    logger.info(f"building the archive of {model_name}@{version}")
+    _write_file(_archive_path(version), build_archive(get_manifest(model_name, version), blob_store()))
+
+
+def _schedule_archive(model_name, version):
+    '''
+    Starts building the archive of the version in the background, unless it's built or being built already.
+    Returns the future of the build, or None if the archive exists
+    '''
+    if os.path.exists(_archive_path(version)):
+        return None
+
+    with REGISTRY_LOCK:
+        build = ARCHIVE_BUILDS.get(version)
+        # a build that failed is retried, and so is a build whose archive was removed since
+        if build is None or (build.done() and not os.path.exists(_archive_path(version))):
+            build = ARCHIVE_BUILDS[version] = _executor().submit(_build_archive_file, model_name, version)
+    return build
+
+
+def get_model_archive(model_name, version=None):
+    '''
+    Returns the path of the zip archive of the version of the model, and waits for it if it isn't built yet
+    '''
+    version = get_manifest(model_name, version)['version']
+    build = _schedule_archive(model_name, version)
+    if build is not None:
+        build.result()
+    return _archive_path(version)
+
+
+def build_archive(manifest, store):
+    archive = BytesIO()
+    with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as model_zip:
+        for f in manifest['files']:
+            model_zip.writestr(f['path'], store.get(f['digest']))
+    return archive.getvalue()
+
+
+def get_model_by_name(model_name, version=None):
+    with open(get_model_archive(model_name, version), "rb") as model_contents:
+        return model_contents.read()
+
+
+def parse_range(range_header, size):
+    '''
+    Returns the first and last byte positions of a "bytes=first-last" range header, or None if the header
+    isn't a single byte range, in which case the whole archive is returned
+    '''
+    unit, _, byte_range = range_header.partition('=')
+    if unit.strip() != 'bytes' or ',' in byte_range:
+        return None
+
+    first, _, last = byte_range.strip().partition('-')
+    try:
+        if not first:
+            # a suffix range, the last bytes of the archive
+            first, last = max(0, size - int(last)), size - 1
+        else:
+            first, last = int(first), min(int(last), size - 1) if last else size - 1
+    except ValueError:
+        return None
+
+    if first > last or first >= size:
+        raise InvalidRangeError(range_header, size)
+    return first, last
+
+
+def read_archive(path, first, last, chunk_size=ARCHIVE_CHUNK_SIZE):
+    '''
+    Yields the bytes of the archive between the first and last positions, a chunk at a time
+    '''
+    with open(path, "rb") as archive:
+        archive.seek(first)
+        remaining = last - first + 1
+        while remaining > 0:
+            chunk = archive.read(min(chunk_size, remaining))
+            if not chunk:
+                return
+            remaining -= len(chunk)
+            yield chunk
+
+
+def get_model_version(model_name):
+    '''
+    Returns the current version of the model, which is the digest of its manifest
+    '''
+    try:
+        return MODELS[model_name]['version']
     except KeyError:
+        if model_name in MODEL_IMPORTS and not MODEL_IMPORTS[model_name].done():
+            raise ModelNotReadyError(model_name)
         raise ModelNotFoundError(model_name)
 
 
@@ -69,35 +400,47 @@ def _common_subdir_in_zip(model_zip):
     return None
 
 
-def add_model(model_name, model_contents, ignore_already_exists=True):
+def add_model(model_name, model_contents):
+    '''
+    Adds a version of the model from a zip archive of its files, only files that aren't stored yet are added.
+    Returns the version
+    '''
     logger.info(f"going to add model {model_name}")
-    if model_name in MODELS:
-        msg = f"model {model_name} already exists in DB"
-        if ignore_already_exists:
-            logger.warning(msg)
-            return
-        raise Exception(msg)
-
-    model_dir = os.path.join(BASE_MODEL_DIR, model_name)
     model_zip = zipfile.ZipFile(BytesIO(model_contents))
-    model_zip.extractall(model_dir)
 
     # if there was a hierarchy of directories in the zip (but all files are in the same path)
     # use only the contents of the leaf directory
     common_subdir = _common_subdir_in_zip(model_zip)
     if common_subdir:
         logger.debug(f'found common subdir {common_subdir}, going to take files from it')
-        full_dir = os.path.join(model_dir, common_subdir)
-        for f in os.listdir(full_dir):
-            shutil.move(os.path.join(full_dir, f), model_dir)
-        shutil.rmtree(os.path.join(model_dir, common_subdir.parts[0]))
-
     else:
         logger.debug('no common subidr was found')
-    MODELS[model_name] = model_dir
 
-    # create a zip file that will be returned upon request
-    shutil.make_archive(os.path.join(BASE_MODEL_DIR, model_name), 'zip', model_dir)
+    store = blob_store()
+    files = {}
+    for info in model_zip.infolist():
+        if info.is_dir():
+            continue
+        path = pathlib.PurePosixPath(info.filename)
+        if common_subdir:
+            path = path.relative_to(common_subdir.as_posix())
+        files[path.as_posix()] = store.put(model_zip.read(info))
+
+    return save_manifest(model_name, files)
+
+
+def add_model_dir(model_name, model_dir):
+    '''
+    Adds a version of the model from a directory of its files
+    '''
+    store = blob_store()
+    files = {}
+    for root, _, file_names in os.walk(model_dir):
+        for file_name in file_names:
+            path = os.path.join(root, file_name)
+            with open(path, 'rb') as f:
+                files[pathlib.Path(os.path.relpath(path, model_dir)).as_posix()] = store.put(f.read())
+    return save_manifest(model_name, files)
 
 
 def get_models():
@@ -107,21 +450,125 @@ def get_models():
 
 class ModelRegistryClient:
 
-    def __init__(self, uri=f"http://{MODEL_REGISTRY_SERVICE}:80/models", requests_mod=None):
+    def __init__(self, uri=f"http://{MODEL_REGISTRY_SERVICE}:80/models", requests_mod=None, blob_cache=None):
         self.uri = uri
+        self.blobs_uri = f"{uri.rsplit('/', 1)[0]}/blobs"
         self.requests = requests_mod or requests
+        self.blob_cache = blob_cache
+
+    def get_model_by_name(self, model_name, version=None):
+        return self.get_model(model_name, version=version)[1]
+
+    def get_model(self, model_name, cached_version=None, version=None):
+        '''
+        Returns a tuple of the version of the model (the current version, unless a version is given), and the
+        contents of its archive. If that's the cached version, the archive isn't fetched and the contents are None.
+        With a blob cache, only the files of the model that aren't in the cache are fetched
+        '''
+        if version is not None and version == cached_version:
+            # a version of a model never changes
+            return version, None
+        if self.blob_cache is not None:
+            return self._get_model_from_blobs(model_name, cached_version, version)
+
+        logger.info(f"going to get from {self.uri}/{model_name}")
+        headers = {"If-None-Match": f'"{cached_version}"'} if cached_version is not None else {}
+        params = {"version": version} if version is not None else None
+        response = self._get(model_name, f"{self.uri}/{model_name}", headers, params)
+        if response.status_code == 304:
+            return cached_version, None
+        return self._download(model_name, response, params)
+
+    def _get(self, model_name, url, headers, params=None):
+        response = self.requests.get(url, headers=headers, params=params, stream=True)
+        if response.status_code == 404:
+            raise ModelNotFoundError(model_name)
+        response.raise_for_status()
+        return response
+
+    def _download(self, model_name, response, params=None):
+        '''
+        Reads the archive from the response, a download that is interrupted is resumed from where it stopped
+        '''
+        etag = response.headers.get("ETag")
+        contents = bytearray()
+        for attempt in range(DOWNLOAD_RETRIES + 1):
+            try:
+                for chunk in response.iter_content(ARCHIVE_CHUNK_SIZE):
+                    contents.extend(chunk)
+                break
+            except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError) as e:
+                if attempt == DOWNLOAD_RETRIES or etag is None:
+                    raise
+                logger.warning(f"download of model {model_name} was interrupted after {len(contents)} bytes: {e}")
+                response = self._get(model_name, f"{self.uri}/{model_name}",
+                                     {"Range": f"bytes={len(contents)}-", "If-Range": etag}, params)
+                if response.status_code != 206:
+                    # the model changed since the download started, so it starts over
+                    etag = response.headers.get("ETag")
+                    contents = bytearray()
+
+        return (etag.strip('"') if etag else None), bytes(contents)
+
+    def _get_model_from_blobs(self, model_name, cached_version, version):
+        manifest = self.get_manifest(model_name, cached_version, version)
+        if manifest is None:
+            return cached_version, None
+
+        missing = [f['digest'] for f in manifest['files'] if not self.blob_cache.has(f['digest'])]
+        logger.info(f"fetching {len(missing)} of the {len(manifest['files'])} files of "
+                    f"{model_name}@{manifest['version']}")
+        for digest in dict.fromkeys(missing):
+            self.blob_cache.put(self.get_blob(digest), digest)
+
+        archive = BytesIO()
+        with zipfile.ZipFile(archive, 'w') as model_zip:
+            for f in manifest['files']:
+                model_zip.writestr(f['path'], self.blob_cache.get(f['digest']))
+        return manifest['version'], archive.getvalue()
+
+    def get_manifest(self, model_name, cached_version=None, version=None):
+        '''
+        Returns the manifest of the version of the model, the current version if no version is given.
+        Returns None if the current version is the cached version
+        '''
+        headers = {"If-None-Match": f'"{cached_version}"'} if cached_version is not None else {}
+        params = {"version": version} if version is not None else None
+        response = self._get(model_name, f"{self.uri}/{model_name}/manifest", headers, params)
+        if response.status_code == 304:
+            return None
+        return response.json()
+
+    def get_blob(self, digest):
+        response = self.requests.get(f"{self.blobs_uri}/{digest}")
+        response.raise_for_status()
+        return response.content
+
+    def add_model_files(self, model_name, files):
+        '''
+        Adds a version of the model with the files, given as a dict of path to contents.
+        Only the files that the registry doesn't have yet are uploaded
+        '''
+        contents = {blob_digest(c): c for c in files.values()}
+        manifest = {"files": {path: blob_digest(c) for path, c in files.items()}}
+        response = self.requests.post(f"{self.uri}/{model_name}/manifest", json=manifest)
+        if response.status_code == 409:
+            missing = response.json()["missing"]
+            logger.info(f"uploading {len(missing)} of the {len(files)} files of model {model_name}")
+            for digest in missing:
+                self.requests.put(f"{self.blobs_uri}/{digest}", data=contents[digest]).raise_for_status()
+            response = self.requests.post(f"{self.uri}/{model_name}/manifest", json=manifest)
+        response.raise_for_status()
+        return response.json()
 
-    def get_model_by_name(self, model_name):
-        try:
-            logger.info(f"going to get from {self.uri}/{model_name}")
-            response = self.requests.get(f"{self.uri}/{model_name}")
-            response.raise_for_status()
-            return response.content
-        except self.requests.HTTPError:
-            if response.status_code == 404:
-                raise ModelNotFoundError(model_name)
-            else:
-                raise
+    def get_model_version(self, model_name):
+        response = self.requests.get(f"{self.uri}/{model_name}/version")
+        if response.status_code == 404:
+            raise ModelNotFoundError(model_name)
+        if response.status_code == 503:
+            raise ModelNotReadyError(model_name)
+        response.raise_for_status()
+        return response.json()["version"]
 
     def get_models(self):
         return self.requests.get(f"{self.uri}").json()
@@ -0,0 +1,109 @@
+import logging
+import math
+import os
+import queue
+import resource
+import subprocess
+
+logger = logging.getLogger()
+logger.setLevel(logging.DEBUG)
+
+# the number of model processes that a worker runs at once, "auto" runs one on every cpu that is available to it
+MODEL_PROCESSES = os.environ.get("WQDSS_MODEL_PROCESSES", "1")
+
+# the address space of each model process is limited to this size, 0 doesn't limit it
+MODEL_MEMORY_LIMIT = int(os.environ.get("WQDSS_MODEL_MEMORY_LIMIT_MB", "0")) * 1024 * 1024
+
+CGROUP_V2_CPU_MAX = "/sys/fs/cgroup/cpu.max"
+CGROUP_V1_CPU_QUOTA = "/sys/fs/cgroup/cpu/cpu.cfs_quota_us"
+CGROUP_V1_CPU_PERIOD = "/sys/fs/cgroup/cpu/cpu.cfs_period_us"
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def cgroup_cpu_limit():
+    '''
+    Returns the number of cpus that the cgroup of the process may use, or None if it isn't limited
+    '''
+    cpu_max = _read(CGROUP_V2_CPU_MAX)
+    if cpu_max is not None:
+        quota, _, period = cpu_max.partition(' ')
+        if quota == 'max':
+            return None
+        return math.ceil(int(quota) / int(period))
+
+    quota, period = _read(CGROUP_V1_CPU_QUOTA), _read(CGROUP_V1_CPU_PERIOD)
+    if quota is None or period is None or int(quota) <= 0:
+        return None
+    return math.ceil(int(quota) / int(period))
+
+
+def available_cpus():
+    '''
+    Returns the cpus that the process may run on, limited to the number of cpus in its cgroup quota
+    '''
+    cpus = sorted(os.sched_getaffinity(0))
+    limit = cgroup_cpu_limit()
+    if limit is not None:
+        cpus = cpus[:max(1, limit)]
+    return cpus
+
+
+def get_model_processes(model_processes=MODEL_PROCESSES):
+    if model_processes == "auto":
+        return len(available_cpus())
+    return max(1, int(model_processes))
+
+
+class ModelProcessPool:
+    """
+    Runs model processes, at most one on each of the cpus of the pool. Every process is pinned to its cpu,
+    and its address space is limited to memory_limit bytes. run() blocks until a cpu is free, so it can be
+    called from as many threads as there are cpus
+    """
+
+    def __init__(self, cpus=None, memory_limit=MODEL_MEMORY_LIMIT):
+        self.cpus = list(cpus) if cpus is not None else available_cpus()
+        self.memory_limit = memory_limit
+        self._free = queue.Queue()
+        for cpu in self.cpus:
+            self._free.put(cpu)
+
+    @property
+    def size(self):
+        return len(self.cpus)
+
+    def run(self, args):
+        '''
+        Runs the process and waits for it to exit, returns its exit code
+        '''
+        cpu = self._free.get()
+        try:
+            process = subprocess.Popen(args, stdin=subprocess.DEVNULL,
+                                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            # the limits are set from the parent, since preexec_fn isn't safe with threads
+            try:
+                os.sched_setaffinity(process.pid, {cpu})
+                if self.memory_limit:
+                    resource.prlimit(process.pid, resource.RLIMIT_AS, (self.memory_limit, self.memory_limit))
+            except ProcessLookupError:
+                # the process already exited
+                pass
+            logger.info(f'going to execute process {process} on cpu {cpu}')
+            return process.wait()
+        finally:
+            self._free.put(cpu)
+
+
+def create_model_process_pool(model_processes=MODEL_PROCESSES, memory_limit=MODEL_MEMORY_LIMIT):
+    '''
+    Returns a pool of model processes for the worker, on as many of its cpus as configured
+    '''
+    cpus = available_cpus()
+    return ModelProcessPool(cpus[:get_model_processes(model_processes)], memory_limit)
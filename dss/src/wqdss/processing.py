@@ -1,5 +1,4 @@
 import asyncio
-import csv
 import datetime
 from enum import Enum
 import itertools
@@ -8,24 +7,42 @@ import os
 import shutil
 import uuid
 
-from .model_execution import get_out_contents, ModelExecutionPermutation, DEFAULT_MODEL
-from .tasks import execute_on_worker
-
+from .model_execution import get_out_contents, DEFAULT_MODEL, ModelExecutionPermutation
+from .model_registry import ModelRegistryClient
+from .run_cache import RunResultCache, run_key, permutation_values
+from .artifacts import get_artifact_store, ArtifactNotFoundError
+from .events import ExecutionEvents
+from .execution_store import get_execution_store
+from .scheduler import RunScheduler
+from .stopping import StoppingCriteria
+from .surrogate import get_surrogate_filter
+from .scoring import (calc_param_score, get_parameter_keys, get_run_score, get_values_score,  # noqa: F401
+                      DuplicateParameterError)
+from .search import generate_permutations, get_search_strategy, values_range, NonEqualStepNumber  # noqa: F401
+from .tasks import execute_on_worker, execute_batched_on_worker, BATCH_RUNS
+
+# executions that are still running, completed executions are only kept in the execution store
 EXECUTIONS = {}
+EXECUTION_STORE = get_execution_store()
 
+# the progress of running executions is published to clients that follow them
+EXECUTION_EVENTS = ExecutionEvents()
 
-BEST_RUNS_DIR = os.environ.get("WQDSS_BEST_RUNS_DIR", os.path.join("/", "best_runs"))
+# results of runs are shared by all executions, so a run that was already executed is never executed again
+RUN_CACHE = RunResultCache()
 
-logger = logging.getLogger()
-logger.setLevel(logging.DEBUG)
+# the number of runs that all executions together keep in flight on the workers
+RUN_SCHEDULER = RunScheduler(int(os.getenv("NUM_PARALLEL_EXECS", "-1")))
 
+# the store in which workers keep the files of each run, if runs aren't returned inline
+ARTIFACT_STORE = get_artifact_store()
+model_registry_client = ModelRegistryClient()
 
-def sliced(seq, n):
-    return itertools.takewhile(bool, (seq[i: i + n] for i in itertools.count(0, n)))
 
+BEST_RUNS_DIR = os.environ.get("WQDSS_BEST_RUNS_DIR", os.path.join("/", "best_runs"))
 
-class NonEqualStepNumber(Exception):
-    pass
+logger = logging.getLogger()
+logger.setLevel(logging.DEBUG)
 
 
 class ExectuionState(Enum):
@@ -41,20 +58,59 @@ class Execution:
             self.permutation = permutation
             self.iteration = iteration
             self.result = None
+            self.artifact = None
+            self.values = None
+            self.run_score = None
+
+        def set_result(self, result):
+            '''
+            A result is a score record from the worker, with either the zip of the run files or their reference
+            in the artifact store. A plain zip of the run files is accepted from workers that don't score runs
+            '''
+            self.set_files(result)
+            if isinstance(result, dict):
+                self.values = result.get('values')
+                self.run_score = result.get('score')
+
+        def set_files(self, result):
+            '''
+            Takes the files of the run from its result, without its score
+            '''
+            if isinstance(result, dict):
+                self.result = result.get('result')
+                self.artifact = result.get('artifact')
+            else:
+                self.result = result
 
-        def get_run_output(self, output_file):
+        def get_run_zip(self):
             if self.result is not None:
-                return get_out_contents(self.result, output_file)
-            else:
-                raise Execution.RunNotCompletedError()
+                return self.result
+            if self.artifact is not None:
+                try:
+                    return ARTIFACT_STORE.get(self.artifact)
+                except ArtifactNotFoundError:
+                    # the files of a run that wasn't the best run are removed once its iteration completes
+                    pass
+            raise Execution.RunNotCompletedError()
+
+        def get_run_output(self, output_file):
+            return get_out_contents(self.get_run_zip(), output_file)
 
         def save_results(self, results_zip_file):
+            # the files may no longer be available, which mustn't leave an empty file behind
+            run_zip = self.get_run_zip()
             with open(results_zip_file, "wb") as run_file:
-                run_file.write(self.result)
+                run_file.write(run_zip)
 
         def score(self, params):
-            out_file = params['model_analysis']['output_file']
-            return get_run_score(params, self.get_run_output(out_file))
+            if self.run_score is None:
+                # the run was executed by a worker that doesn't score runs
+                if self.values is not None:
+                    self.run_score = get_values_score(params['model_analysis'], self.values)
+                else:
+                    out_file = params['model_analysis']['output_file']
+                    self.run_score = get_run_score(params, self.get_run_output(out_file))
+            return self.run_score
 
     class RunNotCompletedError(Exception):
         pass
@@ -66,9 +122,47 @@ class Execution:
         self.runs = []
         self.execute_func = execute_func
         self.output_file = None
+        self.params = None
         EXECUTIONS[exec_id] = self
         self.model_name = None
+        self.model_version = None
         self.start_time = None
+        self.end_time = None
+        self.best_run = None
+        self.best_score = None
+        self.stopping = None
+        self.stop_reason = None
+        self.surrogate = None
+        self.runs_completed = 0
+        self.runs_skipped = 0
+        self.iteration = None
+        self.iteration_runs = 0
+        self.iteration_runs_completed = 0
+        self.iteration_start_time = None
+
+    @classmethod
+    def restore(cls, exec_id, execute_func):
+        '''
+        Recreates an execution from its checkpoint in the execution store, returns it along with its params
+        '''
+        stored = EXECUTION_STORE.get_execution(exec_id)
+        execution = cls(exec_id, execute_func)
+        execution.model_name = stored['model_name']
+        execution.model_version = stored['model_version']
+        if stored['start_time'] is not None:
+            execution.start_time = datetime.datetime.fromisoformat(stored['start_time'])
+        execution.result = stored['result']
+        for stored_run in EXECUTION_STORE.get_runs(exec_id):
+            run = execution.add_run(stored_run['run_id'], ModelExecutionPermutation.from_dict(stored_run['params']),
+                                    stored_run['iteration'])
+            run.set_result({'values': stored_run['values'], 'score': stored_run['score'],
+                            'artifact': stored_run['artifact']})
+
+        execution.runs_skipped = sum(r.get('skipped', 0) for r in execution.result or [])
+        if execution.result:
+            best_run_id = execution.result[-1].get('best_run')
+            execution.best_run = next((run for run in execution.runs if run.run_id == best_run_id), None)
+        return execution, stored['params']
 
     def add_run(self, run_id, p, iteration):
         run = Execution.Run(run_id, p, iteration)
@@ -87,149 +181,267 @@ class Execution:
 
     def mark_complete(self):
         self.state = ExectuionState.COMPLETED
+        self.end_time = datetime.datetime.now()
+        EXECUTION_STORE.save_execution(self)
+        EXECUTIONS.pop(self.exec_id, None)
+        EXECUTION_EVENTS.publish(self.exec_id, 'completed', status=self.state.value,
+                                 result=simple_result(self.result))
+
+    def progress(self):
+        '''
+        A snapshot of the progress of the execution, with an estimate of the time until the current iteration completes
+        '''
+        remaining = self.iteration_runs - self.iteration_runs_completed
+        eta = None
+        if self.iteration_runs_completed and remaining:
+            elapsed = (datetime.datetime.now() - self.iteration_start_time).total_seconds()
+            eta = elapsed / self.iteration_runs_completed * remaining
+
+        return {
+            'id': self.exec_id,
+            'status': self.state.value,
+            'iteration': self.iteration,
+            'runs_completed': self.runs_completed,
+            'runs_skipped': self.runs_skipped,
+            'iteration_runs': self.iteration_runs,
+            'iteration_runs_remaining': remaining,
+            'eta': eta,
+            'best_score': self.best_score,
+            'stop_reason': self.stop_reason,
+        }
+
+    def start_iteration(self, iteration, num_runs):
+        self.iteration = iteration
+        self.iteration_runs = num_runs
+        self.iteration_runs_completed = 0
+        self.iteration_start_time = datetime.datetime.now()
+        EXECUTION_EVENTS.publish(self.exec_id, 'iteration', **self.progress())
+
+    def complete_run(self, run, params):
+        score = run.score(params)
+        EXECUTION_STORE.add_runs(self.exec_id, [run])
+        self.runs_completed += 1
+        self.iteration_runs_completed += 1
+        if self.best_score is None or score < self.best_score:
+            self.best_score = score
+        if self.stopping is not None:
+            self.stopping.add_run(score)
+        EXECUTION_EVENTS.publish(self.exec_id, 'run', run_id=run.run_id, params=run.permutation.values,
+                                 score=score, **self.progress())
 
     def save_best_run(self, run):
+        if run is self.best_run:
+            return
+
         best_run_zip_path = best_run_file(self.exec_id)
         os.makedirs(os.path.dirname(best_run_zip_path), exist_ok=True)
         run.save_results(best_run_zip_path)
-
-    def get_num_iterations(self, params):
-        input_files = params["model_run"]["input_files"]
-        all_iteration_counts = set(len(i["steps"]) for i in input_files)
-
-        if len(all_iteration_counts) > 1:
-            raise NonEqualStepNumber(all_iteration_counts)
-
-        return all_iteration_counts.pop()
+        self.best_run = run
+
+    def scored_runs(self, params):
+        return [(run.permutation, run.score(params)) for run in self.runs]
+
+    def release_runs(self, iteration):
+        '''
+        Drops the files of the runs of the iteration from memory, the runs themselves are already in the store.
+        The files of runs that aren't the best run are removed from the artifact store, since the best run
+        of a later iteration is either the same run or a run of that iteration
+        '''
+        best_artifact = self.best_run.artifact if self.best_run is not None else None
+        for run in self.runs:
+            if run.iteration == iteration:
+                run.result = None
+            if run.artifact is not None and run.artifact != best_artifact:
+                self.delete_artifact(run)
+
+    def delete_artifact(self, run):
+        logger.debug(f'removing the files of run {run.run_id} from the artifact store')
+        ARTIFACT_STORE.delete(run.artifact)
+        run.artifact = None
+        if self.model_version is not None:
+            RUN_CACHE.discard(run_key(self.model_version, run.permutation, self.params['model_analysis']))
 
     async def execute(self, params):
-        for iteration in range(self.get_num_iterations(params)):
-            permutations = generate_permutations(params, self.result, iteration)
-            num_parallel_execs = int(os.getenv("NUM_PARALLEL_EXECS", "-1"))
-            try:
-                self.model_name = params['model_run']['model_name']
-            except KeyError:
-                self.model_name = DEFAULT_MODEL
-
-            self.start_time = datetime.datetime.now()
-            logger.info(f'going to use model {self.model_name}')
-
-            self.output_file = params['model_analysis']['output_file']
-
+        try:
+            # parameters that would share a value are rejected before any run is executed
+            get_parameter_keys(params['model_analysis'])
+        except DuplicateParameterError as e:
+            self.result = [{'best_run': 'FAILED', 'score': 0, 'error': str(e)}]
+            raise
+        search = get_search_strategy(params)
+        self.params = params
+        self.stopping = StoppingCriteria(params)
+        self.surrogate = get_surrogate_filter(params)
+        try:
+            self.model_name = params['model_run']['model_name']
+        except KeyError:
+            self.model_name = DEFAULT_MODEL
+
+        # an execution that is resumed continues from the runs that completed before it was interrupted
+        for run in self.runs:
+            self.stopping.add_run(run.run_score)
+        self.runs_completed = len(self.runs)
+        self.best_score = self.stopping.best_score
+
+        self.start_time = self.start_time or datetime.datetime.now()
+        # the version of the model is pinned for the whole execution, a resumed execution keeps its version
+        self.model_version = params['model_run'].get('model_version') or self.model_version or \
+            get_model_version(self.model_name)
+        logger.info(f'going to use model {self.model_name}@{self.model_version}')
+
+        self.output_file = params['model_analysis']['output_file']
+        EXECUTION_STORE.save_execution(self)
+
+        for iteration in itertools.count(len(self.result or [])):
             try:
-                if num_parallel_execs > 0 and len(permutations) > num_parallel_execs:
-                    for i, s in enumerate(sliced(permutations, num_parallel_execs)):
-                        logger.info(f'About to process slice {i}: {s}')
-                        awaitables = [self.execute_run_async(self.model_name, params, p, iteration) for p in s]
-                        logger.info(f'Going to call gather')
-                        await asyncio.gather(*awaitables)
-                        logger.info(f'finished slice {i}: {s}')
-                else:
-                    logger.info(f'going to execute all permutations')
-                    awaitables = [self.execute_run_async(self.model_name, params, p, iteration) for p in permutations]
-                    logger.info(f'Going to call gather')
-                    await asyncio.gather(*awaitables)
-                    logger.info('Done executing all permutations')
+                self.stop_reason = self.stopping.reason()
+                if self.stop_reason is not None:
+                    logger.info(f'stopping execution before iteration {iteration}: {self.stop_reason}')
+                    break
+
+                permutations = search.next_permutations(iteration, self.scored_runs(params), self.result)
+                if not permutations:
+                    logger.info(f'search is complete after {iteration} iterations and {len(self.runs)} runs')
+                    break
+
+                completed = {permutation_values(run.permutation) for run in self.runs if run.iteration == iteration}
+                if completed:
+                    permutations = [p for p in permutations if permutation_values(p) not in completed]
+                    logger.info(f'{len(completed)} runs of iteration {iteration} already completed')
+
+                # the scheduler bounds how many of these runs are in flight at once
+                logger.info(f'going to execute {len(permutations)} permutations')
+                self.start_iteration(iteration, len(permutations))
+                skipped = await self.execute_iteration(self.model_name, params, permutations, iteration)
+                logger.info('Done executing all permutations')
+                if not self.runs:
+                    break
 
                 best_run = self.find_best_run(params)
 
                 # create a zip file with all of the relevant run files (inputs and outputs used for analysis)
-                self.save_best_run(best_run)
+                try:
+                    self.save_best_run(best_run)
+                except Execution.RunNotCompletedError:
+                    await self.execute_run_files(self.model_name, params, best_run)
+                    self.save_best_run(best_run)
 
                 if self.result is None:
                     self.result = []
 
                 self.result.append({'best_run': best_run.run_id,
                                     'params': best_run.permutation, 'score': best_run.score(params)})
+                if self.surrogate is not None:
+                    self.result[-1]['skipped'] = skipped
+                if self.stop_reason is not None:
+                    self.result[-1]['stopped'] = self.stop_reason
+                self.release_runs(iteration)
+                EXECUTION_STORE.save_execution(self)
+                EXECUTION_EVENTS.publish(self.exec_id, 'iteration_complete', **self.progress(),
+                                         result=simple_result(self.result[-1:])[0])
+                logger.info(f'run cache after iteration {iteration}: {RUN_CACHE.stats()}')
+                if self.stop_reason is not None:
+                    break
             except Exception as e:
                 logger.error("An error occurred during processing")
                 self.result = [{'best_run': 'FAILED', 'score': 0, 'error': str(e)}]
                 raise
 
+    async def execute_iteration(self, model_name, params, permutations, iteration):
+        '''
+        Executes the runs of the iteration, returns the number of runs that were skipped.
+        With a surrogate, the runs are executed in rounds, and runs that aren't expected to beat the best run
+        are skipped
+        '''
+        if self.surrogate is None:
+            await self.execute_runs(model_name, params, permutations, iteration)
+            return 0
+
+        skipped = 0
+        remaining = permutations
+        while remaining and self.stop_reason is None:
+            num_remaining = len(remaining)
+            round_permutations, remaining = self.surrogate.next_round(remaining, self.scored_runs(params))
+            round_skipped = num_remaining - len(round_permutations) - len(remaining)
+            skipped += round_skipped
+            self.runs_skipped += round_skipped
+            self.iteration_runs -= round_skipped
+            await self.execute_runs(model_name, params, round_permutations, iteration)
+
+        logger.info(f'{skipped} runs of iteration {iteration} were skipped')
+        return skipped
+
+    async def execute_runs(self, model_name, params, permutations, iteration):
+        '''
+        Executes the runs, until they all complete or the stopping criteria are met.
+        Runs that didn't complete are cancelled, which also cancels their tasks on the workers
+        '''
+        pending = [asyncio.ensure_future(self.execute_run_async(model_name, params, p, iteration))
+                   for p in permutations]
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, timeout=self.stopping.time_left(),
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    task.result()
+
+                self.stop_reason = self.stopping.reason()
+                if self.stop_reason is not None:
+                    logger.info(f'stopping execution with {len(pending)} runs pending: {self.stop_reason}')
+                    break
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.wait(pending)
+
     async def execute_run_async(self, model_name, params, run_permutation, iteration):
         run_id = get_run_id()
         run = self.add_run(run_id, run_permutation, iteration)
         logger.info(f"going to await run {run_id} for model {model_name}")
-        run.result = await self.execute_func(model_name, run.permutation.as_dict(), self.output_file)
+        try:
+            result = await self.get_run_result(model_name, params, run.permutation)
+        except asyncio.CancelledError:
+            self.runs.remove(run)
+            raise
+        run.set_result(result)
         logger.info(f"done awaiting run {run_id}")
+        self.complete_run(run, params)
 
+    async def execute_run_files(self, model_name, params, run):
+        '''
+        Executes the run again for its files. The run cache only keeps the score of a run, along with the reference
+        to its files while they are in the artifact store, and the files of a restored run were already released
+        '''
+        logger.info(f'the files of run {run.run_id} are no longer available, going to execute it again')
+        result = await RUN_SCHEDULER.run(self.exec_id, lambda: self.dispatch_run(model_name, params, run.permutation))
+        run.set_files(result)
 
-def generate_permutations(params, best_runs, iteration):
-    '''
-    Iterates over the input files, and the defined range of values for qwd in each of these files.
-    Returns the set of all relevant permutation values for the input files
-    '''
-    inputs = params['model_run']['input_files']
-    if iteration == 0:
-        ranges = {i['name']: values_range(float(i['min_val']), float(
-            i['max_val']), float(i['steps'][0])) for i in inputs}
-    else:
-        # build the new set of ranges, each range is [best_value - prev_step/2, best_value + prev_step/2, curr_step]
-        ranges = {}
-        for in_file in inputs:
-            file_name = in_file["name"]
-            half_prev_step = float(in_file["steps"][iteration-1])/2.0
-            curr_step = float(in_file["steps"][iteration])
-            best_value = best_runs[-1]["params"].values[file_name]
-            ranges[file_name] = values_range(best_value-half_prev_step, best_value+half_prev_step, curr_step)
-
-    # for now, get a full cartesian product of the parameter values
-    run_values = itertools.product(*ranges.values())
-
-    input_file_names = ranges.keys()
-    input_file_columns = [i['col_name'] for i in inputs]
-
-    # each value in run_values includes the value to be used for each input
-    # file. Now, create a dict that will hold all the necessary information:
-    # input_file: (column_name, value)
-    permutations = [
-        ModelExecutionPermutation(input_file_names, input_file_columns, r) for r in run_values]
-
-    return permutations
-
-
-def values_range(min_val, max_val, step):
-    '''
-    Yields all values in the range [min_val, max_val] with a given step
-    '''
-    cur_val = min_val
-    i = 0
-    while cur_val < max_val:
-        cur_val = min_val + (i * step)
-        if cur_val <= max_val:
-            yield cur_val
-        i = i + 1
-
+    def dispatch_run(self, model_name, params, run_permutation):
+        return self.execute_func(model_name, run_permutation.as_dict(), self.output_file, params['model_analysis'],
+                                 self.model_version)
 
-def get_run_parameter_value(param_name, contents):
-    """
-    Parses outfile contents and extracts the value for the field named as `param_name` from the last row
-    """
+    async def get_run_result(self, model_name, params, run_permutation):
+        def execute():
+            return RUN_SCHEDULER.run(self.exec_id, lambda: self.dispatch_run(model_name, params, run_permutation))
 
-    # read the header + the last line, and strip whitespace from field names
-    header = ','.join([c.lstrip() for c in contents[0].split(',')]) + '\n'
-    reader = csv.DictReader([header, contents[-1]])
-    return float(next(reader)[param_name])
+        # without the exact version of the model, a previous result might not match the current model
+        if self.model_version is None:
+            return await execute()
 
+        key = run_key(self.model_version, run_permutation, params['model_analysis'])
+        return await RUN_CACHE.get_or_execute(key, execute)
 
-def calc_param_score(value, target, score_step, weight):
 
-    distance = abs(target - value)
-    return (distance/score_step)/weight
-
-
-def get_run_score(params, outfile_contents):
-    """
-    Based on the params field 'model_analysis' find the run for this score
-    """
-    model_analysis_params = params['model_analysis']['parameters']
-    param_scores = {}
-    for param in model_analysis_params:
-        param_value = get_run_parameter_value(param['name'], outfile_contents)
-        param_scores[param['name']] = calc_param_score(param_value, float(
-            param['target']), float(param['score_step']), float(param['weight']))
-
-    return sum(param_scores.values())
+def get_model_version(model_name):
+    '''
+    Returns the version of the model from the registry, or None if it can't be determined
+    '''
+    try:
+        return model_registry_client.get_model_version(model_name)
+    except Exception as e:
+        logger.warning(f"could not get the version of model {model_name}, run results will not be reused: {e}")
+        return None
 
 
 def get_exec_id():
@@ -241,11 +453,33 @@ def get_run_id():
 
 
 def get_status(exec_id):
-    return EXECUTIONS[exec_id].state.value
+    if exec_id in EXECUTIONS:
+        return EXECUTIONS[exec_id].state.value
+    return EXECUTION_STORE.get_status(exec_id)
 
 
 def get_result(exec_id):
-    return EXECUTIONS[exec_id].result
+    if exec_id in EXECUTIONS:
+        return EXECUTIONS[exec_id].result
+    return EXECUTION_STORE.get_result(exec_id)
+
+
+def get_progress(exec_id):
+    '''
+    Returns the progress of a running execution, or only the status of an execution that isn't running
+    '''
+    if exec_id in EXECUTIONS:
+        return EXECUTIONS[exec_id].progress()
+    return {'id': exec_id, 'status': EXECUTION_STORE.get_status(exec_id)}
+
+
+def simple_result(result):
+    '''
+    Returns the result of an execution with the values of the best run of each iteration, instead of the permutation
+    '''
+    if result is None:
+        return None
+    return [dict(r, params=r['params'].values) if 'params' in r else r for r in result]
 
 
 def best_run_file(exec_id):
@@ -258,27 +492,62 @@ def get_best_run(exec_id):
         return f.read()
 
 
-def simple_execution(exec_id, execution):
-    simple_exec = {
-        'id': exec_id,
-        'model_name': execution.model_name,
-        'start_time': str(execution.start_time),
-        'result': dict(execution.result)
-    }
-    simple_exec['result']['params'] = simple_exec['result']['params'].as_dict()
-    return simple_exec
+# the number of executions that are returned at once, unless a different limit is requested
+EXECUTIONS_PAGE_SIZE = int(os.environ.get("WQDSS_EXECUTIONS_PAGE_SIZE", "100"))
 
 
-def get_executions():
-    return {"executions": [simple_execution(exec_id, execution) for exec_id, execution in EXECUTIONS.items()]}
+def get_executions(limit=EXECUTIONS_PAGE_SIZE, cursor=None, model_name=None, state=None, since=None, fields=None):
+    '''
+    Returns a page of executions, with only the requested fields of each execution
+    '''
+    executions, next_cursor = EXECUTION_STORE.get_executions(limit=limit, cursor=cursor, model_name=model_name,
+                                                             state=state, since=since)
+    if fields is not None:
+        executions = [{f: e[f] for f in fields if f in e} for e in executions]
+    return {"executions": executions, "next_cursor": next_cursor}
+
+
+def get_executions_version():
+    return EXECUTION_STORE.get_version()
 
 
-async def execute_dss(exec_id, params):
+def get_execute_func():
+    return execute_batched_on_worker if BATCH_RUNS else execute_on_worker
+
+
+async def execute_dss(exec_id, params, execution=None):
     # TODO: extract handling the Execution to a context
     # model_run_params = params['model_run']
     # model_name = model_run_params['model_name'] if 'model_name' in model_run_params else DEFAULT_MODEL
-    current_execution = Execution(exec_id, execute_on_worker)
+    current_execution = execution or Execution(exec_id, get_execute_func())
     try:
         await current_execution.execute(params)
-    finally:
+    except asyncio.CancelledError:
+        # the API is shutting down, the execution is resumed from its checkpoint when it starts again
+        logger.info(f"execution {exec_id} was interrupted")
+        EXECUTIONS.pop(exec_id, None)
+        raise
+    except Exception:
         current_execution.mark_complete()
+        raise
+    current_execution.mark_complete()
+
+
+async def resume_dss(exec_id):
+    execution, params = Execution.restore(exec_id, get_execute_func())
+    if params is None:
+        logger.warning(f"execution {exec_id} can't be resumed, it was started before executions were checkpointed")
+        execution.result = [{'best_run': 'FAILED', 'score': 0, 'error': 'the execution was interrupted'}]
+        execution.mark_complete()
+        return
+
+    logger.info(f"resuming execution {exec_id} with {len(execution.runs)} completed runs")
+    await execute_dss(exec_id, params, execution)
+
+
+def resume_executions():
+    '''
+    Resumes every execution that was running when the API stopped, returns the tasks that execute them
+    '''
+    return [asyncio.ensure_future(resume_dss(exec_id))
+            for exec_id in EXECUTION_STORE.get_running_executions() if exec_id not in EXECUTIONS]
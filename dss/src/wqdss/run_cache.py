@@ -0,0 +1,140 @@
+import asyncio
+from collections import OrderedDict
+import json
+import logging
+import os
+
+logger = logging.getLogger()
+logger.setLevel(logging.DEBUG)
+
+RUN_CACHE_SIZE = int(os.environ.get("WQDSS_RUN_CACHE_SIZE_MB", "256")) * 1024 * 1024
+
+
+def permutation_values(permutation):
+    '''
+    Returns the values of the permutation in a form that can be compared and hashed
+    '''
+    return tuple(sorted((f, permutation.columns[f], round(float(permutation.values[f]), 10))
+                        for f in permutation.files))
+
+
+def run_key(model_version, permutation, model_analysis):
+    '''
+    Returns the key of a run, which identifies its result regardless of the execution it was part of.
+    Runs are scored on the workers, so the analysis (including the output file) is part of the key
+    '''
+    return (model_version, permutation_values(permutation), json.dumps(model_analysis, sort_keys=True))
+
+
+def result_size(result):
+    '''
+    The size of a run result, which is either the zip of the run files, or a record of the run
+    '''
+    if isinstance(result, (bytes, bytearray)):
+        return len(result)
+    if isinstance(result, dict):
+        return sum(result_size(v) for v in result.values())
+    return len(json.dumps(result))
+
+
+def cached_result(result):
+    '''
+    The part of a run result that is cached. The score and values of a record are kept, along with the reference
+    to its files in the artifact store, but not files that were returned inline, which the executions that
+    completed the run already released. A zip of the run files is kept, since the run can't be scored without it
+    '''
+    if isinstance(result, dict):
+        return {k: v for k, v in result.items() if k != 'result'}
+    return result
+
+
+class RunResultCache:
+    """
+    A size-bounded LRU cache of run results, shared by all executions in the API process.
+    Runs that are still executing are tracked as well, so an identical run that is requested
+    at the same time awaits the same result instead of being executed twice
+    """
+
+    def __init__(self, max_size=RUN_CACHE_SIZE):
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._results = OrderedDict()
+        self._in_flight = {}
+
+    async def get_or_execute(self, key, execute):
+        '''
+        Returns the cached result for key, or awaits execute() and caches its result
+        '''
+        if key in self._results:
+            self.hits += 1
+            self._results.move_to_end(key)
+            return self._results[key]
+
+        if key in self._in_flight:
+            self.hits += 1
+            in_flight = self._in_flight[key]
+            try:
+                return await asyncio.shield(in_flight)
+            except asyncio.CancelledError:
+                if not in_flight.cancelled():
+                    raise
+            # the execution that was running it stopped, so the run is executed again
+            self.hits -= 1
+            return await self.get_or_execute(key, execute)
+
+        self.misses += 1
+        future = asyncio.get_event_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            result = await execute()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            # failed runs are not cached, anyone waiting on the same run gets the error
+            future.set_exception(e)
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            self.add(key, result)
+            return result
+        finally:
+            del self._in_flight[key]
+
+    def add(self, key, result):
+        result = cached_result(result)
+        size = result_size(result)
+        if size > self.max_size or key in self._results:
+            return
+
+        while self._results and self.size + size > self.max_size:
+            _, evicted = self._results.popitem(last=False)
+            self.size -= result_size(evicted)
+
+        self._results[key] = result
+        self.size += size
+
+    def discard(self, key):
+        '''
+        Drops the cached run, once its files were removed from the artifact store.
+        A run that is requested again is executed again, so its files are available if it becomes the best run
+        '''
+        result = self._results.pop(key, None)
+        if result is not None:
+            self.size -= result_size(result)
+
+    def clear(self):
+        self._results.clear()
+        self.size = 0
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "runs": len(self._results),
+            "size": self.size,
+            "max_size": self.max_size
+        }
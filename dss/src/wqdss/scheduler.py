@@ -0,0 +1,79 @@
+import asyncio
+from collections import deque, OrderedDict
+import logging
+
+logger = logging.getLogger()
+logger.setLevel(logging.DEBUG)
+
+
+class RunScheduler:
+    """
+    Bounds the number of runs in flight across all executions. As soon as a run completes its slot
+    is handed to the next waiting run, so max_runs runs are always in flight while there is work.
+    Free slots are handed out round-robin between the executions that are waiting for them,
+    so an execution with many runs doesn't starve executions that were submitted after it.
+    A max_runs that isn't positive means the number of runs in flight isn't limited
+    """
+
+    def __init__(self, max_runs):
+        self.max_runs = max_runs
+        self.in_flight = 0
+        self._waiting = OrderedDict()
+
+    @property
+    def limited(self):
+        return self.max_runs > 0
+
+    def num_waiting(self, exec_id=None):
+        if exec_id is not None:
+            return len(self._waiting.get(exec_id, ()))
+        return sum(len(q) for q in self._waiting.values())
+
+    async def run(self, exec_id, execute):
+        '''
+        Awaits execute() once a slot is available for the execution
+        '''
+        await self._acquire(exec_id)
+        try:
+            return await execute()
+        finally:
+            self._release()
+
+    async def _acquire(self, exec_id):
+        if not self.limited or (self.in_flight < self.max_runs and not self._waiting):
+            self.in_flight += 1
+            return
+
+        slot = asyncio.get_event_loop().create_future()
+        self._waiting.setdefault(exec_id, deque()).append(slot)
+        try:
+            await slot
+        except asyncio.CancelledError:
+            if slot.done() and not slot.cancelled():
+                # the slot was handed over just as the run was cancelled, pass it on
+                self._release()
+            else:
+                self._discard(exec_id, slot)
+            raise
+
+    def _discard(self, exec_id, slot):
+        queue = self._waiting.get(exec_id)
+        if queue is not None and slot in queue:
+            queue.remove(slot)
+            if not queue:
+                del self._waiting[exec_id]
+
+    def _release(self):
+        self.in_flight -= 1
+        while self._waiting and (not self.limited or self.in_flight < self.max_runs):
+            exec_id, queue = next(iter(self._waiting.items()))
+            slot = queue.popleft()
+            if queue:
+                # the execution goes to the back of the line, after every other waiting execution
+                self._waiting.move_to_end(exec_id)
+            else:
+                del self._waiting[exec_id]
+
+            if not slot.done():
+                self.in_flight += 1
+                slot.set_result(None)
@@ -0,0 +1,261 @@
+"""
+Scoring of model runs.
+
+Each parameter in the 'model_analysis' section is reduced to a single value by its 'objective',
+which is then scored by its distance from the parameter's 'target':
+
+    last        the value in the last row of the output file (the default)
+    mean        the mean of the whole series
+    min, max    the minimum / maximum of the whole series
+    percentile  the 'percentile' (0-100) of the series
+    time_above  the fraction of the simulated time in which the value is above 'threshold'
+    time_below  the fraction of the simulated time in which the value is below 'threshold'
+    rmse        the root mean square error against 'target_series', a list of [jday, value] pairs.
+                The target of an rmse parameter defaults to 0
+
+All objectives other than last can be limited to a time window with 'start' and 'end' (in julian days).
+The first column of the output file is the time of each row.
+
+The values of a run are keyed by parameter: the name of the column for its last value, or the name along with
+the objective, its option and the window otherwise, e.g. 'DO:percentile(10)[100:200]'.
+"""
+import csv
+import re
+
+import numpy as np
+
+TRAILING_SEPARATOR = re.compile(r',[ \t]*$', re.MULTILINE)
+
+
+class MalformedOutputError(Exception):
+    pass
+
+
+class DuplicateParameterError(Exception):
+    def __init__(self, key):
+        self.key = key
+        super().__init__(f'parameter {key} is defined more than once, with different objectives')
+
+
+def get_run_parameter_value(param_name, contents):
+    """
+    Parses outfile contents and extracts the value for the field named as `param_name` from the last row
+    """
+
+    # read the header + the last line, and strip whitespace from field names
+    header = ','.join([c.lstrip() for c in contents[0].split(',')]) + '\n'
+    reader = csv.DictReader([header, contents[-1]])
+    return float(next(reader)[param_name])
+
+
+def _blank_fields(buffer, starts, ends):
+    """
+    Returns whether each of the fields between the starts and ends positions of the buffer is only whitespace
+    """
+    lengths = ends - starts
+    blank = lengths == 0
+    check = np.flatnonzero(lengths > 0)
+    if check.size:
+        width = np.arange(lengths[check].max())
+        field_bytes = buffer[np.minimum(starts[check, None] + width, buffer.size - 1)]
+        whitespace = (field_bytes == ord(' ')) | (field_bytes == ord('\t')) | (field_bytes == ord('\r'))
+        blank[check] = (whitespace | (width >= lengths[check, None])).all(axis=1)
+    return blank
+
+
+def _field_separators(buffer):
+    """
+    Returns the positions of the separators of the fields in the rows of the output file, and whether each
+    of them ends a row. Trailing separators and blank lines are skipped, like TRAILING_SEPARATOR does
+    """
+    separators = np.flatnonzero((buffer == ord(',')) | (buffer == ord('\n')))
+    newlines = buffer[separators] == ord('\n')
+
+    # only the last field of a row can make the row a blank line, or its separator a trailing separator
+    ends = np.flatnonzero(newlines)
+    previous = np.maximum(ends - 1, 0)
+    single = np.flatnonzero((ends == 0) | newlines[previous])
+    blank = single[_blank_fields(buffer, np.where(ends[single] == 0, 0, separators[previous[single]] + 1),
+                                 separators[ends[single]])]
+    trailing = (ends > 0) & ~newlines[previous] & \
+        _blank_fields(buffer, separators[previous] + 1, separators[ends])
+
+    skipped = np.concatenate((ends[trailing] - 1, ends[blank]))
+    if skipped.size:
+        keep = np.ones(separators.size, dtype=bool)
+        keep[skipped] = False
+        separators, newlines = separators[keep], newlines[keep]
+    return separators, newlines
+
+
+def load_output_columns(contents, names):
+    """
+    Parses the outfile contents into arrays, and returns the time column along with the columns in `names`
+    """
+    header = [c.strip() for c in TRAILING_SEPARATOR.sub('', contents[0].rstrip('\r\n')).split(',')]
+    try:
+        indices = [header.index(name) for name in names]
+    except ValueError as e:
+        raise KeyError(str(e))
+
+    data = ''.join(contents[1:])
+    buffer = np.frombuffer((data if data.endswith('\n') else data + '\n').encode(), dtype=np.uint8)
+    separators, newlines = _field_separators(buffer)
+    if separators.size % len(header) != 0 or \
+            (newlines.reshape(-1, len(header)) != (np.arange(len(header)) == len(header) - 1)).any():
+        raise MalformedOutputError(f'expected {len(header)} values in every row of the output file')
+
+    # only the fields of the time column and the requested columns are parsed: they are copied into a table
+    # of fixed width fields padded with spaces, which is parsed as a single sequence of numbers
+    columns = sorted(set([0] + indices))
+    starts = np.concatenate(([0], separators + 1))[:-1].reshape(-1, len(header))[:, columns].ravel()
+    lengths = separators.reshape(-1, len(header))[:, columns].ravel() - starts
+    width = lengths.max(initial=0) + 1
+    padded = np.concatenate((buffer, np.full(width, ord(' '), dtype=np.uint8)))
+    field_bytes = np.lib.stride_tricks.sliding_window_view(padded, width)[starts]
+    # the skipped separators and blank lines are whitespace within the fields
+    field_bytes = np.where((np.arange(width) >= lengths[:, None]) | (field_bytes == ord(',')), ord(' '),
+                           field_bytes).astype(np.uint8)
+    try:
+        # a field that isn't a number ends the sequence early, or raises an error in newer versions of numpy
+        values = np.fromstring(field_bytes.tobytes().decode('latin-1'), sep=' ')
+    except ValueError:
+        values = None
+    if values is None or values.size != starts.size:
+        raise MalformedOutputError(f'the columns {[header[i] for i in columns]} of the output file must be numeric')
+
+    table = values.reshape(-1, len(columns))
+    return table[:, columns.index(0)], {name: table[:, columns.index(i)] for name, i in zip(names, indices)}
+
+
+def _time_fraction(time, condition):
+    if len(time) < 2:
+        return float(condition.all())
+    durations = np.diff(time)
+    return float(durations[condition[:-1]].sum() / durations.sum())
+
+
+def _rmse(time, series, param):
+    target_series = np.array(param['target_series'], dtype=float).reshape(-1, 2)
+    predicted = np.interp(target_series[:, 0], time, series)
+    return float(np.sqrt(np.mean((predicted - target_series[:, 1]) ** 2)))
+
+
+OBJECTIVES = {
+    'mean': lambda time, series, param: float(series.mean()),
+    'min': lambda time, series, param: float(series.min()),
+    'max': lambda time, series, param: float(series.max()),
+    'percentile': lambda time, series, param: float(np.percentile(series, float(param.get('percentile', 50)))),
+    'time_above': lambda time, series, param: _time_fraction(time, series > float(param['threshold'])),
+    'time_below': lambda time, series, param: _time_fraction(time, series < float(param['threshold'])),
+    'rmse': _rmse,
+}
+
+
+def get_objective(param):
+    return param.get('objective', 'last')
+
+
+# the option of each objective that changes the value of the parameter
+OBJECTIVE_OPTIONS = {
+    'percentile': ('percentile', 50),
+    'time_above': ('threshold', None),
+    'time_below': ('threshold', None),
+}
+
+# the fields of a parameter that only change how its value is scored
+SCORE_FIELDS = {'target', 'weight', 'score_step'}
+
+
+def get_parameter_key(param):
+    """
+    Returns the key of the value of the parameter in the values of a run
+    """
+    objective = get_objective(param)
+    if objective == 'last':
+        return param['name']
+
+    key = f"{param['name']}:{objective}"
+    if objective in OBJECTIVE_OPTIONS:
+        option, default = OBJECTIVE_OPTIONS[objective]
+        key += f"({param.get(option, default)})"
+    if 'start' in param or 'end' in param:
+        key += f"[{param.get('start', '')}:{param.get('end', '')}]"
+    return key
+
+
+def get_parameter_keys(model_analysis):
+    """
+    Returns the key of the value of each parameter in the 'model_analysis' section. Parameters with the same key
+    share their value, so they can only differ in how it's scored
+    """
+    keys, objectives = [], {}
+    for param in model_analysis['parameters']:
+        key = get_parameter_key(param)
+        objective = {field: value for field, value in param.items() if field not in SCORE_FIELDS}
+        if objectives.setdefault(key, objective) != objective:
+            raise DuplicateParameterError(key)
+        keys.append(key)
+    return keys
+
+
+def get_series_parameter_value(param, time, series):
+    """
+    Reduces the series of a parameter to a single value, according to its objective
+    """
+    if 'start' in param or 'end' in param:
+        window = (time >= float(param.get('start', -np.inf))) & (time <= float(param.get('end', np.inf)))
+        time, series = time[window], series[window]
+    return OBJECTIVES[get_objective(param)](time, series, param)
+
+
+def get_run_parameter_values(model_analysis, contents):
+    """
+    Extracts the value of every parameter in the 'model_analysis' section from the outfile contents
+    """
+    params = dict(zip(get_parameter_keys(model_analysis), model_analysis['parameters']))
+    param_values = {key: get_run_parameter_value(p['name'], contents)
+                    for key, p in params.items() if get_objective(p) == 'last'}
+
+    # the output file is only loaded as a whole if a parameter needs more than its last value
+    series_params = {key: p for key, p in params.items() if get_objective(p) != 'last'}
+    if series_params:
+        time, columns = load_output_columns(contents, list(dict.fromkeys(p['name'] for p in series_params.values())))
+        for key, p in series_params.items():
+            param_values[key] = get_series_parameter_value(p, time, columns[p['name']])
+
+    return param_values
+
+
+def calc_param_score(value, target, score_step, weight):
+
+    distance = abs(target - value)
+    return (distance/score_step)/weight
+
+
+def get_values_score(model_analysis, param_values):
+    """
+    Scores the values of the parameters in the 'model_analysis' section, that were extracted from a run
+    """
+    param_scores = []
+    for key, param in zip(get_parameter_keys(model_analysis), model_analysis['parameters']):
+        param_scores.append(calc_param_score(param_values[key], float(
+            param.get('target', 0)), float(param['score_step']), float(param['weight'])))
+
+    return sum(param_scores)
+
+
+def get_run_score(params, outfile_contents):
+    """
+    Based on the params field 'model_analysis' find the run for this score
+    """
+    param_values = get_run_parameter_values(params['model_analysis'], outfile_contents)
+    return get_values_score(params['model_analysis'], param_values)
+
+
+def score_run(model_analysis, outfile_contents):
+    """
+    Returns the score record of a run: the values of the analysis parameters, and the score they add up to
+    """
+    param_values = get_run_parameter_values(model_analysis, outfile_contents)
+    return {"values": param_values, "score": get_values_score(model_analysis, param_values)}
@@ -0,0 +1,149 @@
+import contextlib
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger()
+logger.setLevel(logging.DEBUG)
+
+SCRATCH_DIR = os.environ.get("WQDSS_SCRATCH_DIR", os.path.join(tempfile.gettempdir(), "wqdss-scratch"))
+
+# the number of emptied run directories that are kept for reuse
+SCRATCH_POOL_SIZE = int(os.environ.get("WQDSS_SCRATCH_POOL_SIZE", "8"))
+
+# the number of run directories of failed runs that are kept for debugging, the oldest ones are removed first
+KEEP_FAILED_RUNS = int(os.environ.get("WQDSS_KEEP_FAILED_RUNS", "0"))
+
+# new runs wait while there is less free disk space than this, and fail if it isn't freed in time
+SCRATCH_MIN_FREE = int(os.environ.get("WQDSS_SCRATCH_MIN_FREE_MB", "1024")) * 1024 * 1024
+SCRATCH_WAIT_SECONDS = float(os.environ.get("WQDSS_SCRATCH_WAIT_SECONDS", "600"))
+
+FAILED_DIR = "failed"
+RUN_DIR_PATTERN = re.compile(r'^run-(\d+)-')
+
+
+class ScratchSpaceFullError(Exception):
+    def __init__(self, base_dir, free):
+        self.base_dir = base_dir
+        self.free = free
+        super().__init__(f'only {free} bytes are free in {base_dir}')
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def clear_dir(path):
+    '''
+    Removes the files in the directory tree, but keeps the directories so they can be reused
+    '''
+    for root, _, files in os.walk(path):
+        for f in files:
+            os.unlink(os.path.join(root, f))
+
+
+class ScratchSpace:
+    """
+    The run directories of a worker process. Run directories are emptied once the files of the run were
+    collected, and kept in a pool for the next runs. The directories of failed runs can be kept for debugging.
+    New runs wait while the disk is low on free space, so runs don't fail halfway through for lack of space.
+    Directories that were left behind by worker processes that are no longer alive are removed on first use
+    """
+
+    def __init__(self, base_dir=SCRATCH_DIR, pool_size=SCRATCH_POOL_SIZE, keep_failed=KEEP_FAILED_RUNS,
+                 min_free=SCRATCH_MIN_FREE, wait_seconds=SCRATCH_WAIT_SECONDS, poll_interval=1.0):
+        self.base_dir = base_dir
+        self.pool_size = pool_size
+        self.keep_failed = keep_failed
+        self.min_free = min_free
+        self.wait_seconds = wait_seconds
+        self.poll_interval = poll_interval
+        self._pool = []
+        self._lock = threading.Lock()
+        self._initialized = False
+
+    def _init(self):
+        with self._lock:
+            if self._initialized:
+                return
+            os.makedirs(os.path.join(self.base_dir, FAILED_DIR), exist_ok=True)
+            self._remove_orphans()
+            self._initialized = True
+
+    def _remove_orphans(self):
+        for name in os.listdir(self.base_dir):
+            match = RUN_DIR_PATTERN.match(name)
+            if match and not _pid_alive(int(match.group(1))):
+                logger.info(f"removing orphaned run directory {name}")
+                shutil.rmtree(os.path.join(self.base_dir, name), ignore_errors=True)
+
+    def free_space(self):
+        return shutil.disk_usage(self.base_dir).free
+
+    def _wait_for_space(self):
+        deadline = time.monotonic() + self.wait_seconds
+        free = self.free_space()
+        while free < self.min_free:
+            if time.monotonic() >= deadline:
+                raise ScratchSpaceFullError(self.base_dir, free)
+            logger.warning(f"only {free} bytes are free in {self.base_dir}, waiting before starting a run")
+            time.sleep(self.poll_interval)
+            free = self.free_space()
+
+    def acquire(self):
+        '''
+        Returns an empty run directory
+        '''
+        self._init()
+        self._wait_for_space()
+        with self._lock:
+            if self._pool:
+                return self._pool.pop()
+        return tempfile.mkdtemp(prefix=f'run-{os.getpid()}-', dir=self.base_dir)
+
+    def release(self, run_dir, failed=False):
+        if failed and self.keep_failed > 0:
+            kept = os.path.join(self.base_dir, FAILED_DIR, os.path.basename(run_dir))
+            logger.info(f"keeping the run directory of a failed run in {kept}")
+            os.rename(run_dir, kept)
+            self._prune_failed()
+            return
+
+        with self._lock:
+            reuse = len(self._pool) < self.pool_size
+        if not reuse:
+            shutil.rmtree(run_dir, ignore_errors=True)
+            return
+
+        clear_dir(run_dir)
+        with self._lock:
+            self._pool.append(run_dir)
+
+    def _prune_failed(self):
+        failed_dir = os.path.join(self.base_dir, FAILED_DIR)
+        kept = sorted(os.listdir(failed_dir), key=lambda name: os.path.getmtime(os.path.join(failed_dir, name)))
+        for name in kept[:-self.keep_failed]:
+            shutil.rmtree(os.path.join(failed_dir, name), ignore_errors=True)
+
+    @contextlib.contextmanager
+    def run_dir(self):
+        '''
+        Provides a run directory, which is released when the run is done with it
+        '''
+        run_dir = self.acquire()
+        try:
+            yield run_dir
+        except BaseException:
+            self.release(run_dir, failed=True)
+            raise
+        self.release(run_dir)
@@ -0,0 +1,611 @@
+import itertools
+import logging
+import math
+
+import numpy as np
+
+from .model_execution import ModelExecutionPermutation
+
+logger = logging.getLogger()
+logger.setLevel(logging.DEBUG)
+
+DEFAULT_SEARCH = "grid"
+
+
+class NonEqualStepNumber(Exception):
+    pass
+
+
+class UnknownSearchStrategy(Exception):
+    def __init__(self, search):
+        self.search = search
+        super().__init__(f'search strategy {search} is not supported')
+
+
+def generate_permutations(params, best_runs, iteration):
+    '''
+    Iterates over the input files, and the defined range of values for qwd in each of these files.
+    Returns the set of all relevant permutation values for the input files
+    '''
+    inputs = params['model_run']['input_files']
+    if iteration == 0:
+        ranges = {i['name']: values_range(float(i['min_val']), float(
+            i['max_val']), float(i['steps'][0])) for i in inputs}
+    else:
+        # build the new set of ranges, each range is [best_value - prev_step/2, best_value + prev_step/2, curr_step]
+        ranges = {}
+        for in_file in inputs:
+            file_name = in_file["name"]
+            half_prev_step = float(in_file["steps"][iteration-1])/2.0
+            curr_step = float(in_file["steps"][iteration])
+            best_value = best_runs[-1]["params"].values[file_name]
+            ranges[file_name] = values_range(best_value-half_prev_step, best_value+half_prev_step, curr_step)
+
+    # for now, get a full cartesian product of the parameter values
+    run_values = itertools.product(*ranges.values())
+
+    input_file_names = ranges.keys()
+    input_file_columns = [i['col_name'] for i in inputs]
+
+    # each value in run_values includes the value to be used for each input
+    # file. Now, create a dict that will hold all the necessary information:
+    # input_file: (column_name, value)
+    permutations = [
+        ModelExecutionPermutation(input_file_names, input_file_columns, r) for r in run_values]
+
+    return permutations
+
+
+def values_range(min_val, max_val, step):
+    '''
+    Yields all values in the range [min_val, max_val] with a given step
+    '''
+    cur_val = min_val
+    i = 0
+    while cur_val < max_val:
+        cur_val = min_val + (i * step)
+        if cur_val <= max_val:
+            yield cur_val
+        i = i + 1
+
+
+class SearchDimension:
+    '''
+    A single input file whose column is searched over, bounded by [min_val, max_val]
+    '''
+
+    def __init__(self, input_file):
+        self.name = input_file['name']
+        self.column = input_file['col_name']
+        self.min_val = float(input_file['min_val'])
+        self.max_val = float(input_file['max_val'])
+        self.steps = [float(s) for s in input_file['steps']]
+
+    @property
+    def span(self):
+        return self.max_val - self.min_val
+
+    def snap(self, value, step=None):
+        '''
+        Returns the grid point (min_val + k * step) closest to value, within the bounds of the dimension
+        '''
+        step = step or self.steps[-1]
+        value = min(max(value, self.min_val), self.max_val)
+        snapped = self.min_val + round((value - self.min_val) / step) * step
+        if snapped > self.max_val:
+            snapped -= step
+        return round(snapped, 10)
+
+    def to_unit(self, value):
+        return (value - self.min_val) / self.span if self.span else 0.0
+
+    def from_unit(self, unit_value):
+        return self.snap(self.min_val + unit_value * self.span)
+
+
+class SearchStrategy:
+    '''
+    Decides which permutations are executed in each iteration of an execution.
+
+    next_permutations is called before each iteration with all of the runs completed so far,
+    as a list of (permutation, score) tuples, and the best run of every previous iteration.
+    An empty list of permutations ends the execution.
+    '''
+
+    def __init__(self, params):
+        self.params = params
+        self.options = params['model_run'].get('search_options', {})
+        self.dimensions = [SearchDimension(i) for i in params['model_run']['input_files']]
+        self.max_runs = int(self.options.get('max_runs', self.default_max_runs()))
+        self.rng = np.random.default_rng(self.options.get('seed'))
+
+    def default_max_runs(self):
+        return 25 * len(self.dimensions)
+
+    def next_permutations(self, iteration, runs, best_runs):
+        raise NotImplementedError()
+
+    def permutation(self, values):
+        return ModelExecutionPermutation([d.name for d in self.dimensions],
+                                         [d.column for d in self.dimensions], list(values))
+
+    def key(self, values):
+        return tuple(round(v, 10) for v in values)
+
+    def run_values(self, permutation):
+        return self.key(permutation.values[d.name] for d in self.dimensions)
+
+    def scores(self, runs):
+        '''
+        Returns a dict of the best score for each set of values that was already executed
+        '''
+        scores = {}
+        for permutation, score in runs:
+            k = self.run_values(permutation)
+            scores[k] = min(score, scores.get(k, score))
+        return scores
+
+    def new_permutations(self, candidates, runs):
+        '''
+        Returns permutations for the candidate values which weren't executed yet, within the run budget
+        '''
+        executed = self.scores(runs)
+        budget = self.max_runs - len(runs)
+        new_values = []
+        for values in candidates:
+            k = self.key(values)
+            if k not in executed and k not in new_values:
+                new_values.append(k)
+
+        return [self.permutation(v) for v in new_values[:max(budget, 0)]]
+
+    def center(self):
+        return self.key(d.snap(d.min_val + d.span / 2, d.steps[0]) for d in self.dimensions)
+
+
+class GridSearch(SearchStrategy):
+    '''
+    A full cartesian product of the values of all inputs. Each iteration refines the grid
+    around the best run of the previous iteration, with the next step of every input
+    '''
+
+    def __init__(self, params):
+        super().__init__(params)
+        self.num_iterations = self.get_num_iterations(params)
+
+    def get_num_iterations(self, params):
+        input_files = params["model_run"]["input_files"]
+        all_iteration_counts = set(len(i["steps"]) for i in input_files)
+
+        if len(all_iteration_counts) > 1:
+            raise NonEqualStepNumber(all_iteration_counts)
+
+        return all_iteration_counts.pop()
+
+    def next_permutations(self, iteration, runs, best_runs):
+        if iteration >= self.num_iterations:
+            return []
+        return generate_permutations(self.params, best_runs, iteration)
+
+
+class AdaptiveGridSearch(SearchStrategy):
+    '''
+    A grid search whose refinements are allocated by the sensitivity of the score to each input.
+    The sensitivity of an input is how much the score changes within a step of the previous grid,
+    along the line of that input through the best run so far. Each iteration refines the grid around
+    the best run, with more points on inputs the score is sensitive to (down to their finest step),
+    and without refining inputs whose sensitivity is below flat_tolerance of the most sensitive input
+    '''
+
+    def __init__(self, params):
+        super().__init__(params)
+        self.num_iterations = max(len(d.steps) for d in self.dimensions)
+        self.flat_tolerance = float(self.options.get('flat_tolerance', 0.05))
+
+    def default_max_runs(self):
+        return 10 ** 6
+
+    def step(self, dim, iteration):
+        return dim.steps[min(iteration, len(dim.steps) - 1)]
+
+    def sensitivity(self, dim_index, best, scores, distance):
+        '''
+        Returns the largest change of the score within distance of the best run along the input,
+        or None if there are no runs to estimate it from
+        '''
+        best_score = scores[best]
+        changes = [abs(score - best_score) for values, score in scores.items()
+                   if values != best and abs(values[dim_index] - best[dim_index]) <= distance + 1e-9 and
+                   all(v == b for i, (v, b) in enumerate(zip(values, best)) if i != dim_index)]
+        return max(changes) if changes else None
+
+    def num_points(self, iteration, best, scores):
+        '''
+        Returns the number of points of each input in the next grid
+        '''
+        base, sensitivities = [], []
+        for i, d in enumerate(self.dimensions):
+            prev_step, step = self.step(d, iteration - 1), self.step(d, iteration)
+            base.append(int(round(prev_step / step)) + 1)
+            sensitivities.append(self.sensitivity(i, best, scores, prev_step))
+
+        known = [s for s in sensitivities if s is not None]
+        max_sensitivity = max(known) if known else 0.0
+        points = []
+        for n, sensitivity in zip(base, sensitivities):
+            if sensitivity is None or max_sensitivity == 0.0:
+                points.append(n)
+                continue
+            relative = sensitivity / max_sensitivity
+            points.append(1 if relative < self.flat_tolerance else max(2, math.ceil(2 * n * relative)))
+        return points
+
+    def next_permutations(self, iteration, runs, best_runs):
+        if iteration >= self.num_iterations:
+            return []
+        if iteration == 0:
+            candidates = itertools.product(*[values_range(d.min_val, d.max_val, self.step(d, 0))
+                                             for d in self.dimensions])
+            return self.new_permutations(candidates, runs)
+
+        scores = self.scores(runs)
+        best = min(scores, key=scores.get)
+        axes = []
+        for d, v, n in zip(self.dimensions, best, self.num_points(iteration, best, scores)):
+            if n == 1:
+                axes.append([v])
+                continue
+            half_prev_step = self.step(d, iteration - 1) / 2.0
+            low, high = max(d.min_val, v - half_prev_step), min(d.max_val, v + half_prev_step)
+            axes.append(list(dict.fromkeys(d.snap(x) for x in np.linspace(low, high, n))))
+
+        logger.info(f'refining {[len(a) for a in axes]} points of each input around {best}')
+        return self.new_permutations(itertools.product(*axes), runs)
+
+
+class BeamSearch(SearchStrategy):
+    '''
+    A grid search that refines the grid around the beam_width best runs, instead of only around the best run,
+    so a sweep doesn't lock onto a single local minimum. A run is only refined if there is no better run within
+    a step of the previous grid from it, so the beam follows separate minima rather than the neighbours of the
+    best run. Points shared by neighbourhoods are executed once. The runs left in the budget are split evenly
+    between the remaining iterations, and when an iteration doesn't have the budget for all of its points,
+    the points of better runs, and the points closest to them, are executed first
+    '''
+
+    def __init__(self, params):
+        self.beam_width = int(params['model_run'].get('search_options', {}).get('beam_width', 3))
+        super().__init__(params)
+        self.num_iterations = max(len(d.steps) for d in self.dimensions)
+
+    def step(self, dim, iteration):
+        return dim.steps[min(iteration, len(dim.steps) - 1)]
+
+    def default_max_runs(self):
+        # the full grid, and a full neighbourhood for every parent in each refinement
+        runs = int(np.prod([len(list(values_range(d.min_val, d.max_val, d.steps[0]))) for d in self.dimensions]))
+        for iteration in range(1, max(len(d.steps) for d in self.dimensions)):
+            runs += self.beam_width * int(np.prod(
+                [int(round(self.step(d, iteration - 1) / self.step(d, iteration))) + 1 for d in self.dimensions]))
+        return runs
+
+    def parents(self, iteration, scores):
+        '''
+        Returns the best runs so far that have no better run within a step of the previous grid
+        '''
+        prev_steps = np.array([self.step(d, iteration - 1) for d in self.dimensions]) + 1e-9
+        ordered = sorted(scores, key=scores.get)
+        points = np.array(ordered)
+        parents = []
+        for i, values in enumerate(ordered):
+            if len(parents) == self.beam_width:
+                break
+            if not np.all(np.abs(points[:i] - points[i]) <= prev_steps, axis=1).any():
+                parents.append(values)
+        return parents
+
+    def neighbourhood(self, iteration, parent):
+        '''
+        Returns the points of the next grid within half a step of the previous grid from the parent,
+        the closest points first
+        '''
+        axes = []
+        for d, v in zip(self.dimensions, parent):
+            half_prev_step = self.step(d, iteration - 1) / 2.0
+            axes.append(values_range(max(d.min_val, v - half_prev_step), min(d.max_val, v + half_prev_step),
+                                     self.step(d, iteration)))
+        return sorted(itertools.product(*axes), key=lambda values: sum(
+            ((v - p) / self.step(d, iteration - 1)) ** 2 for d, v, p in zip(self.dimensions, values, parent)))
+
+    def next_permutations(self, iteration, runs, best_runs):
+        if iteration >= self.num_iterations:
+            return []
+        if iteration == 0:
+            candidates = itertools.product(*[values_range(d.min_val, d.max_val, d.steps[0]) for d in self.dimensions])
+            return self.new_permutations(candidates, runs)
+
+        scores = self.scores(runs)
+        parents = self.parents(iteration, scores)
+        candidates = itertools.chain.from_iterable(self.neighbourhood(iteration, p) for p in parents)
+        permutations = self.new_permutations(candidates, runs)
+
+        budget = math.ceil((self.max_runs - len(runs)) / (self.num_iterations - iteration))
+        logger.info(f'refining around {len(parents)} runs, {len(permutations)} new points with a budget of {budget}')
+        return permutations[:max(budget, 0)]
+
+
+class CoordinateSearch(SearchStrategy):
+    '''
+    Searches one input at a time over its range, while the other inputs are held at their best values so far.
+    After all inputs were searched with a step, the search is repeated around the best values with the next step
+    '''
+
+    def __init__(self, params):
+        super().__init__(params)
+        self.num_levels = max(len(d.steps) for d in self.dimensions)
+
+    def next_permutations(self, iteration, runs, best_runs):
+        scores = self.scores(runs)
+        while iteration < self.num_levels * len(self.dimensions):
+            level, dim_index = divmod(iteration, len(self.dimensions))
+            best = min(scores, key=scores.get) if scores else self.center()
+            dim = self.dimensions[dim_index]
+            step = dim.steps[min(level, len(dim.steps) - 1)]
+            if level == 0:
+                low, high = dim.min_val, dim.max_val
+            else:
+                half_prev_step = dim.steps[min(level - 1, len(dim.steps) - 1)] / 2.0
+                low = max(dim.min_val, best[dim_index] - half_prev_step)
+                high = min(dim.max_val, best[dim_index] + half_prev_step)
+
+            candidates = []
+            for value in values_range(low, high, step):
+                values = list(best)
+                values[dim_index] = value
+                candidates.append(values)
+
+            permutations = self.new_permutations(candidates, runs)
+            if permutations or len(runs) >= self.max_runs:
+                return permutations
+
+            # every point on this line was already executed, move on to the next input
+            iteration += 1
+
+        return []
+
+
+class NelderMeadSearch(SearchStrategy):
+    '''
+    The Nelder-Mead simplex method. To keep the workers busy, each iteration executes the reflection,
+    expansion and both contraction points of the current simplex together (or all shrunk vertices).
+    The search ends when the simplex is smaller than the finest step of every input, or the run budget is used up
+    '''
+
+    def __init__(self, params):
+        super().__init__(params)
+        self.simplex = None
+        self.pending = None
+
+    def default_max_runs(self):
+        return 15 * (len(self.dimensions) + 1)
+
+    def initial_simplex(self):
+        center = self.center()
+        vertices = [center]
+        for i, d in enumerate(self.dimensions):
+            vertex = list(center)
+            vertex[i] = d.snap(center[i] + d.steps[0]) if center[i] + d.steps[0] <= d.max_val \
+                else d.snap(center[i] - d.steps[0])
+            vertices.append(self.key(vertex))
+        return vertices
+
+    def snap(self, point):
+        return self.key(d.snap(v) for d, v in zip(self.dimensions, point))
+
+    def candidates(self):
+        ordered = sorted(self.simplex, key=lambda v: v[1])
+        centroid = np.mean([v[0] for v in ordered[:-1]], axis=0)
+        worst = np.array(ordered[-1][0])
+        return {
+            'reflection': self.snap(centroid + (centroid - worst)),
+            'expansion': self.snap(centroid + 2 * (centroid - worst)),
+            'outside': self.snap(centroid + 0.5 * (centroid - worst)),
+            'inside': self.snap(centroid - 0.5 * (centroid - worst)),
+        }
+
+    def shrink(self):
+        best = np.array(min(self.simplex, key=lambda v: v[1])[0])
+        return [self.snap(best + 0.5 * (np.array(v[0]) - best)) for v in self.simplex]
+
+    def converged(self):
+        points = np.array([v[0] for v in self.simplex])
+        size = points.max(axis=0) - points.min(axis=0)
+        return all(s < d.steps[-1] for s, d in zip(size, self.dimensions))
+
+    def update(self, scores):
+        '''
+        Applies the pending step of the method, once the scores of all of its points are known
+        '''
+        kind, points = self.pending
+        self.pending = None
+        if kind == 'init':
+            self.simplex = [(p, scores[p]) for p in points]
+            return
+        if kind == 'shrink':
+            best = min(self.simplex, key=lambda v: v[1])
+            self.simplex = [best] + [(p, scores[p]) for p in points if p != best[0]][:len(self.dimensions)]
+            return
+
+        ordered = sorted(self.simplex, key=lambda v: v[1])
+        best, second_worst, worst = ordered[0][1], ordered[-2][1], ordered[-1][1]
+        f = {name: scores[p] for name, p in points.items()}
+        if f['reflection'] < best:
+            name = 'expansion' if f['expansion'] < f['reflection'] else 'reflection'
+        elif f['reflection'] < second_worst:
+            name = 'reflection'
+        elif f['reflection'] < worst:
+            name = 'outside' if f['outside'] <= f['reflection'] else None
+        else:
+            name = 'inside' if f['inside'] < worst else None
+
+        if name is None:
+            self.pending = ('shrink', self.shrink())
+        else:
+            self.simplex = ordered[:-1] + [(points[name], f[name])]
+
+    def next_permutations(self, iteration, runs, best_runs):
+        scores = self.scores(runs)
+        if self.simplex is None and self.pending is None:
+            self.pending = ('init', self.initial_simplex())
+
+        # points that were already executed don't need to run again, so keep stepping until new points are needed
+        for _ in range(self.max_runs):
+            if self.pending is not None:
+                kind, points = self.pending
+                point_list = list(points.values()) if kind not in ('init', 'shrink') else points
+                if all(p in scores for p in point_list):
+                    self.update(scores)
+                    continue
+                return self.new_permutations(point_list, runs)
+
+            if self.converged() or len(runs) >= self.max_runs:
+                return []
+            self.pending = ('step', self.candidates())
+
+        return []
+
+
+def latin_hypercube(rng, num_samples, num_dimensions):
+    '''
+    Returns num_samples points in the unit cube, such that each dimension has exactly one sample in each stratum
+    '''
+    strata = np.array([rng.permutation(num_samples) for _ in range(num_dimensions)]).T
+    return (strata + rng.random((num_samples, num_dimensions))) / num_samples
+
+
+class LatinHypercubeSearch(SearchStrategy):
+    '''
+    Samples the inputs with a latin hypercube. Each following iteration samples a box around the best run so far,
+    half the size of the previous one, so the number of iterations is the number of steps of the inputs
+    '''
+
+    def __init__(self, params):
+        super().__init__(params)
+        self.num_samples = int(self.options.get('samples', 10 * len(self.dimensions)))
+        self.num_iterations = max(len(d.steps) for d in self.dimensions)
+
+    def default_max_runs(self):
+        return 10 * len(self.dimensions) * max(len(d.steps) for d in self.dimensions)
+
+    def next_permutations(self, iteration, runs, best_runs):
+        if iteration >= self.num_iterations:
+            return []
+
+        scores = self.scores(runs)
+        box_size = 0.5 ** iteration
+        if scores:
+            best = min(scores, key=scores.get)
+            low = [min(max(d.to_unit(v) - box_size / 2, 0.0), 1.0 - box_size) for d, v in zip(self.dimensions, best)]
+        else:
+            low = [0.0] * len(self.dimensions)
+
+        samples = latin_hypercube(self.rng, self.num_samples, len(self.dimensions))
+        candidates = [[d.from_unit(lo + box_size * s) for d, lo, s in zip(self.dimensions, low, sample)]
+                      for sample in samples]
+        return self.new_permutations(candidates, runs)
+
+
+def expected_improvement(mean, std, best):
+    '''
+    Expected improvement (for minimization) over best, of normally distributed predictions
+    '''
+    std = np.maximum(std, 1e-12)
+    z = (best - mean) / std
+    cdf = 0.5 * (1 + np.array([math.erf(v / math.sqrt(2)) for v in z]))
+    pdf = np.exp(-0.5 * z ** 2) / math.sqrt(2 * math.pi)
+    return (best - mean) * cdf + std * pdf
+
+
+def gaussian_process(x_train, y_train, x_predict, length_scale, noise=1e-6):
+    '''
+    Returns the mean and standard deviation of a gaussian process with an RBF kernel, fitted to the training points
+    '''
+    def kernel(a, b):
+        distances = ((a[:, None, :] - b[None, :, :]) ** 2).sum(axis=-1)
+        return np.exp(-0.5 * distances / length_scale ** 2)
+
+    y_mean, y_std = y_train.mean(), y_train.std() or 1.0
+    y_normalized = (y_train - y_mean) / y_std
+
+    cholesky = np.linalg.cholesky(kernel(x_train, x_train) + noise * np.eye(len(x_train)))
+    alpha = np.linalg.solve(cholesky.T, np.linalg.solve(cholesky, y_normalized))
+    k_predict = kernel(x_predict, x_train)
+    mean = k_predict @ alpha
+    v = np.linalg.solve(cholesky, k_predict.T)
+    variance = np.maximum(1.0 - (v ** 2).sum(axis=0), 0.0)
+    return mean * y_std + y_mean, np.sqrt(variance) * y_std
+
+
+class BayesianSearch(SearchStrategy):
+    '''
+    Bayesian optimization: after an initial latin hypercube sample, a gaussian process is fitted to the scores
+    of all runs, and each iteration executes the candidates with the highest expected improvement
+    '''
+
+    def __init__(self, params):
+        super().__init__(params)
+        self.initial_samples = int(self.options.get('initial_samples', 2 * len(self.dimensions) + 2))
+        self.batch_size = int(self.options.get('batch_size', 4))
+        self.num_candidates = int(self.options.get('candidates', 1000))
+        self.length_scale = float(self.options.get('length_scale', 0.2))
+
+    def default_max_runs(self):
+        return 10 * len(self.dimensions) + 10
+
+    def next_permutations(self, iteration, runs, best_runs):
+        if len(runs) >= self.max_runs:
+            return []
+
+        if iteration == 0:
+            samples = latin_hypercube(self.rng, self.initial_samples, len(self.dimensions))
+            return self.new_permutations([self.from_unit(s) for s in samples], runs)
+
+        scores = self.scores(runs)
+        x_train = np.array([[d.to_unit(v) for d, v in zip(self.dimensions, k)] for k in scores])
+        y_train = np.array(list(scores.values()))
+
+        candidates = [self.from_unit(s) for s in self.rng.random((self.num_candidates, len(self.dimensions)))]
+        candidates = [c for c in dict.fromkeys(candidates) if c not in scores]
+        if not candidates:
+            return []
+
+        x_candidates = np.array([[d.to_unit(v) for d, v in zip(self.dimensions, c)] for c in candidates])
+        mean, std = gaussian_process(x_train, y_train, x_candidates, self.length_scale)
+        improvement = expected_improvement(mean, std, y_train.min())
+        best_candidates = [candidates[i] for i in np.argsort(-improvement)[:self.batch_size]]
+        return self.new_permutations(best_candidates, runs)
+
+    def from_unit(self, sample):
+        return self.key(d.from_unit(s) for d, s in zip(self.dimensions, sample))
+
+
+SEARCH_STRATEGIES = {
+    "grid": GridSearch,
+    "adaptive": AdaptiveGridSearch,
+    "beam": BeamSearch,
+    "coordinate": CoordinateSearch,
+    "nelder-mead": NelderMeadSearch,
+    "latin-hypercube": LatinHypercubeSearch,
+    "bayesian": BayesianSearch,
+}
+
+
+def get_search_strategy(params):
+    search = params['model_run'].get('search', DEFAULT_SEARCH)
+    try:
+        strategy_cls = SEARCH_STRATEGIES[search]
+    except KeyError:
+        raise UnknownSearchStrategy(search)
+
+    logger.info(f'using search strategy {search}')
+    return strategy_cls(params)
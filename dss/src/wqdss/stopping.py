@@ -0,0 +1,67 @@
+import logging
+import time
+
+logger = logging.getLogger()
+logger.setLevel(logging.DEBUG)
+
+
+class StoppingCriteria:
+    '''
+    Decides when an execution stops before its search is complete, configured by the 'stopping'
+    section of 'model_run':
+
+        score_threshold  stop once a run scores at or below the threshold
+        patience         stop once this many runs completed without improving the best score
+        max_runs         stop once this many runs completed
+        max_duration     stop once the execution ran for this many seconds
+
+    Runs that are still executing when the execution stops are cancelled
+    '''
+
+    def __init__(self, params, clock=time.monotonic):
+        options = params['model_run'].get('stopping', {})
+        self.score_threshold = self._option(options, 'score_threshold', float)
+        self.patience = self._option(options, 'patience', int)
+        self.max_runs = self._option(options, 'max_runs', int)
+        self.max_duration = self._option(options, 'max_duration', float)
+        self.clock = clock
+        self.start_time = clock()
+        self.runs = 0
+        self.best_score = None
+        self.runs_since_improvement = 0
+
+    @staticmethod
+    def _option(options, name, convert):
+        value = options.get(name)
+        return None if value is None else convert(value)
+
+    def add_run(self, score):
+        self.runs += 1
+        if self.best_score is None or score < self.best_score:
+            self.best_score = score
+            self.runs_since_improvement = 0
+        else:
+            self.runs_since_improvement += 1
+
+    def time_left(self):
+        '''
+        Returns the number of seconds until the execution should stop, or None if its duration isn't limited
+        '''
+        if self.max_duration is None:
+            return None
+        return max(0.0, self.start_time + self.max_duration - self.clock())
+
+    def reason(self):
+        '''
+        Returns why the execution should stop, or None if it should continue
+        '''
+        if self.score_threshold is not None and self.best_score is not None and \
+                self.best_score <= self.score_threshold:
+            return f'score {self.best_score} is within the threshold {self.score_threshold}'
+        if self.patience is not None and self.runs_since_improvement >= self.patience:
+            return f'the score did not improve in {self.runs_since_improvement} runs'
+        if self.max_runs is not None and self.runs >= self.max_runs:
+            return f'{self.runs} runs were executed'
+        if self.time_left() == 0:
+            return f'the execution ran for {self.max_duration} seconds'
+        return None
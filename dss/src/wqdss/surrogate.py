@@ -0,0 +1,76 @@
+import logging
+
+import numpy as np
+
+from .search import gaussian_process, SearchDimension
+
+logger = logging.getLogger()
+logger.setLevel(logging.DEBUG)
+
+
+class SurrogateFilter:
+    '''
+    Skips runs that aren't expected to beat the best run so far, configured by the 'surrogate' section of 'model_run'.
+    The runs of an iteration are executed in rounds, and before each round a gaussian process is fitted to the
+    scores of all completed runs. A run is skipped once the lower bound of its predicted score (the mean, less
+    kappa standard deviations) isn't below the best score, the other runs are executed by their lower bound.
+
+        min_runs      no runs are skipped until this many runs completed, these runs are spread over the iteration
+        round_size    the number of runs that are executed between fits of the surrogate (default 16)
+        kappa         the weight of the uncertainty of the prediction (default 2)
+        length_scale  the length scale of the kernel, as a fraction of the range of each input (default 0.2)
+    '''
+
+    def __init__(self, params, options):
+        self.dimensions = [SearchDimension(i) for i in params['model_run']['input_files']]
+        self.min_runs = int(options.get('min_runs', 2 * len(self.dimensions) + 2))
+        self.round_size = max(1, int(options.get('round_size', 16)))
+        self.kappa = float(options.get('kappa', 2.0))
+        self.length_scale = float(options.get('length_scale', 0.2))
+
+    def to_unit(self, permutation):
+        return [d.to_unit(permutation.values[d.name]) for d in self.dimensions]
+
+    def spread(self, permutations, num_runs):
+        '''
+        Splits the permutations to num_runs permutations that are spread evenly over them, and the rest
+        '''
+        chosen = set(np.linspace(0, len(permutations) - 1, num_runs).round().astype(int))
+        return ([p for i, p in enumerate(permutations) if i in chosen],
+                [p for i, p in enumerate(permutations) if i not in chosen])
+
+    def next_round(self, permutations, runs):
+        '''
+        Returns the permutations to execute in the next round, and the permutations that are left for later rounds.
+        runs are all of the completed runs, as (permutation, score) tuples
+        '''
+        if len(runs) < self.min_runs:
+            return self.spread(permutations, min(self.min_runs - len(runs), self.round_size, len(permutations)))
+
+        scores = {}
+        for permutation, score in runs:
+            x = tuple(self.to_unit(permutation))
+            scores[x] = min(score, scores.get(x, score))
+        x_train, y_train = np.array(list(scores)), np.array(list(scores.values()))
+
+        try:
+            mean, std = gaussian_process(x_train, y_train, np.array([self.to_unit(p) for p in permutations]),
+                                         self.length_scale, noise=1e-4)
+        except np.linalg.LinAlgError:
+            logger.warning('could not fit the surrogate to the completed runs, no runs are skipped')
+            return permutations[:self.round_size], permutations[self.round_size:]
+
+        lower_bound = mean - self.kappa * std
+        promising = [i for i in np.argsort(lower_bound) if lower_bound[i] < y_train.min()]
+        skipped = len(permutations) - len(promising)
+        if skipped:
+            logger.info(f'the surrogate skips {skipped} runs that are not expected to beat {y_train.min()}')
+        return ([permutations[i] for i in promising[:self.round_size]],
+                [permutations[i] for i in promising[self.round_size:]])
+
+
+def get_surrogate_filter(params):
+    options = params['model_run'].get('surrogate')
+    if not options:
+        return None
+    return SurrogateFilter(params, {} if options is True else options)
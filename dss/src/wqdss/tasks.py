@@ -1,52 +1,207 @@
 import asyncio
 import base64
+from concurrent.futures import ThreadPoolExecutor
+import functools
 from io import BytesIO
+import logging
+import os
+import queue
+import socket
+import threading
 import time
 
 from celery.exceptions import TimeoutError
 
+from .artifacts import get_artifact_store
+from .batching import RunBatcher
 from .celery import app
-from .model_execution import create_run_zip, exec_model, prepare_run_dir, ModelExecutionPermutation
-from .model_registry import ModelRegistryClient
+from .model_cache import ModelCache
+from .model_execution import (create_run_zip, exec_model, get_out_contents, prepare_run_dir,
+                              prepare_run_dir_from_template, ModelExecutionPermutation, ModelTemplates, RUN_DIR_MODE)
+from .blobs import BlobStore
+from .model_registry import ModelRegistryClient, MODEL_BLOB_CACHE_DIR
+from .process_pool import create_model_process_pool
+from .scratch import ScratchSpace
+from .scoring import score_run
+
+logger = logging.getLogger()
+logger.setLevel(logging.DEBUG)
+
+# models are cached for the lifetime of the worker process, and shared by all tasks that it executes
+MODEL_CACHE = ModelCache(ModelRegistryClient(blob_cache=BlobStore(MODEL_BLOB_CACHE_DIR)))
+MODEL_TEMPLATES = ModelTemplates()
+ARTIFACT_STORE = get_artifact_store()
+
+# the model processes of the worker, the runs of a batch are executed on all of them at once
+MODEL_PROCESS_POOL = create_model_process_pool()
+
+# run directories are emptied and reused once the files of the run are collected
+SCRATCH_SPACE = ScratchSpace()
+
+# runs are sent to the workers in batches, which requires workers that have the model_exec_batch task
+BATCH_RUNS = os.environ.get("WQDSS_BATCH_RUNS", "false").lower() == "true"
 
 
 @app.task
-def model_exec(model_name, param_values_as_dict, output_file):
-    model_run = CeleryModelExecution(model_name)
+def model_exec(model_name, param_values_as_dict, output_file, model_analysis=None, model_version=None):
+    return execute_run(CeleryModelExecution(model_name, model_version=model_version), param_values_as_dict,
+                       output_file, model_analysis)
+
+
+@app.task
+def model_exec_batch(model_name, param_values_as_dicts, output_file, model_analysis=None, model_version=None):
+    '''
+    Executes a batch of runs of the same model, returns a record for each of them.
+    A run that fails doesn't fail the others, its record has the error instead
+    '''
+    model_run = CeleryModelExecution(model_name, model_version=model_version)
+
+    def execute(param_values_as_dict):
+        try:
+            return execute_run(model_run, param_values_as_dict, output_file, model_analysis)
+        except Exception as e:
+            logger.exception(f"run {param_values_as_dict} of model {model_name} failed")
+            return {"error": str(e)}
+
+    if model_run.process_pool.size == 1:
+        return [execute(p) for p in param_values_as_dicts]
+
+    with ThreadPoolExecutor(model_run.process_pool.size) as executor:
+        return list(executor.map(execute, param_values_as_dicts))
+
+
+def execute_run(model_run, param_values_as_dict, output_file, model_analysis=None):
     param_values = ModelExecutionPermutation.from_dict(param_values_as_dict)
     out_bytes = model_run.run(param_values, output_file)
 
-    return {"result": base64.b64encode(out_bytes.getvalue()).decode('ascii')}
+    if model_analysis is None:
+        return {"result": base64.b64encode(out_bytes.getvalue()).decode('ascii')}
 
+    # the run is scored here, so the API only has to compare the scores of the runs
+    record = score_run(model_analysis, get_out_contents(out_bytes.getvalue(), output_file))
+    if ARTIFACT_STORE is None:
+        record["result"] = base64.b64encode(out_bytes.getvalue()).decode('ascii')
+    else:
+        record["artifact"] = ARTIFACT_STORE.put(out_bytes.getvalue())
+    return record
 
-async def get_result(async_task_result, timeout=None, interval=0.5):
 
-    # wait until timeout expires
-    start_time = time.time()
-    if timeout is None:
-        def condition(): return True
-    else:
-        end_time = start_time + timeout
+@app.task
+def model_cache_stats():
+    return MODEL_CACHE.stats()
+
+
+class ResultListener:
+    """
+    A single thread per process that consumes task results from the result backend, and resolves the future
+    that awaits each task as soon as its result arrives. The cost of waiting for results doesn't depend
+    on the number of tasks in flight, since there is no polling per task.
+    The results are consumed from the backend that sent each task: a backend that isn't thread-safe is created
+    per thread, and it only receives the results of the tasks that it sent. All access to the result consumers
+    happens from the listener thread, since their connections aren't thread-safe
+    """
+
+    def __init__(self, celery_app, interval=0.1):
+        self.app = celery_app
+        self.interval = interval
+        self._registrations = queue.Queue()
+        # the backends of the registered results, by their id
+        self._backends = {}
+        self._thread = None
+        self._lock = threading.Lock()
 
-        def condition():
-            return end_time >= time.time()
+    def wait_for(self, async_result):
+        '''
+        Returns a future, in the current event loop, that resolves with the result of the task
+        '''
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        self._registrations.put((async_result, loop, future))
+        self._ensure_started()
+        return future
 
-    while True:
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._listen, name="wqdss-result-listener", daemon=True)
+                self._thread.start()
+
+    def _listen(self):
+        logger.info("result listener started")
+        while True:
+            self._register_pending()
+            if not self._backends:
+                time.sleep(self.interval)
+            for backend in list(self._backends.values()):
+                try:
+                    backend.result_consumer.drain_events(timeout=self.interval / len(self._backends))
+                except socket.timeout:
+                    pass
+                except Exception:
+                    logger.exception("error while consuming task results")
+                    time.sleep(self.interval)
+
+    def _register_pending(self):
+        while True:
+            try:
+                async_result, loop, future = self._registrations.get_nowait()
+            except queue.Empty:
+                return
+            self._backends.setdefault(id(async_result.backend), async_result.backend)
+            # a result that arrived before it was registered is buffered by the consumer, and resolved right away
+            async_result.then(functools.partial(self._on_ready, loop, future))
+
+    def _on_ready(self, loop, future, async_result):
+        # the result is already cached in async_result, so get() doesn't block
         try:
-            if async_task_result.ready():
-                result = async_task_result.get(timeout=0.1)  # expected to return immediately
-                return base64.b64decode(result["result"])
-            elif condition():
-                await asyncio.sleep(interval)
-            else:
-                raise TimeoutError('The operation timed out')
-        except Exception:
-            # if we're going to raise an error, make sure we `forget` the result
+            value, error = async_result.get(timeout=self.interval, propagate=True), None
+        except Exception as e:
+            value, error = None, e
+        loop.call_soon_threadsafe(self._resolve, future, value, error)
+
+    @staticmethod
+    def _resolve(future, value, error):
+        if future.done():
+            # whoever awaited the task has given up on it
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(value)
+
+
+RESULT_LISTENER = ResultListener(app)
+
+
+def decode_record(record):
+    if "result" in record:
+        record["result"] = base64.b64decode(record["result"])
+    return record
+
+
+async def get_result(async_task_result, timeout=None, listener=None):
+    listener = listener or RESULT_LISTENER
+    try:
+        result = await asyncio.wait_for(listener.wait_for(async_task_result), timeout)
+        if isinstance(result, list):
+            return [decode_record(record) for record in result]
+        return decode_record(result)
+    except BaseException as e:
+        if isinstance(e, asyncio.CancelledError):
+            # the result isn't needed anymore, if the task is still queued the workers drop it
             try:
-                async_task_result.forget()
-            except NotImplementedError:
-                pass
-            raise
+                async_task_result.revoke()
+            except Exception as revoke_error:
+                logger.warning(f"could not revoke task {async_task_result}: {revoke_error}")
+
+        # if we're going to raise an error, make sure we `forget` the result
+        try:
+            async_task_result.forget()
+        except NotImplementedError:
+            pass
+        if isinstance(e, asyncio.TimeoutError):
+            raise TimeoutError('The operation timed out')
+        raise
 
 
 class CeleryModelExecution:
@@ -54,16 +209,48 @@ class CeleryModelExecution:
     This is what gets executed on the worker side via the task
     """
 
-    def __init__(self, model_name):
-        self.model_registry_client = ModelRegistryClient()
-        self.model_contents = self.model_registry_client.get_model_by_name(model_name)
+    def __init__(self, model_name, model_cache=None, model_templates=None, run_dir_mode=RUN_DIR_MODE,
+                 process_pool=None, scratch_space=None, model_version=None):
+        self.model_name = model_name
+        self.model_cache = model_cache or MODEL_CACHE
+        self.model_templates = model_templates or MODEL_TEMPLATES
+        self.process_pool = process_pool or MODEL_PROCESS_POOL
+        self.scratch_space = scratch_space or SCRATCH_SPACE
+        self.run_dir_mode = run_dir_mode
+        # the execution pins the version of the model, so all of its runs use the same model
+        self.model_version, self.model_contents = self.model_cache.get_model(model_name, model_version)
+
+    def prepare_run_dir(self, param_values, output_file, run_dir=None):
+        if self.run_dir_mode == "template":
+            with self.model_templates.use(self.model_name, self.model_version, self.model_contents) as template_dir:
+                return prepare_run_dir_from_template(param_values, template_dir, output_file, run_dir)
+
+        return prepare_run_dir(param_values, self.model_contents, run_dir)
 
     def run(self, param_values, output_file):
-        run_dir = prepare_run_dir(param_values, self.model_contents)
-        exec_model(run_dir)
-        return BytesIO(create_run_zip(run_dir, list(param_values.files) + [output_file]))
+        # the run directory is released as soon as the files of the run are collected
+        with self.scratch_space.run_dir() as run_dir:
+            self.prepare_run_dir(param_values, output_file, run_dir)
+            exec_model(run_dir, self.process_pool)
+            return BytesIO(create_run_zip(run_dir, list(param_values.files) + [output_file]))
 
 
-async def execute_on_worker(model_name, param_values, output_file):
-    async_result = model_exec.delay(model_name, param_values, output_file)
+async def execute_on_worker(model_name, param_values, output_file, model_analysis=None, model_version=None):
+    async_result = model_exec.delay(model_name, param_values, output_file, model_analysis, model_version)
     return await get_result(async_result)
+
+
+async def execute_batch_on_worker(model_name, param_values_list, output_file, model_analysis=None,
+                                  model_version=None):
+    async_result = model_exec_batch.delay(model_name, param_values_list, output_file, model_analysis, model_version)
+    return await get_result(async_result)
+
+
+RUN_BATCHER = RunBatcher(execute_batch_on_worker)
+
+
+async def execute_batched_on_worker(model_name, param_values, output_file, model_analysis=None, model_version=None):
+    '''
+    Executes a run on the workers as part of a batch of runs
+    '''
+    return await RUN_BATCHER.run(model_name, param_values, output_file, model_analysis, model_version)
@@ -12,6 +12,9 @@ import pytest
 from asynctest import CoroutineMock
 
 import api as service
+import wqdss.blobs
+import wqdss.execution_store
+import wqdss.model_execution
 import wqdss.processing
 import wqdss.model_registry
 import model_registry_api
@@ -45,6 +48,12 @@ def api():
     return service.api
 
 
+@pytest.fixture(autouse=True)
+def execution_store():
+    with mock.patch.object(wqdss.processing, 'EXECUTION_STORE', wqdss.execution_store.SqliteExecutionStore(':memory:')) as store:
+        yield store
+
+
 def test_execution_not_found(api):
     assert api.requests.get(f"/status/DOES_NOT_EXIST").json()['status'] == 'NOT_FOUND'
 
@@ -53,7 +62,7 @@ def test_dss_execution(api, tmp_path):
     '''
     Test the execution of a dss, including setting the paramters, and polling for a result
     '''
-    RESPONSE = [{"score": 4.2, "params": mock.Mock(values=[])}]
+    RESPONSE = [{"score": 4.2, "params": wqdss.model_execution.ModelExecutionPermutation(['qin_br8.csv'], ['QWD'], [30.0])}]
 
     file_obj = tmp_path / "data.t"
     file_obj.write_bytes(INPUT_EXAMPLE.encode())
@@ -105,6 +114,32 @@ def test_dss_execution(api, tmp_path):
         assert resp.headers['content-type'] == 'application/zip'
 
 
+def test_executions(api, execution_store):
+    execution = wqdss.processing.Execution('exec', None)
+    execution.model_name = 'some_model'
+    execution.mark_complete()
+
+    resp = api.requests.get("/executions", params={'fields': 'id,state', 'limit': '10'})
+    assert resp.status_code == 200
+    assert resp.json() == {'executions': [{'id': 'exec', 'state': 'COMPLETED'}], 'next_cursor': None}
+
+    # the executions didn't change, so they aren't listed again
+    etag = resp.headers['ETag']
+    resp = api.requests.get("/executions", params={'fields': 'id,state', 'limit': '10'},
+                            headers={'If-None-Match': etag})
+    assert resp.status_code == 304
+    assert resp.content == b''
+
+    assert api.requests.get("/executions", params={'cursor': 'foo'}).status_code == 400
+    assert api.requests.get("/executions", params={'limit': '0'}).status_code == 400
+
+
+def test_status_events_not_found(api):
+    resp = api.requests.get("/status/DOES_NOT_EXIST/events")
+    assert resp.headers['content-type'].startswith('text/event-stream')
+    assert resp.text == 'event: progress\ndata: {"id": "DOES_NOT_EXIST", "status": "NOT_FOUND"}\n\n'
+
+
 def test_get_best_run_not_found(api):
     s = io.BytesIO()
     with zipfile.ZipFile(s, 'w'):
@@ -205,3 +240,126 @@ def test_model_registry_client_model_in_dir(tmp_path):
 
     returned_model = zipfile.ZipFile(io.BytesIO(model_contents))
     assert sorted(returned_model.namelist()) == ['file.a', 'file.b']
+
+
+def test_model_registry_client_version(tmp_path):
+    file_a = tmp_path / "file.a"
+    file_a.write_bytes("this is a file".encode())
+    model_zip = tmp_path / "model.zip"
+
+    with zipfile.ZipFile(model_zip, 'w') as z:
+        z.write(file_a, arcname="file.a")
+
+    files = {'model': ('test_model-version', model_zip.read_bytes(), 'application/zip')}
+    model_registry_api.api.requests.post("/models", files=files)
+
+    model_registry_client = wqdss.model_registry.ModelRegistryClient("/models", model_registry_api.api.requests)
+    version = model_registry_client.get_model_version("test_model-version")
+    assert version == wqdss.model_registry.get_model_version("test_model-version")
+
+    resp = model_registry_api.api.requests.get("/models/test_model-version")
+    assert resp.headers['etag'] == f'"{version}"'
+
+    with pytest.raises(wqdss.model_registry.ModelNotFoundError):
+        model_registry_client.get_model_version("no-such-model")
+
+
+def test_model_registry_conditional_and_range_get(tmp_path):
+    file_a = tmp_path / "file.a"
+    file_a.write_bytes("this is a file".encode())
+    model_zip = tmp_path / "model.zip"
+
+    with zipfile.ZipFile(model_zip, 'w') as z:
+        z.write(file_a, arcname="file.a")
+
+    files = {'model': ('test_model-range', model_zip.read_bytes(), 'application/zip')}
+    model_registry_api.api.requests.post("/models", files=files)
+
+    resp = model_registry_api.api.requests.get("/models/test_model-range")
+    contents, etag = resp.content, resp.headers['etag']
+    assert resp.headers['accept-ranges'] == 'bytes'
+    assert resp.headers['content-type'] == 'application/zip'
+    assert int(resp.headers['content-length']) == len(contents)
+
+    resp = model_registry_api.api.requests.get("/models/test_model-range", headers={'If-None-Match': etag})
+    assert resp.status_code == 304
+    assert resp.content == b''
+
+    # the files are streamed uncompressed, even to clients that accept compressed responses
+    resp = model_registry_api.api.requests.get("/models/test_model-range",
+                                               headers={'Range': 'bytes=10-', 'Accept-Encoding': 'gzip'})
+    assert resp.status_code == 206
+    assert 'content-encoding' not in resp.headers
+    assert resp.content == contents[10:]
+    assert resp.headers['content-range'] == f'bytes 10-{len(contents) - 1}/{len(contents)}'
+    assert resp.headers['content-type'] == 'application/zip'
+
+    # the whole archive is returned if it changed since the client fetched the start of it
+    resp = model_registry_api.api.requests.get("/models/test_model-range",
+                                               headers={'Range': 'bytes=10-', 'If-Range': '"old"'})
+    assert resp.status_code == 200
+    assert resp.content == contents
+
+    resp = model_registry_api.api.requests.get("/models/test_model-range",
+                                               headers={'Range': f'bytes={len(contents)}-'})
+    assert resp.status_code == 416
+    assert resp.content == b''
+
+    model_registry_client = wqdss.model_registry.ModelRegistryClient("/models", model_registry_api.api.requests)
+    assert model_registry_client.get_model("test_model-range", etag.strip('"')) == (etag.strip('"'), None)
+
+
+def test_model_registry_manifest_and_blobs(tmp_path):
+    model_zip = tmp_path / "model.zip"
+    with zipfile.ZipFile(model_zip, 'w') as z:
+        z.writestr("a.csv", b"a")
+        z.writestr("b.csv", b"b")
+
+    files = {'model': ('test_model-blobs', model_zip.read_bytes(), 'application/zip')}
+    version = model_registry_api.api.requests.post("/models", files=files).json()['version']
+
+    resp = model_registry_api.api.requests.get("/models/test_model-blobs/manifest")
+    manifest = resp.json()
+    assert manifest['version'] == version
+    assert [f['path'] for f in manifest['files']] == ['a.csv', 'b.csv']
+
+    resp = model_registry_api.api.requests.get("/models/test_model-blobs/manifest",
+                                               headers={'If-None-Match': f'"{version}"'})
+    assert resp.status_code == 304
+    assert resp.content == b''
+
+    resp = model_registry_api.api.requests.get(f"/blobs/{manifest['files'][0]['digest']}")
+    assert resp.content == b"a"
+
+    digest = wqdss.blobs.blob_digest(b"c")
+    resp = model_registry_api.api.requests.put(f"/blobs/{digest}", data=b"not c")
+    assert resp.status_code == 400
+
+    # a new version of the model, which only uploads the file that changed
+    new_files = {'a.csv': manifest['files'][0]['digest'], 'b.csv': digest}
+    resp = model_registry_api.api.requests.post("/models/test_model-blobs/manifest", json={'files': new_files})
+    assert resp.status_code == 409
+    assert resp.json()['missing'] == [digest]
+
+    model_registry_client = wqdss.model_registry.ModelRegistryClient("/models", model_registry_api.api.requests)
+    new_version = model_registry_client.add_model_files("test_model-blobs", {'a.csv': b"a", 'b.csv': b"c"})['version']
+    assert new_version != version
+    assert model_registry_client.get_model_version("test_model-blobs") == new_version
+
+    # the previous version can still be fetched by its version
+    resp = model_registry_api.api.requests.get("/models/test_model-blobs", params={'version': version})
+    assert zipfile.ZipFile(io.BytesIO(resp.content)).read('b.csv') == b"b"
+
+
+def test_model_registry_status(tmp_path):
+    model_zip = tmp_path / "model.zip"
+    with zipfile.ZipFile(model_zip, 'w') as z:
+        z.writestr("a.csv", b"a")
+
+    files = {'model': ('test_model-status', model_zip.read_bytes(), 'application/zip')}
+    version = model_registry_api.api.requests.post("/models", files=files).json()['version']
+    wqdss.model_registry.wait_for_models()
+
+    status = model_registry_api.api.requests.get("/models/test_model-status/status").json()
+    assert status == {'model_name': 'test_model-status', 'version': version, 'size': 1, 'files': 1, 'state': 'READY'}
+    assert model_registry_api.api.requests.get("/models/no-such-model/status").status_code == 404
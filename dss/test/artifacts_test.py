@@ -0,0 +1,31 @@
+import pytest
+
+from wqdss.artifacts import (get_artifact_store, ArtifactNotFoundError, LocalArtifactStore,
+                             UnknownArtifactStoreError)
+
+
+def test_local_artifact_store(tmp_path):
+    store = get_artifact_store(f"file://{tmp_path}")
+    assert isinstance(store, LocalArtifactStore)
+
+    ref = store.put(b"run files")
+    assert store.put(b"run files") == ref
+    assert store.get(ref) == b"run files"
+    assert store.put(b"other run files") != ref
+
+    store.delete(ref)
+    with pytest.raises(ArtifactNotFoundError):
+        store.get(ref)
+
+
+def test_invalid_ref(tmp_path):
+    store = LocalArtifactStore(str(tmp_path))
+    with pytest.raises(ArtifactNotFoundError):
+        store.get("../../etc/passwd")
+
+
+def test_get_artifact_store():
+    assert get_artifact_store("") is None
+    assert isinstance(get_artifact_store("/artifacts"), LocalArtifactStore)
+    with pytest.raises(UnknownArtifactStoreError):
+        get_artifact_store("s3://bucket/artifacts")
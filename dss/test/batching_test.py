@@ -0,0 +1,74 @@
+import asyncio
+
+import pytest
+
+from wqdss.batching import RunBatcher, RunFailedError
+
+
+class FakeWorker:
+    def __init__(self):
+        self.batches = []
+        self.release = asyncio.Event()
+        self.release.set()
+        self.cancelled = False
+
+    async def __call__(self, model_name, param_values_list, output_file, model_analysis, model_version=None):
+        self.batches.append(param_values_list)
+        try:
+            await self.release.wait()
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        return [{'error': 'failed'} if p == 'bad' else {'values': p} for p in param_values_list]
+
+
+@pytest.mark.asyncio
+async def test_runs_are_batched():
+    worker = FakeWorker()
+    batcher = RunBatcher(worker, target_seconds=10, max_size=4)
+    batcher.observe(10, 5)
+
+    results = await asyncio.gather(*[batcher.run('model', i, 'out.csv', {}) for i in range(10)])
+    assert [r['values'] for r in results] == list(range(10))
+    assert [len(b) for b in worker.batches] == [4, 4, 2]
+
+
+@pytest.mark.asyncio
+async def test_batch_size_is_tuned():
+    batcher = RunBatcher(FakeWorker(), target_seconds=60, max_size=16)
+    assert batcher.batch_size == 1
+    batcher.observe(30, 1)
+    assert batcher.batch_size == 2
+    for _ in range(50):
+        batcher.observe(4, 2)
+    assert batcher.batch_size == 16
+
+
+@pytest.mark.asyncio
+async def test_failed_run_in_batch():
+    batcher = RunBatcher(FakeWorker(), max_size=4)
+    batcher.observe(1, 1)
+    results = await asyncio.gather(*[batcher.run('model', p, 'out.csv') for p in ['good', 'bad']],
+                                   return_exceptions=True)
+    assert results[0] == {'values': 'good'}
+    assert isinstance(results[1], RunFailedError)
+
+
+@pytest.mark.asyncio
+async def test_cancelled_batch():
+    worker = FakeWorker()
+    worker.release.clear()
+    batcher = RunBatcher(worker, max_size=4)
+    batcher.observe(1, 1)
+
+    runs = [asyncio.ensure_future(batcher.run('model', i, 'out.csv')) for i in range(2)]
+    await asyncio.sleep(0.01)
+    assert worker.batches == [[0, 1]]
+    runs[0].cancel()
+    await asyncio.sleep(0.01)
+    assert not worker.cancelled
+
+    # once none of the runs of a batch are awaited, the batch itself is cancelled
+    runs[1].cancel()
+    await asyncio.sleep(0.01)
+    assert worker.cancelled
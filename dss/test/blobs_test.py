@@ -0,0 +1,23 @@
+import pytest
+
+from wqdss.blobs import blob_digest, BlobStore, InvalidBlobError
+
+
+def test_put_and_get(tmp_path):
+    store = BlobStore(str(tmp_path))
+    digest = store.put(b'contents')
+    assert digest == blob_digest(b'contents')
+    assert store.has(digest)
+    assert store.get(digest) == b'contents'
+    assert store.size(digest) == len(b'contents')
+
+    # storing the same contents again doesn't add a blob
+    assert store.put(b'contents') == digest
+    assert len(list(tmp_path.glob('*/*'))) == 1
+
+
+def test_put_verifies_digest(tmp_path):
+    store = BlobStore(str(tmp_path))
+    with pytest.raises(InvalidBlobError):
+        store.put(b'contents', blob_digest(b'other contents'))
+    assert not store.has(blob_digest(b'contents'))
@@ -0,0 +1,21 @@
+import pytest
+
+from wqdss.events import ExecutionEvents
+
+
+@pytest.mark.asyncio
+async def test_execution_events():
+    events = ExecutionEvents(max_queued=2)
+    events.publish('a', 'run', score=1)
+
+    with events.subscribe('a') as queue, events.subscribe('b') as other:
+        assert events.num_subscribers('a') == 1
+        for score in range(3):
+            events.publish('a', 'run', score=score)
+
+        # a subscriber that doesn't keep up only gets the latest events
+        assert [queue.get_nowait() for _ in range(queue.qsize())] == [{'type': 'run', 'score': 1},
+                                                                     {'type': 'run', 'score': 2}]
+        assert other.empty()
+
+    assert events.num_subscribers('a') == 0
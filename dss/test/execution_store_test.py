@@ -0,0 +1,118 @@
+import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from wqdss.execution_store import SqliteExecutionStore, get_execution_store, UnknownExecutionStoreError, \
+    InvalidCursorError
+from wqdss.model_execution import ModelExecutionPermutation
+from wqdss.processing import Execution, ExectuionState
+
+
+def make_execution(exec_id, state=ExectuionState.RUNNING, result=None, model_name='model', day=1):
+    return SimpleNamespace(exec_id=exec_id, state=state, model_name=model_name, model_version='v1',
+                           start_time=datetime.datetime(2020, 1, day), end_time=None, result=result,
+                           params={'model_run': {}})
+
+
+def test_execution_store(tmp_path):
+    path = str(tmp_path / "db" / "executions.db")
+    store = SqliteExecutionStore(path)
+    permutation = ModelExecutionPermutation(['qin_br8.csv'], ['QWD'], [30.0])
+
+    store.save_execution(make_execution('a'))
+    assert store.get_status('a') == 'RUNNING'
+    assert store.get_running_executions() == ['a']
+    assert store.get_result('a') is None
+
+    run = Execution.Run('run', permutation, 0)
+    run.set_result({'values': {'DO': 8.0}, 'score': 1.5, 'artifact': 'ref'})
+    store.add_runs('a', [run])
+    store.save_execution(make_execution('a', ExectuionState.COMPLETED, [{'best_run': 'run', 'params': permutation,
+                                                                        'score': 1.5}]))
+    store.close()
+
+    # executions outlive the store that saved them
+    store = SqliteExecutionStore(path)
+    assert store.get_status('a') == 'COMPLETED'
+    result = store.get_result('a')
+    assert result[0]['params'].values == {'qin_br8.csv': 30.0}
+    assert store.get_runs('a') == [{'run_id': 'run', 'iteration': 0, 'params': permutation.as_dict(),
+                                    'values': {'DO': 8.0}, 'score': 1.5, 'artifact': 'ref'}]
+    executions, next_cursor = store.get_executions()
+    assert next_cursor is None
+    assert executions == [{'id': 'a', 'state': 'COMPLETED', 'model_name': 'model',
+                           'start_time': '2020-01-01 00:00:00', 'updated_at': executions[0]['updated_at'],
+                           'result': {'best_run': 'run', 'params': permutation.as_dict(), 'score': 1.5}}]
+
+    stored = store.get_execution('a')
+    assert stored['params'] == {'model_run': {}}
+    assert stored['start_time'] == '2020-01-01 00:00:00'
+    assert stored['result'][0]['params'].values == {'qin_br8.csv': 30.0}
+    assert store.get_running_executions() == []
+
+    with pytest.raises(KeyError):
+        store.get_status('b')
+
+
+def test_get_execution_store(tmp_path):
+    assert get_execution_store(f"sqlite://{tmp_path}/executions.db").path == f"{tmp_path}/executions.db"
+    with pytest.raises(UnknownExecutionStoreError):
+        get_execution_store("redis://localhost")
+
+
+def test_get_executions_pages():
+    store = SqliteExecutionStore(':memory:')
+    for i in range(5):
+        store.save_execution(make_execution(f'exec-{i}', model_name=f'model-{i % 2}', day=5 - i))
+
+    ids, cursor = [], None
+    while True:
+        executions, cursor = store.get_executions(limit=2, cursor=cursor)
+        assert len(executions) <= 2
+        ids += [e['id'] for e in executions]
+        if cursor is None:
+            break
+    assert ids == [f'exec-{i}' for i in reversed(range(5))]
+
+    executions, _ = store.get_executions(model_name='model-1')
+    assert [e['id'] for e in executions] == ['exec-3', 'exec-1']
+
+    # only executions that were updated after the last one that was seen are returned
+    version = store.get_version()
+    last_updated = max(e['updated_at'] for e in store.get_executions()[0])
+    assert store.get_executions(since=last_updated) == ([], None)
+    store.save_execution(make_execution('exec-2', state=ExectuionState.COMPLETED, day=3))
+    assert store.get_version() != version
+    executions, _ = store.get_executions(since=last_updated)
+    assert [(e['id'], e['state']) for e in executions] == [('exec-2', 'COMPLETED')]
+    assert [e['id'] for e in store.get_executions(state='COMPLETED')[0]] == ['exec-2']
+
+    with pytest.raises(InvalidCursorError):
+        store.get_executions(cursor='not a cursor')
+
+
+def test_executions_not_started(tmp_path):
+    path = str(tmp_path / "executions.db")
+    store = SqliteExecutionStore(path)
+    for i in range(3):
+        execution = make_execution(f'queued-{i}')
+        execution.start_time = None
+        store.save_execution(execution)
+    store.save_execution(make_execution('started'))
+
+    assert store.get_execution('queued-0')['start_time'] is None
+    ids, cursor = [], None
+    while True:
+        executions, cursor = store.get_executions(limit=2, cursor=cursor)
+        ids += [e['id'] for e in executions]
+        if cursor is None:
+            break
+    assert ids == ['queued-0', 'queued-1', 'queued-2', 'started']
+
+    # the start time of executions that hadn't started was once stored as 'None'
+    store.conn.execute("UPDATE executions SET start_time = 'None' WHERE start_time IS NULL")
+    store.conn.commit()
+    store.close()
+    store = SqliteExecutionStore(path)
+    assert store.get_execution('queued-1')['start_time'] is None
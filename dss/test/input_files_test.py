@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+
+from wqdss.input_files import format_fixed_width, index_lines, patch_input_file, InputColumnNotFoundError
+
+
+def test_patch_csv_last_column(tmp_path):
+    source = tmp_path / "qin_br8.csv"
+    source.write_bytes(b"Flow_file,\n,\nJDAY,QWD\n1,157.15\n1.01,40.38\n")
+    patch_input_file(str(source), str(source), "QWD", 30.0)
+    assert source.read_bytes() == b"Flow_file,\n,\nJDAY,QWD\n1,30.0\n1.01,30.0\n"
+
+
+def test_patch_csv_keeps_formatting(tmp_path):
+    source = tmp_path / "hangq01.csv"
+    target = tmp_path / "out.csv"
+    source.write_bytes(b"$$Hangman C,reek inflow,\r\n,,\r\nJday, Q,T\r\n1,1.15,3.0\r\n1.02,1.15,4\r\n\r\n")
+    patch_input_file(str(source), str(target), "Q", 1.5)
+    assert target.read_bytes() == b"$$Hangman C,reek inflow,\r\n,,\r\nJday, Q,T\r\n1,1.5,3.0\r\n1.02,1.5,4\r\n\r\n"
+
+    # the source is left untouched
+    assert b"1.15" in source.read_bytes()
+
+
+def test_patch_npt(tmp_path):
+    source = tmp_path / "qin_br8.npt"
+    source.write_bytes(b"Flow file for segment 86\r\n\r\n    JDAY     QWD\r\n   1.000  157.15\r\n   1.010   40.38\r\n")
+    patch_input_file(str(source), str(source), "QWD", 30.0)
+    assert source.read_bytes() == b"Flow file for segment 86\r\n\r\n    JDAY     QWD\r\n   1.000   30.00\r\n   1.010   30.00\r\n"
+
+
+def test_patch_npt_middle_column(tmp_path):
+    source = tmp_path / "met.npt"
+    source.write_bytes(b"met\n\n    JDAY    TAIR    TDEW\n   1.000   -2.20   -3.30\n   1.039   -2.20   -3.30\n")
+    patch_input_file(str(source), str(source), "TAIR", 123456.78)
+    assert source.read_bytes() == b"met\n\n    JDAY    TAIR    TDEW\n   1.000123456.8   -3.30\n   1.039123456.8   -3.30\n"
+
+
+def test_format_fixed_width():
+    assert format_fixed_width(1.5, 2) == "    1.50"
+    assert format_fixed_width(1234567.0, 2) == " 1234567"
+    with pytest.raises(ValueError):
+        format_fixed_width(123456789.0, 2)
+
+
+def test_patch_missing_column(tmp_path):
+    source = tmp_path / "qin_br8.csv"
+    source.write_bytes(b"Flow_file,\n,\nJDAY,QWD\n1,157.15\n")
+    with pytest.raises(InputColumnNotFoundError) as excinfo:
+        patch_input_file(str(source), str(source), "Q", 30.0)
+    assert excinfo.value.column == "Q"
+    assert list(tmp_path.iterdir()) == [source]
+
+
+@pytest.mark.parametrize("name, contents, column, value", [
+    ("hangq01.csv", b"$$Hangman C,reek inflow,\r\n,,\r\nJday, Q,T\r\n1,1.15,3.0\r\n1.02,1.15,4\r\n\r\n", "Q", 1.5),
+    ("qin_br8.csv", b"Flow_file,\n,\nJDAY,QWD,T\n1,157.15\n1.01\n2,40.38,\n3,1,2,3\n\n4,5", "QWD", 30.25),
+    ("qin_br8.csv", b"Flow_file,\n,\nJDAY,QWD,T\n1,157.15\n1.01\n2,40.38,\n3,1,2,3\n\n4,5", "T", 7),
+    ("qin_br8.npt", b"Flow\r\n\r\n    JDAY     QWD\r\n   1.000  157.15\r\n   1.010   40.38\r\n", "QWD", 30.0),
+    ("met.npt", b"met\n\n    JDAY    TAIR    TDEW\n   1.000   -2.20   -3.30\n   1.039   -2.2\n   1.0\n", "TAIR", 1.5),
+    ("met.npt", b"met\n\n    JDAY    TAIR    TDEW\n   1.000   -2.20   -3.30\n   1.039   -2.2\n   1.0\n", "TDEW", 12),
+    ("empty.csv", b"Flow_file,\n,\nJDAY,QWD\n", "QWD", 1.0),
+])
+def test_patch_indexed(tmp_path, name, contents, column, value):
+    source = tmp_path / name
+    source.write_bytes(contents)
+    line_index = index_lines(np.frombuffer(contents, dtype=np.uint8), name)
+
+    patch_input_file(str(source), str(tmp_path / "streamed"), column, value)
+    patch_input_file(str(source), str(tmp_path / "indexed"), column, value, line_index=line_index)
+    assert (tmp_path / "indexed").read_bytes() == (tmp_path / "streamed").read_bytes()
+
+
+def test_index_lines():
+    contents = b"Flow_file,\n,\r\nJDAY,QWD\r1,157.15\r\n\n2,3"
+    index = index_lines(np.frombuffer(contents, dtype=np.uint8), "qin_br8.csv")
+    assert index.dtype == np.int32
+    assert index.tolist() == [23, 33, 34, 37]
+
+    with pytest.raises(ValueError):
+        index_lines(np.frombuffer(b"a\n\n", dtype=np.uint8), "a.csv")
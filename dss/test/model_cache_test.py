@@ -0,0 +1,105 @@
+from unittest.mock import Mock
+
+from wqdss.model_cache import ModelCache
+
+
+def registry_client(versions, contents):
+    client = Mock()
+    client.downloads = 0
+
+    def get_model(name, cached_version=None, version=None):
+        version = version or versions[name]
+        if version == cached_version:
+            return version, None
+        client.downloads += 1
+        return version, contents[name]
+
+    client.get_model.side_effect = get_model
+    return client
+
+
+def test_model_cache_hit_and_miss():
+    client = registry_client({"a": "v1"}, {"a": b"aaaa"})
+    cache = ModelCache(client, max_size=100)
+
+    assert cache.get_model_by_name("a") == b"aaaa"
+    assert cache.get_model_by_name("a") == b"aaaa"
+
+    assert client.downloads == 1
+    assert client.get_model.call_args[0] == ("a", "v1", None)
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_model_cache_new_version():
+    versions = {"a": "v1"}
+    contents = {"a": b"aaaa"}
+    client = registry_client(versions, contents)
+    cache = ModelCache(client, max_size=100)
+    cache.get_model_by_name("a")
+
+    versions["a"] = "v2"
+    contents["a"] = b"bbbbbb"
+    assert cache.get_model_by_name("a") == b"bbbbbb"
+
+    # the previous version stays cached, for the executions that pinned it
+    assert cache.stats()["models"] == 2
+    assert cache.size == 10
+    assert client.get_model.call_args[0] == ("a", "v1", None)
+    assert cache.get_model("a", "v1") == ("v1", b"aaaa")
+    assert cache.get_model_by_name("a") == b"bbbbbb"
+    assert client.get_model.call_args[0] == ("a", "v2", None)
+    assert client.downloads == 2
+
+
+def test_model_cache_lru_eviction():
+    client = registry_client({"a": "1", "b": "1", "c": "1"}, {"a": b"a" * 4, "b": b"b" * 4, "c": b"c" * 4})
+    cache = ModelCache(client, max_size=10)
+
+    cache.get_model_by_name("a")
+    cache.get_model_by_name("b")
+    cache.get_model_by_name("a")  # a is now the most recently used
+    cache.get_model_by_name("c")  # b is evicted
+
+    assert cache.size == 8
+    cache.get_model_by_name("a")
+    assert cache.stats()["hits"] == 2
+    cache.get_model_by_name("b")
+    assert cache.stats()["misses"] == 4
+
+
+def test_model_cache_too_large():
+    client = registry_client({"a": "1"}, {"a": b"a" * 20})
+    cache = ModelCache(client, max_size=10)
+
+    assert cache.get_model_by_name("a") == b"a" * 20
+    assert cache.size == 0
+
+
+def test_model_cache_evicted_while_checking():
+    client = registry_client({"a": "1"}, {"a": b"aaaa"})
+    cache = ModelCache(client, max_size=10)
+    cache.get_model_by_name("a")
+
+    def get_model(name, cached_version=None, version=None):
+        # another thread clears the cache while the registry confirms that the cached version is current
+        cache.clear()
+        client.get_model.side_effect = None
+        client.get_model.return_value = ("1", b"aaaa")
+        return cached_version, None
+
+    client.get_model.side_effect = get_model
+    assert cache.get_model("a") == ("1", b"aaaa")
+    assert cache.stats()["misses"] == 2
+
+
+def test_model_cache_pinned_version():
+    client = registry_client({"a": "v1"}, {"a": b"aaaa"})
+    cache = ModelCache(client, max_size=100)
+
+    assert cache.get_model("a", "v1") == ("v1", b"aaaa")
+    assert cache.get_model("a", "v1") == ("v1", b"aaaa")
+
+    # a cached version is served without asking the registry
+    assert client.get_model.call_count == 1
+    assert client.downloads == 1
@@ -0,0 +1,286 @@
+import io
+import os
+import threading
+from unittest.mock import Mock
+import zipfile
+
+import pytest
+import requests
+
+import wqdss.model_registry
+from wqdss.blobs import blob_digest, BlobStore
+from wqdss.model_registry import (InvalidRangeError, ModelNotFoundError, ModelNotReadyError, ModelRegistryClient,
+                                  parse_range, read_archive)
+
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    monkeypatch.setattr(wqdss.model_registry, 'BASE_MODEL_DIR', str(tmp_path))
+    monkeypatch.setattr(wqdss.model_registry, 'MODELS', {})
+    monkeypatch.setattr(wqdss.model_registry, 'MODEL_IMPORTS', {})
+    monkeypatch.setattr(wqdss.model_registry, 'ARCHIVE_BUILDS', {})
+    yield tmp_path
+    wqdss.model_registry.wait_for_models()
+
+
+def model_zip(files):
+    contents = io.BytesIO()
+    with zipfile.ZipFile(contents, 'w') as z:
+        for name, data in files.items():
+            z.writestr(name, data)
+    return contents.getvalue()
+
+
+def test_add_model_versions(registry):
+    v1 = wqdss.model_registry.add_model('m', model_zip({'model/a.csv': b'a', 'model/b.csv': b'b'}))
+    assert wqdss.model_registry.get_model_version('m') == v1
+    manifest = wqdss.model_registry.get_manifest('m')
+    assert [(f['path'], f['size']) for f in manifest['files']] == [('a.csv', 1), ('b.csv', 1)]
+
+    # a recalibrated model only adds the files that changed
+    v2 = wqdss.model_registry.add_model('m', model_zip({'a.csv': b'a', 'b.csv': b'bb'}))
+    assert v2 != v1
+    assert wqdss.model_registry.get_model_version('m') == v2
+    assert len(list((registry / '.blobs').glob('*/*'))) == 3
+
+    # the previous version is still available
+    archive = zipfile.ZipFile(io.BytesIO(wqdss.model_registry.get_model_by_name('m', v1)))
+    assert archive.read('b.csv') == b'b'
+    assert wqdss.model_registry.add_model('m', model_zip({'a.csv': b'a', 'b.csv': b'bb'})) == v2
+
+
+
+def test_removed_archive_is_rebuilt(registry):
+    wqdss.model_registry.add_model('m', model_zip({'a.csv': b'a'}))
+    archive_path = wqdss.model_registry.get_model_archive('m')
+    os.remove(archive_path)
+
+    assert wqdss.model_registry.get_model_archive('m') == archive_path
+    assert zipfile.ZipFile(archive_path).read('a.csv') == b'a'
+
+def test_unknown_version(registry):
+    wqdss.model_registry.add_model('m', model_zip({'a.csv': b'a'}))
+    with pytest.raises(wqdss.model_registry.ModelVersionNotFoundError):
+        wqdss.model_registry.get_manifest('m', 'no-such-version')
+    with pytest.raises(ModelNotFoundError):
+        wqdss.model_registry.get_manifest('no-such-model')
+
+
+def test_save_manifest_missing_blobs(registry):
+    digest = wqdss.model_registry.blob_store().put(b'a')
+    with pytest.raises(wqdss.model_registry.MissingBlobsError) as e:
+        wqdss.model_registry.save_manifest('m', {'a.csv': digest, 'b.csv': blob_digest(b'b')})
+    assert e.value.missing == [blob_digest(b'b')]
+    with pytest.raises(wqdss.model_registry.InvalidManifestError):
+        wqdss.model_registry.save_manifest('m', {'../a.csv': digest})
+
+
+def test_load_models(registry):
+    (registry / 'dir_model' / 'sub').mkdir(parents=True)
+    (registry / 'dir_model' / 'sub' / 'a.csv').write_bytes(b'a')
+    version = wqdss.model_registry.add_model('uploaded', model_zip({'b.csv': b'b'}))
+
+    wqdss.model_registry.MODELS.clear()
+    wqdss.model_registry.load_models()
+    wqdss.model_registry.wait_for_models()
+    assert sorted(wqdss.model_registry.get_models()) == ['dir_model', 'uploaded']
+    assert wqdss.model_registry.get_model_status('dir_model')['state'] == 'READY'
+    assert wqdss.model_registry.get_model_version('uploaded') == version
+    archive = zipfile.ZipFile(io.BytesIO(wqdss.model_registry.get_model_by_name('dir_model')))
+    assert archive.namelist() == ['sub/a.csv']
+
+
+def test_parse_range():
+    assert parse_range('bytes=0-9', 100) == (0, 9)
+    assert parse_range('bytes=90-', 100) == (90, 99)
+    assert parse_range('bytes=90-200', 100) == (90, 99)
+    assert parse_range('bytes=-10', 100) == (90, 99)
+    assert parse_range('bytes=-200', 100) == (0, 99)
+
+
+def test_parse_range_unsupported():
+    assert parse_range('bytes=0-9,20-29', 100) is None
+    assert parse_range('lines=0-9', 100) is None
+    assert parse_range('bytes=a-b', 100) is None
+
+
+def test_parse_range_not_satisfiable():
+    with pytest.raises(InvalidRangeError):
+        parse_range('bytes=100-', 100)
+    with pytest.raises(InvalidRangeError):
+        parse_range('bytes=20-10', 100)
+
+
+def test_read_archive(tmp_path):
+    archive = tmp_path / "model.zip"
+    archive.write_bytes(bytes(range(100)))
+    chunks = list(read_archive(archive, 10, 54, chunk_size=20))
+    assert [len(c) for c in chunks] == [20, 20, 5]
+    assert b''.join(chunks) == bytes(range(10, 55))
+
+
+def response(status_code, chunks=(), etag='"v1"', error_after=None):
+    resp = Mock()
+    resp.status_code = status_code
+    resp.headers = {'ETag': etag} if etag else {}
+
+    def iter_content(chunk_size):
+        for i, chunk in enumerate(chunks):
+            if i == error_after:
+                raise requests.exceptions.ChunkedEncodingError('connection reset')
+            yield chunk
+
+    resp.iter_content.side_effect = iter_content
+    return resp
+
+
+def test_load_models_from_index(registry):
+    version = wqdss.model_registry.add_model('m', model_zip({'a.csv': b'a', 'b.csv': b'bb'}))
+
+    # the index is enough to load the models, their manifests aren't read
+    (registry / '.manifests' / 'm' / 'current').unlink()
+    wqdss.model_registry.MODELS.clear()
+    wqdss.model_registry.load_models()
+    assert wqdss.model_registry.MODELS['m'] == {'version': version, 'size': 3, 'files': ['a.csv', 'b.csv']}
+
+    # a registry without an index rebuilds it from the manifests
+    (registry / '.manifests' / 'm' / 'current').write_text(version)
+    (registry / '.index.json').unlink()
+    wqdss.model_registry.MODELS.clear()
+    wqdss.model_registry.load_models()
+    assert wqdss.model_registry.get_model_version('m') == version
+    assert (registry / '.index.json').exists()
+
+
+def test_model_status(registry, monkeypatch):
+    release = threading.Event()
+    build_archive = wqdss.model_registry.build_archive
+    monkeypatch.setattr(wqdss.model_registry, 'build_archive', lambda *args: release.wait() and build_archive(*args))
+    (registry / 'dir_model').mkdir()
+    (registry / 'dir_model' / 'a.csv').write_bytes(b'a')
+
+    wqdss.model_registry.load_models()
+    wqdss.model_registry.MODEL_IMPORTS['dir_model'].result()
+    assert wqdss.model_registry.get_model_status('dir_model')['state'] == 'ARCHIVING'
+
+    # the files of the model can already be fetched, only the archive is waited for
+    assert [f['path'] for f in wqdss.model_registry.get_manifest('dir_model')['files']] == ['a.csv']
+    release.set()
+    wqdss.model_registry.get_model_archive('dir_model')
+    assert wqdss.model_registry.get_model_status('dir_model')['state'] == 'READY'
+    with pytest.raises(ModelNotFoundError):
+        wqdss.model_registry.get_model_status('no-such-model')
+
+
+def test_model_importing(registry, monkeypatch):
+    release = threading.Event()
+    add_model_dir = wqdss.model_registry.add_model_dir
+    monkeypatch.setattr(wqdss.model_registry, 'add_model_dir', lambda *args: release.wait() and add_model_dir(*args))
+    (registry / 'dir_model').mkdir()
+    (registry / 'dir_model' / 'a.csv').write_bytes(b'a')
+
+    wqdss.model_registry.load_models()
+    assert wqdss.model_registry.get_model_status('dir_model')['state'] == 'IMPORTING'
+    with pytest.raises(wqdss.model_registry.ModelNotReadyError):
+        wqdss.model_registry.get_model_version('dir_model')
+    release.set()
+
+
+def test_client_not_modified():
+    requests_mod = Mock()
+    requests_mod.get.return_value = response(304)
+    client = ModelRegistryClient("/models", requests_mod)
+
+    assert client.get_model("a", "v1") == ("v1", None)
+    assert requests_mod.get.call_args[1]['headers'] == {'If-None-Match': '"v1"'}
+
+
+def test_client_not_found():
+    requests_mod = Mock()
+    requests_mod.get.return_value = response(404)
+    client = ModelRegistryClient("/models", requests_mod)
+
+    with pytest.raises(ModelNotFoundError):
+        client.get_model("a")
+
+
+
+def test_client_version_errors():
+    requests_mod = Mock()
+    client = ModelRegistryClient("/models", requests_mod)
+
+    requests_mod.get.return_value = response(404)
+    with pytest.raises(ModelNotFoundError):
+        client.get_model_version("a")
+
+    requests_mod.get.return_value = response(503)
+    with pytest.raises(ModelNotReadyError):
+        client.get_model_version("a")
+
+
+def test_client_resumes_download():
+    requests_mod = Mock()
+    requests_mod.get.side_effect = [response(200, [b'abc', b'def', b'ghi'], error_after=2), response(206, [b'ghi'])]
+    client = ModelRegistryClient("/models", requests_mod)
+
+    assert client.get_model("a") == ("v1", b'abcdefghi')
+    assert requests_mod.get.call_args[1]['headers'] == {'Range': 'bytes=6-', 'If-Range': '"v1"'}
+
+
+def test_client_restarts_changed_download():
+    requests_mod = Mock()
+    requests_mod.get.side_effect = [response(200, [b'abc', b'def'], error_after=1),
+                                    response(200, [b'new', b'model'], etag='"v2"')]
+    client = ModelRegistryClient("/models", requests_mod)
+
+    assert client.get_model("a") == ("v2", b'newmodel')
+
+
+def test_client_download_retries(monkeypatch):
+    monkeypatch.setattr(wqdss.model_registry, 'DOWNLOAD_RETRIES', 1)
+    requests_mod = Mock()
+    requests_mod.get.side_effect = [response(200, [b'abc', b'def'], error_after=1),
+                                    response(206, [b'def'], error_after=0)]
+    client = ModelRegistryClient("/models", requests_mod)
+
+    with pytest.raises(requests.exceptions.ChunkedEncodingError):
+        client.get_model("a")
+
+
+def test_client_fetches_missing_blobs(tmp_path):
+    blobs = {blob_digest(b'a'): b'a', blob_digest(b'b'): b'b'}
+    manifest = {'version': 'v2', 'files': [{'path': 'a.csv', 'digest': blob_digest(b'a')},
+                                           {'path': 'b.csv', 'digest': blob_digest(b'b')}]}
+    blob_cache = BlobStore(str(tmp_path))
+    blob_cache.put(b'a')
+
+    def get(url, **kwargs):
+        if url.endswith('/manifest'):
+            resp = response(200)
+            resp.json.return_value = manifest
+            return resp
+        resp = response(200)
+        resp.content = blobs[url.rsplit('/', 1)[1]]
+        return resp
+
+    requests_mod = Mock()
+    requests_mod.get.side_effect = get
+    client = ModelRegistryClient("/models", requests_mod, blob_cache=blob_cache)
+
+    version, contents = client.get_model("m", "v1")
+    assert version == 'v2'
+    assert zipfile.ZipFile(io.BytesIO(contents)).read('b.csv') == b'b'
+    assert [c[0][0] for c in requests_mod.get.call_args_list] == ['/models/m/manifest', f'/blobs/{blob_digest(b"b")}']
+    assert requests_mod.get.call_args_list[0][1]['headers'] == {'If-None-Match': '"v1"'}
+
+
+def test_client_uploads_missing_blobs():
+    requests_mod = Mock()
+    conflict, created = response(409), response(200)
+    conflict.json.return_value = {'missing': [blob_digest(b'b')]}
+    created.json.return_value = {'model_name': 'm', 'version': 'v2'}
+    requests_mod.post.side_effect = [conflict, created]
+    client = ModelRegistryClient("/models", requests_mod)
+
+    assert client.add_model_files('m', {'a.csv': b'a', 'b.csv': b'b'}) == {'model_name': 'm', 'version': 'v2'}
+    requests_mod.put.assert_called_once_with(f'/blobs/{blob_digest(b"b")}', data=b'b')
@@ -0,0 +1,63 @@
+import os
+import sys
+import threading
+from unittest.mock import patch
+
+import pytest
+
+import wqdss.process_pool
+from wqdss.process_pool import ModelProcessPool
+
+
+def test_cgroup_cpu_limit(tmp_path):
+    cpu_max = tmp_path / "cpu.max"
+    with patch.object(wqdss.process_pool, 'CGROUP_V2_CPU_MAX', str(cpu_max)), \
+            patch.object(wqdss.process_pool, 'CGROUP_V1_CPU_QUOTA', str(tmp_path / "cfs_quota_us")), \
+            patch.object(wqdss.process_pool, 'CGROUP_V1_CPU_PERIOD', str(tmp_path / "cfs_period_us")):
+        assert wqdss.process_pool.cgroup_cpu_limit() is None
+
+        cpu_max.write_text("max 100000\n")
+        assert wqdss.process_pool.cgroup_cpu_limit() is None
+
+        cpu_max.write_text("250000 100000\n")
+        assert wqdss.process_pool.cgroup_cpu_limit() == 3
+
+        cpu_max.unlink()
+        (tmp_path / "cfs_quota_us").write_text("150000")
+        (tmp_path / "cfs_period_us").write_text("100000")
+        assert wqdss.process_pool.cgroup_cpu_limit() == 2
+
+
+def test_available_cpus():
+    with patch('os.sched_getaffinity', return_value={0, 2, 4, 6}), \
+            patch('wqdss.process_pool.cgroup_cpu_limit', return_value=2):
+        assert wqdss.process_pool.available_cpus() == [0, 2]
+        assert wqdss.process_pool.get_model_processes("auto") == 2
+        assert wqdss.process_pool.get_model_processes("0") == 1
+
+
+@pytest.mark.skipif(not hasattr(os, 'sched_setaffinity'), reason="cpu affinity is only supported on linux")
+def test_process_pool(tmp_path):
+    cpu = sorted(os.sched_getaffinity(0))[0]
+    pool = ModelProcessPool([cpu], memory_limit=1024 * 1024 * 1024)
+    out_file = tmp_path / "affinity"
+    script = f"import os, time; time.sleep(0.2); open({str(out_file)!r}, 'w').write(str(os.sched_getaffinity(0)))"
+
+    assert pool.run([sys.executable, '-c', script]) == 0
+    assert out_file.read_text() == str({cpu})
+
+    # the cpu is returned to the pool after every run, so runs that wait for it all get to run
+    threads = [threading.Thread(target=pool.run, args=([sys.executable, '-c', 'pass'],)) for _ in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert pool._free.qsize() == 1
+
+
+def test_worker_concurrency():
+    import wqdss.celery
+
+    # every model process of the pool runs the task of a thread of the worker
+    assert wqdss.celery.app.conf.worker_pool == 'threads'
+    assert wqdss.celery.app.conf.worker_concurrency == wqdss.process_pool.get_model_processes()
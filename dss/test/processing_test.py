@@ -1,5 +1,8 @@
+import asyncio
+import copy
 from io import BytesIO, StringIO
 import itertools
+import json
 import logging
 import os
 import shutil
@@ -15,6 +18,10 @@ import wqdss
 import wqdss.processing
 import wqdss.tasks
 import wqdss.model_execution
+import wqdss.run_cache
+import wqdss.artifacts
+import wqdss.scoring
+import wqdss.execution_store
 
 params = {
     'model_analysis': {
@@ -37,11 +44,24 @@ params = {
 }
 
 
+@pytest.fixture(autouse=True)
+def run_cache():
+    # every test mocks the worker differently, so results must not be reused between tests
+    with patch.object(wqdss.processing, 'RUN_CACHE', wqdss.run_cache.RunResultCache()) as cache:
+        yield cache
+
+
+@pytest.fixture(autouse=True)
+def execution_store():
+    with patch.object(wqdss.processing, 'EXECUTION_STORE', wqdss.execution_store.SqliteExecutionStore(':memory:')) as store:
+        yield store
+
+
 @pytest.mark.asyncio
 async def test_execute_dss():
     exec_id = 'foo'
 
-    async def execute_on_worker_side_effect(model_name, param_values_dict, output_file):
+    async def execute_on_worker_side_effect(model_name, param_values_dict, output_file, model_analysis, model_version):
 
         param_values = wqdss.model_execution.ModelExecutionPermutation.from_dict(param_values_dict)
 
@@ -67,6 +87,22 @@ async def test_execute_dss():
     assert wqdss.processing.get_result(exec_id)[-1]['score'] == approx(4.4)
 
 
+
+@pytest.mark.asyncio
+async def test_execute_dss_duplicate_parameters():
+    exec_id = 'duplicate'
+    test_params = copy.deepcopy(params)
+    test_params['model_analysis']['parameters'] = [
+        {'name': 'NO3', 'objective': 'rmse', 'target_series': series, 'weight': '1', 'score_step': '0.1'}
+        for series in ([[1, 3.2]], [[1, 3.4]])]
+
+    with patch('wqdss.processing.execute_on_worker', new=CoroutineMock()) as execute_on_worker:
+        with pytest.raises(wqdss.scoring.DuplicateParameterError):
+            await wqdss.processing.execute_dss(exec_id, test_params)
+
+    assert execute_on_worker.call_count == 0
+    assert 'NO3:rmse' in wqdss.processing.get_result(exec_id)[0]['error']
+
 @pytest.mark.asyncio
 async def test_execute_dss_multi_iteration():
     exec_id = 'foo'
@@ -90,7 +126,7 @@ async def test_execute_dss_multi_iteration():
         },
     }
 
-    async def execute_on_worker_side_effect(model_name, param_values_dict, output_file):
+    async def execute_on_worker_side_effect(model_name, param_values_dict, output_file, model_analysis, model_version):
 
         param_values = wqdss.model_execution.ModelExecutionPermutation.from_dict(param_values_dict)
 
@@ -113,41 +149,340 @@ async def test_execute_dss_multi_iteration():
 
         return out_zip_io.getvalue()
 
-    with patch('wqdss.processing.execute_on_worker', new=CoroutineMock(side_effect=execute_on_worker_side_effect)) as execute_on_worker:
+    with patch('wqdss.processing.execute_on_worker', new=CoroutineMock(side_effect=execute_on_worker_side_effect)) as execute_on_worker, \
+            patch('wqdss.processing.get_model_version', return_value='v1'):
         await wqdss.processing.execute_dss(exec_id, test_params)
 
     # 1st iteration: 11 values for q_in, 10 values for hangq01
-    # 2nd iteration: 11 values for q_in, 11 values for hangq01
-    assert execute_on_worker.call_count == 10 * 11 + 11 * 11
+    # 2nd iteration: 11 values for q_in, 11 values for hangq01, the best run of the 1st iteration is reused
+    assert execute_on_worker.call_count == 10 * 11 + 11 * 11 - 1
+    assert wqdss.processing.get_result(exec_id)[-1]['score'] == approx(0)
+
+
+@pytest.mark.asyncio
+async def test_execute_dss_coordinate_search():
+    exec_id = 'coordinate'
+    test_params = {
+        'model_analysis': {
+            'parameters': [
+                {'name': 'NO3', 'target': '5.2', 'weight': '1', 'score_step': '0.001'},
+                {'name': 'DO', 'target': '35.4', 'weight': '1', 'score_step': '0.005'},
+            ],
+            "output_file": "tsr_2_seg7.csv",
+        },
+        'model_run': {
+            'type': 'flow',
+            'search': 'coordinate',
+            'input_files': [
+                {'name': 'hangq01.csv', 'col_name': 'Q',
+                 'min_val': '1', 'max_val': '10', 'steps': ['1', '0.1']},
+                {'name': 'qin_br8.csv', 'col_name': 'QWD',
+                 'min_val': '30', 'max_val': '40', 'steps': ['1', '0.1']}
+            ]
+        },
+    }
+
+    async def execute_on_worker_side_effect(model_name, param_values_dict, output_file, model_analysis, model_version):
+        param_values = wqdss.model_execution.ModelExecutionPermutation.from_dict(param_values_dict)
+        out_zip_io = BytesIO()
+        with zipfile.ZipFile(out_zip_io, 'w') as out_zip:
+            no3_val = param_values.values['hangq01.csv']
+            do_val = param_values.values['qin_br8.csv']
+            out_zip.writestr(output_file, f'NO3,DO,\n{no3_val},{do_val},\n'.encode())
+
+        return out_zip_io.getvalue()
+
+    with patch('wqdss.processing.execute_on_worker', new=CoroutineMock(side_effect=execute_on_worker_side_effect)) as execute_on_worker:
+        await wqdss.processing.execute_dss(exec_id, test_params)
+
+    # a fraction of the 10 * 11 + 11 * 11 runs of the grid search
+    assert execute_on_worker.call_count < 10 * 11
     assert wqdss.processing.get_result(exec_id)[-1]['score'] == approx(0)
+    assert wqdss.processing.get_result(exec_id)[-1]['params'].values == approx({'hangq01.csv': 5.2, 'qin_br8.csv': 35.4})
+
+
+@pytest.mark.asyncio
+async def test_execute_dss_surrogate():
+    exec_id = 'surrogate'
+    test_params = {
+        'model_analysis': {
+            'parameters': [
+                {'name': 'NO3', 'target': '5.2', 'weight': '1', 'score_step': '0.001'},
+                {'name': 'DO', 'target': '35.4', 'weight': '1', 'score_step': '0.005'},
+            ],
+            "output_file": "tsr_2_seg7.csv",
+        },
+        'model_run': {
+            'type': 'flow',
+            'surrogate': {'round_size': 8},
+            'input_files': [
+                {'name': 'hangq01.csv', 'col_name': 'Q',
+                 'min_val': '1', 'max_val': '10', 'steps': ['1', '0.1']},
+                {'name': 'qin_br8.csv', 'col_name': 'QWD',
+                 'min_val': '30', 'max_val': '40', 'steps': ['1', '0.1']}
+            ]
+        },
+    }
+
+    async def execute_on_worker_side_effect(model_name, param_values_dict, output_file, model_analysis, model_version):
+        param_values = wqdss.model_execution.ModelExecutionPermutation.from_dict(param_values_dict)
+        out_zip_io = BytesIO()
+        with zipfile.ZipFile(out_zip_io, 'w') as out_zip:
+            no3_val = param_values.values['hangq01.csv']
+            do_val = param_values.values['qin_br8.csv']
+            out_zip.writestr(output_file, f'NO3,DO,\n{no3_val},{do_val},\n'.encode())
+
+        return out_zip_io.getvalue()
+
+    with patch('wqdss.processing.execute_on_worker', new=CoroutineMock(side_effect=execute_on_worker_side_effect)) as execute_on_worker:
+        await wqdss.processing.execute_dss(exec_id, test_params)
+
+    result = wqdss.processing.get_result(exec_id)
+    assert result[-1]['score'] == approx(0)
+    # every run of the grid search was either executed or skipped
+    assert execute_on_worker.call_count + sum(r['skipped'] for r in result) == 10 * 11 + 11 * 11
+    assert execute_on_worker.call_count < 10 * 11
+
+
+@pytest.mark.asyncio
+async def test_execute_dss_reuses_runs(run_cache):
+
+    async def execute_on_worker_side_effect(model_name, param_values_dict, output_file, model_analysis, model_version):
+        out_zip_io = BytesIO()
+        with zipfile.ZipFile(out_zip_io, 'w') as out_zip:
+            out_zip.writestr(output_file, b'NO3,NH4,DO,\n3.7,2.4,8.0,\n')
+        return out_zip_io.getvalue()
+
+    with patch('wqdss.processing.execute_on_worker', new=CoroutineMock(side_effect=execute_on_worker_side_effect)) as execute_on_worker, \
+            patch('wqdss.processing.get_model_version', return_value='v1'):
+        await wqdss.processing.execute_dss('first', params)
+        await wqdss.processing.execute_dss('second', params)
+        assert execute_on_worker.call_count == 6 * 3
+        assert run_cache.stats()['hits'] == 6 * 3
+
+    # a different version of the model executes all runs again
+    with patch('wqdss.processing.execute_on_worker', new=CoroutineMock(side_effect=execute_on_worker_side_effect)) as execute_on_worker, \
+            patch('wqdss.processing.get_model_version', return_value='v2'):
+        await wqdss.processing.execute_dss('third', params)
+        assert execute_on_worker.call_count == 6 * 3
+
+    assert wqdss.processing.get_result('second')[-1]['score'] == approx(0)
+
+
+@pytest.mark.asyncio
+async def test_execute_dss_reuses_scored_runs(tmp_path, run_cache):
+
+    async def execute_on_worker_side_effect(model_name, param_values_dict, output_file, model_analysis, model_version):
+        # the worker scores the run, and returns the run files inline along with the score record
+        out_zip_io = BytesIO()
+        with zipfile.ZipFile(out_zip_io, 'w') as out_zip:
+            out_zip.writestr(output_file, json.dumps(param_values_dict))
+        do_val = param_values_dict['values'][1] / 5
+        record = wqdss.scoring.score_run(model_analysis, ['NO3,NH4,DO,\n', f'3.7,2.4,{do_val},\n'])
+        record['result'] = out_zip_io.getvalue()
+        return record
+
+    with patch('wqdss.processing.execute_on_worker', new=CoroutineMock(side_effect=execute_on_worker_side_effect)) as execute_on_worker, \
+            patch.object(wqdss.processing, 'BEST_RUNS_DIR', str(tmp_path / "best_runs")), \
+            patch('wqdss.processing.get_model_version', return_value='v1'):
+        await wqdss.processing.execute_dss('first', params)
+        await wqdss.processing.execute_dss('second', params)
+        # the cache doesn't keep the files of the runs, so only the best run is executed again for its files
+        assert execute_on_worker.call_count == 6 * 3 + 1
+        best_run_contents = wqdss.processing.get_best_run('second')
+        assert best_run_contents == wqdss.processing.get_best_run('first')
+
+    best_run = zipfile.ZipFile(BytesIO(best_run_contents))
+    assert json.loads(best_run.read('tsr_2_seg7.csv'))['values'] == approx([1.0, 40.0])
+
+
+@pytest.mark.asyncio
+async def test_execute_dss_events():
+
+    async def execute_on_worker_side_effect(model_name, param_values_dict, output_file, model_analysis, model_version):
+        return {'values': {'NO3': 3.7, 'NH4': 2.4, 'DO': param_values_dict['values'][1] / 5}, 'result': b''}
+
+    with patch('wqdss.processing.execute_on_worker', new=CoroutineMock(side_effect=execute_on_worker_side_effect)), \
+            patch.object(wqdss.processing.Execution, 'save_best_run'), \
+            patch('wqdss.processing.get_model_version', return_value=None), \
+            wqdss.processing.EXECUTION_EVENTS.subscribe('events') as queue:
+        await wqdss.processing.execute_dss('events', params)
+
+    events = [queue.get_nowait() for _ in range(queue.qsize())]
+    assert [e['type'] for e in events] == ['iteration'] + ['run'] * 18 + ['iteration_complete', 'completed']
+    assert events[0]['iteration_runs'] == 18
+    assert events[1]['iteration_runs_remaining'] == 17
+    assert events[18]['runs_completed'] == 18
+    assert events[18]['iteration_runs_remaining'] == 0
+    assert events[-2]['best_score'] == approx(0)
+    assert events[-1]['result'][-1]['params'] == approx({'hangq01.csv': 1.0, 'qin_br8.csv': 40.0})
+
+
+@pytest.mark.asyncio
+async def test_execute_dss_early_stopping(execution_store):
+    never = asyncio.Event()
+
+    async def execute_on_worker_side_effect(model_name, param_values_dict, output_file, model_analysis, model_version):
+        # only the first run completes, the others are queued until they are cancelled
+        if param_values_dict['values'] != [1.0, 30.0]:
+            await never.wait()
+        return {'values': {'NO3': 3.7, 'NH4': 2.4, 'DO': 8.0}, 'score': 0.0, 'result': b''}
+
+    stopping_params = dict(params, model_run=dict(params['model_run'], stopping={'score_threshold': 0.1}))
+    with patch('wqdss.processing.execute_on_worker', new=CoroutineMock(side_effect=execute_on_worker_side_effect)), \
+            patch.object(wqdss.processing.Execution, 'save_best_run'), \
+            patch('wqdss.processing.get_model_version', return_value=None):
+        await wqdss.processing.execute_dss('stopped', stopping_params)
+
+    result = wqdss.processing.get_result('stopped')
+    assert len(result) == 1
+    assert result[0]['params'].values == approx({'hangq01.csv': 1.0, 'qin_br8.csv': 30.0})
+    assert 'threshold' in result[0]['stopped']
+    assert len(execution_store.get_runs('stopped')) == 1
+
+
+@pytest.mark.asyncio
+async def test_resume_execution(execution_store):
+    completed = asyncio.Event()
+
+    def run_record(param_values_dict):
+        return {'values': {'NO3': 3.7, 'NH4': 2.4, 'DO': param_values_dict['values'][1] / 5}, 'result': b''}
+
+    async def interrupted_worker(model_name, param_values_dict, output_file, model_analysis, model_version):
+        # the API stops after 5 runs complete
+        if len(execution_store.get_runs('resumed')) >= 5:
+            completed.set()
+            await asyncio.Event().wait()
+        return run_record(param_values_dict)
+
+    async def worker(model_name, param_values_dict, output_file, model_analysis, model_version):
+        return run_record(param_values_dict)
+
+    with patch.object(wqdss.processing.Execution, 'save_best_run'), \
+            patch('wqdss.processing.get_model_version', return_value=None):
+        with patch('wqdss.processing.execute_on_worker', new=CoroutineMock(side_effect=interrupted_worker)), \
+                patch.object(wqdss.processing, 'RUN_SCHEDULER', wqdss.processing.RunScheduler(1)):
+            task = asyncio.ensure_future(wqdss.processing.execute_dss('resumed', params))
+            await completed.wait()
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+        assert 'resumed' not in wqdss.processing.EXECUTIONS
+        assert wqdss.processing.get_status('resumed') == 'RUNNING'
+        assert len(execution_store.get_runs('resumed')) == 5
+
+        # only the runs that didn't complete are executed when the execution is resumed
+        with patch('wqdss.processing.execute_on_worker', new=CoroutineMock(side_effect=worker)) as execute_on_worker:
+            await asyncio.gather(*wqdss.processing.resume_executions())
+            assert execute_on_worker.call_count == 18 - 5
+
+    assert wqdss.processing.get_status('resumed') == 'COMPLETED'
+    assert wqdss.processing.get_result('resumed')[-1]['score'] == approx(0)
+    assert len(execution_store.get_runs('resumed')) == 18
+
+
+@pytest.mark.asyncio
+async def test_execute_dss_artifacts(tmp_path, execution_store):
+    artifact_store = wqdss.artifacts.LocalArtifactStore(str(tmp_path / "artifacts"))
+
+    async def execute_on_worker_side_effect(model_name, param_values_dict, output_file, model_analysis, model_version):
+        param_values = wqdss.model_execution.ModelExecutionPermutation.from_dict(param_values_dict)
+        out_zip_io = BytesIO()
+        with zipfile.ZipFile(out_zip_io, 'w') as out_zip:
+            out_zip.writestr(output_file, json.dumps(param_values_dict))
+
+        # the worker scores the run, and returns a reference to the run files along with the score record
+        no3_val = 3.0 + (0.1 * param_values.values['hangq01.csv'])
+        do_val = 4.8 + (0.02 * param_values.values['qin_br8.csv'])
+        record = wqdss.scoring.score_run(model_analysis, ['NO3,NH4,DO,\n', f'{no3_val},2.1,{do_val},\n'])
+        record['artifact'] = artifact_store.put(out_zip_io.getvalue())
+        return record
+
+    with patch('wqdss.processing.execute_on_worker', new=CoroutineMock(side_effect=execute_on_worker_side_effect)), \
+            patch.object(wqdss.processing, 'ARTIFACT_STORE', artifact_store), \
+            patch.object(wqdss.processing, 'BEST_RUNS_DIR', str(tmp_path / "best_runs")), \
+            patch('wqdss.processing.get_out_contents', side_effect=AssertionError('run files are not parsed')), \
+            patch('wqdss.processing.get_values_score', side_effect=AssertionError('runs are not scored')):
+        await wqdss.processing.execute_dss('artifacts', params)
+        best_run_contents = wqdss.processing.get_best_run('artifacts')
+        best_run = zipfile.ZipFile(BytesIO(best_run_contents))
+
+    assert best_run.namelist() == ['tsr_2_seg7.csv']
+    assert wqdss.processing.get_result('artifacts')[-1]['score'] == approx(4.4)
+    assert 'artifacts' not in wqdss.processing.EXECUTIONS
+    assert wqdss.processing.get_executions(fields=['id', 'state']) == {
+        'executions': [{'id': 'artifacts', 'state': 'COMPLETED'}], 'next_cursor': None}
+    runs = execution_store.get_runs('artifacts')
+    assert len(runs) == 3 * 6
+
+    # only the files of the best run are kept in the artifact store
+    kept = [run for run in runs if os.path.exists(artifact_store._path(run['artifact']))]
+    assert len(kept) == 1
+    assert artifact_store.get(kept[0]['artifact']) == best_run_contents
+
+
+@pytest.mark.asyncio
+async def test_execute_dss_artifacts_reused(tmp_path, run_cache):
+    artifact_store = wqdss.artifacts.LocalArtifactStore(str(tmp_path / "artifacts"))
+
+    async def execute_on_worker_side_effect(model_name, param_values_dict, output_file, model_analysis, model_version):
+        out_zip_io = BytesIO()
+        with zipfile.ZipFile(out_zip_io, 'w') as out_zip:
+            out_zip.writestr(output_file, json.dumps(param_values_dict))
+        # the best run is the one with a flow of 3
+        no3_val = 3.7 + 0.1 * abs(param_values_dict['values'][0] - 3)
+        record = wqdss.scoring.score_run(model_analysis, ['NO3,NH4,DO,\n', f'{no3_val},2.4,8.0,\n'])
+        record['artifact'] = artifact_store.put(out_zip_io.getvalue())
+        return record
+
+    def flow_params(min_val, max_val):
+        flow_params = copy.deepcopy(params)
+        flow_params['model_run']['input_files'] = [
+            {'name': 'hangq01.csv', 'col_name': 'Q', 'min_val': min_val, 'max_val': max_val, 'steps': ['1']}]
+        return flow_params
+
+    with patch('wqdss.processing.execute_on_worker', new=CoroutineMock(side_effect=execute_on_worker_side_effect)) as execute_on_worker, \
+            patch.object(wqdss.processing, 'ARTIFACT_STORE', artifact_store), \
+            patch.object(wqdss.processing, 'BEST_RUNS_DIR', str(tmp_path / "best_runs")), \
+            patch('wqdss.processing.get_model_version', return_value='v1'):
+        await wqdss.processing.execute_dss('all_flows', flow_params('1', '5'))
+        # the runs whose files were removed are no longer cached, so they are executed again
+        await wqdss.processing.execute_dss('high_flows', flow_params('4', '5'))
+        assert execute_on_worker.call_count == 5 + 2
+        assert run_cache.stats()['runs'] == 2
+        best_run_contents = wqdss.processing.get_best_run('high_flows')
+
+    best_run = zipfile.ZipFile(BytesIO(best_run_contents))
+    assert json.loads(best_run.read('tsr_2_seg7.csv'))['values'] == approx([4.0])
 
 
 def test_get_run_score():
     # test where all values are at their targets
-    with patch('wqdss.processing.get_run_parameter_value', side_effect=[3.7, 2.4, 8.0]):
-        result = wqdss.processing.get_run_score(params, "")
+    with patch('wqdss.scoring.get_run_parameter_value', side_effect=[3.7, 2.4, 8.0]):
+        result = wqdss.scoring.get_run_score(params, "")
         assert result == 0
 
     # test where one value exceeds target (wrong direction)
-    with patch('wqdss.processing.get_run_parameter_value', side_effect=[3.7, 2.4, 7.0]):
-        result = wqdss.processing.get_run_score(params, "")
+    with patch('wqdss.scoring.get_run_parameter_value', side_effect=[3.7, 2.4, 7.0]):
+        result = wqdss.scoring.get_run_score(params, "")
         assert result == approx(1.0)  # (|(7.0 - 8.0)/0.5)| / 2.0)
 
     # test where two values exceed target (wrong direction)
-    with patch('wqdss.processing.get_run_parameter_value', side_effect=[3.8, 2.4, 7.0]):
-        result = wqdss.processing.get_run_score(params, "")
+    with patch('wqdss.scoring.get_run_parameter_value', side_effect=[3.8, 2.4, 7.0]):
+        result = wqdss.scoring.get_run_score(params, "")
         # (|(3.7 - 3.8)/0.1|) / 4.0) + (|(7.0 - 8.0)/0.5)| / 2.0)
         assert result == approx(1.25)
 
     # test where two values exceed target (one in wrong direction, one in right direction)
-    with patch('wqdss.processing.get_run_parameter_value', side_effect=[3.6, 2.4, 7.0]):
-        result = wqdss.processing.get_run_score(params, "")
+    with patch('wqdss.scoring.get_run_parameter_value', side_effect=[3.6, 2.4, 7.0]):
+        result = wqdss.scoring.get_run_score(params, "")
         # (|(3.7 - 3.6)/0.1|) / 4.0) + (|(7.0 - 8.0)/0.5)| / 2.0)
         assert result == approx(1.25)
 
     # test where two values exceed target (both in right direction)
-    with patch('wqdss.processing.get_run_parameter_value', side_effect=[3.6, 2.4, 9.0]):
-        result = wqdss.processing.get_run_score(params, "")
+    with patch('wqdss.scoring.get_run_parameter_value', side_effect=[3.6, 2.4, 9.0]):
+        result = wqdss.scoring.get_run_score(params, "")
         # (|(3.7 - 3.6)/0.1|) / 4.0) + (|(9.0 - 8.0)/0.5)| / 2.0)
         assert result == approx(1.25)
 
@@ -317,3 +652,85 @@ def test_model_execution_sync():
 @pytest.mark.skip
 def test_model_execution_async():
     assert False
+
+
+def test_prepare_run_dir_from_template(tmp_path):
+    model_zip_io = BytesIO()
+    with zipfile.ZipFile(model_zip_io, 'w') as model_zip:
+        model_zip.writestr('qin_br8.csv', 'Flow_file,\n,\nJDAY,QWD\n1,157.15\n1.01,40.38\n')
+        model_zip.writestr('met.csv', 'met\n')
+        model_zip.writestr('sub/w2_con.npt', 'control\n')
+        model_zip.writestr('snp.opt', 'snapshot\n')
+
+    templates = wqdss.model_execution.ModelTemplates(str(tmp_path))
+    template_dir = templates.get_template('model', 'v1', model_zip_io.getvalue())
+    assert templates.get_template('model', 'v1', b'') == template_dir
+
+    permutation = wqdss.model_execution.ModelExecutionPermutation(['qin_br8.csv'], ['QWD'], [30.0])
+    run_dir = wqdss.model_execution.prepare_run_dir_from_template(permutation, template_dir)
+    extracted_dir = wqdss.model_execution.prepare_run_dir(permutation, model_zip_io.getvalue())
+
+    for f in ['qin_br8.csv', 'met.csv', 'snp.opt', os.path.join('sub', 'w2_con.npt')]:
+        with open(os.path.join(run_dir, f)) as linked, open(os.path.join(extracted_dir, f)) as extracted:
+            assert linked.read() == extracted.read()
+
+    # read-only data files share the template's file, updated inputs and files the model may write don't
+    assert os.path.samefile(os.path.join(run_dir, 'met.csv'), os.path.join(template_dir, 'met.csv'))
+    assert not os.path.samefile(os.path.join(run_dir, 'snp.opt'), os.path.join(template_dir, 'snp.opt'))
+    with open(os.path.join(run_dir, 'snp.opt'), 'w') as f:
+        f.write('rewritten by the model\n')
+    with open(os.path.join(template_dir, 'snp.opt')) as f:
+        assert f.read() == 'snapshot\n'
+    assert not os.path.samefile(os.path.join(run_dir, 'qin_br8.csv'), os.path.join(template_dir, 'qin_br8.csv'))
+    with open(os.path.join(template_dir, 'qin_br8.csv')) as f:
+        assert '157.15' in f.read()
+
+    # the versions of a model are kept side by side, since executions pin the version they use
+    assert templates.get_template('model', 'v2', model_zip_io.getvalue()) != template_dir
+    assert os.path.exists(template_dir)
+
+
+def test_template_eviction(tmp_path):
+    model_zip_io = BytesIO()
+    with zipfile.ZipFile(model_zip_io, 'w') as model_zip:
+        model_zip.writestr('met.csv', 'met\n')
+    contents = model_zip_io.getvalue()
+
+    # room for a single template
+    templates = wqdss.model_execution.ModelTemplates(str(tmp_path), max_size=len('met\n'))
+    with templates.use('model', 'v1', contents) as v1_dir:
+        v2_dir = templates.get_template('model', 'v2', contents)
+        # a template isn't removed while a run directory is created from it
+        assert os.path.exists(v1_dir)
+
+    v3_dir = templates.get_template('model', 'v3', contents)
+    assert not os.path.exists(v1_dir)
+    assert not os.path.exists(v2_dir)
+    assert os.path.exists(v3_dir)
+    assert templates.size == len('met\n')
+
+
+def test_template_eviction_across_processes(tmp_path):
+    model_zip_io = BytesIO()
+    with zipfile.ZipFile(model_zip_io, 'w') as model_zip:
+        model_zip.writestr('met.csv', 'met\n')
+    contents = model_zip_io.getvalue()
+
+    # each worker process has its own templates, extracted into the same directory
+    worker = wqdss.model_execution.ModelTemplates(str(tmp_path), max_size=len('met\n'))
+    other_worker = wqdss.model_execution.ModelTemplates(str(tmp_path), max_size=len('met\n'))
+    with other_worker.use('model', 'v1', contents) as v1_dir:
+        worker.get_template('model', 'v1', contents)
+        worker.get_template('model', 'v2', contents)
+        # a template isn't removed while another process creates a run directory from it
+        assert os.path.exists(v1_dir)
+
+    worker.get_template('model', 'v1', contents)
+    worker.get_template('model', 'v3', contents)
+    assert not os.path.exists(v1_dir)
+
+    # the other process extracts the template it knew again, once it was removed
+    with other_worker.use('model', 'v1', contents) as template_dir:
+        assert template_dir == v1_dir
+        with open(os.path.join(template_dir, 'met.csv')) as f:
+            assert f.read() == 'met\n'
@@ -0,0 +1,106 @@
+import asyncio
+
+import pytest
+
+from wqdss.model_execution import ModelExecutionPermutation
+from wqdss.run_cache import RunResultCache, run_key
+
+
+def test_run_key():
+    a = ModelExecutionPermutation(['a.csv', 'b.csv'], ['Q', 'QWD'], [1.0, 30.0])
+    b = ModelExecutionPermutation(['b.csv', 'a.csv'], ['QWD', 'Q'], [30.0, 1.0000000000001])
+    analysis = {'output_file': 'out.csv', 'parameters': [{'name': 'DO', 'target': '8'}]}
+    other_target = {'output_file': 'out.csv', 'parameters': [{'name': 'DO', 'target': '9'}]}
+    assert run_key('v1', a, analysis) == run_key('v1', b, dict(analysis))
+    assert run_key('v1', a, analysis) != run_key('v2', a, analysis)
+    assert run_key('v1', a, analysis) != run_key('v1', a, other_target)
+
+
+@pytest.mark.asyncio
+async def test_concurrent_runs_execute_once():
+    cache = RunResultCache()
+    calls = []
+    release = asyncio.Event()
+
+    async def execute():
+        calls.append(1)
+        await release.wait()
+        return b'result'
+
+    waiters = [asyncio.ensure_future(cache.get_or_execute('key', execute)) for _ in range(3)]
+    await asyncio.sleep(0)
+    release.set()
+    assert await asyncio.gather(*waiters) == [b'result'] * 3
+    assert len(calls) == 1
+    assert await cache.get_or_execute('key', execute) == b'result'
+    assert cache.stats()['hits'] == 3
+
+
+@pytest.mark.asyncio
+async def test_failed_runs_are_not_cached():
+    cache = RunResultCache()
+
+    async def fail():
+        raise RuntimeError('run failed')
+
+    async def succeed():
+        return b'result'
+
+    with pytest.raises(RuntimeError):
+        await cache.get_or_execute('key', fail)
+    assert await cache.get_or_execute('key', succeed) == b'result'
+
+
+@pytest.mark.asyncio
+async def test_cancelled_run_is_executed_again():
+    cache = RunResultCache()
+    release = asyncio.Event()
+
+    async def execute():
+        await release.wait()
+        return b'result'
+
+    first = asyncio.ensure_future(cache.get_or_execute('key', execute))
+    await asyncio.sleep(0)
+    second = asyncio.ensure_future(cache.get_or_execute('key', execute))
+    await asyncio.sleep(0)
+
+    # the execution that was running the run stopped, the other one still gets its result
+    first.cancel()
+    await asyncio.sleep(0)
+    release.set()
+    assert await second == b'result'
+    assert first.cancelled()
+    assert cache.stats()['misses'] == 2
+
+
+def test_eviction():
+    cache = RunResultCache(max_size=10)
+    cache.add('a', b'a' * 6)
+    cache.add('b', b'b' * 6)
+    assert cache.stats()['runs'] == 1
+    assert cache.size == 6
+
+
+@pytest.mark.asyncio
+async def test_inline_files_are_not_cached():
+    cache = RunResultCache()
+    record = {'score': 1.0, 'values': {'DO': [8.0]}, 'result': b'zip' * 1000}
+
+    async def execute():
+        return record
+
+    # the execution that ran it gets the files, the cache only keeps the score and values
+    assert await cache.get_or_execute('key', execute) is record
+    assert await cache.get_or_execute('key', execute) == {'score': 1.0, 'values': {'DO': [8.0]}}
+    assert cache.size < 1000
+
+
+def test_discard():
+    cache = RunResultCache()
+    cache.add('key', {'score': 1.0, 'artifact': 'a' * 64})
+    cache.add('other', {'score': 2.0})
+    cache.discard('key')
+    cache.discard('missing')
+    assert 'key' not in cache._results
+    assert cache.size == len('2.0')
@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+
+from wqdss.scheduler import RunScheduler
+
+
+@pytest.mark.asyncio
+async def test_sliding_window():
+    scheduler = RunScheduler(3)
+    in_flight = []
+    max_in_flight = 0
+    releases = [asyncio.Event() for _ in range(6)]
+
+    async def run(i):
+        nonlocal max_in_flight
+        in_flight.append(i)
+        max_in_flight = max(max_in_flight, len(in_flight))
+        await releases[i].wait()
+        in_flight.remove(i)
+        return i
+
+    tasks = [asyncio.ensure_future(scheduler.run('exec', lambda i=i: run(i))) for i in range(6)]
+    await asyncio.sleep(0)
+    assert in_flight == [0, 1, 2]
+
+    # a single slow run doesn't hold back the others
+    releases[1].set()
+    await asyncio.sleep(0.01)
+    assert in_flight == [0, 2, 3]
+
+    for r in releases:
+        r.set()
+    assert await asyncio.gather(*tasks) == list(range(6))
+    assert max_in_flight == 3
+    assert scheduler.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_fairness_between_executions():
+    scheduler = RunScheduler(1)
+    order = []
+
+    async def run(exec_id):
+        order.append(exec_id)
+        await asyncio.sleep(0)
+
+    # execution b submits its runs while the runs of execution a are queued
+    tasks = [asyncio.ensure_future(scheduler.run('a', lambda: run('a'))) for _ in range(4)]
+    tasks += [asyncio.ensure_future(scheduler.run('b', lambda: run('b'))) for _ in range(2)]
+    await asyncio.gather(*tasks)
+
+    assert order == ['a', 'a', 'b', 'a', 'b', 'a']
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter():
+    scheduler = RunScheduler(1)
+    release = asyncio.Event()
+
+    first = asyncio.ensure_future(scheduler.run('a', release.wait))
+    second = asyncio.ensure_future(scheduler.run('a', release.wait))
+    await asyncio.sleep(0)
+    assert scheduler.num_waiting('a') == 1
+
+    second.cancel()
+    await asyncio.sleep(0)
+    assert scheduler.num_waiting() == 0
+
+    release.set()
+    await first
+    assert scheduler.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_unlimited():
+    scheduler = RunScheduler(-1)
+    release = asyncio.Event()
+    tasks = [asyncio.ensure_future(scheduler.run('a', release.wait)) for _ in range(10)]
+    await asyncio.sleep(0)
+    assert scheduler.in_flight == 10
+    release.set()
+    await asyncio.gather(*tasks)
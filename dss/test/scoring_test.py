@@ -0,0 +1,103 @@
+import pytest
+
+import wqdss.scoring
+
+OUTPUT = [
+    'JDAY,NO3,DO,\n',
+    '1.0,1.0,8.0,\n',
+    '2.0,3.0,6.0,\n',
+    '3.0,5.0,4.0,\n',
+    '5.0,7.0,2.0,\n',
+]
+
+
+def param_value(**param):
+    param.setdefault('name', 'NO3')
+    return wqdss.scoring.get_run_parameter_values({'parameters': [param]}, OUTPUT)[
+        wqdss.scoring.get_parameter_key(param)]
+
+
+def test_load_output_columns():
+    time, columns = wqdss.scoring.load_output_columns(OUTPUT, ['DO'])
+    assert time.tolist() == [1.0, 2.0, 3.0, 5.0]
+    assert list(columns) == ['DO']
+    assert columns['DO'].tolist() == [8.0, 6.0, 4.0, 2.0]
+
+    with pytest.raises(KeyError):
+        wqdss.scoring.load_output_columns(OUTPUT, ['NH4'])
+
+    with pytest.raises(wqdss.scoring.MalformedOutputError):
+        wqdss.scoring.load_output_columns(OUTPUT + ['6.0,1.0\n'], ['DO'])
+
+
+def test_load_output_columns_skips_other_columns():
+    # columns that aren't analysed are never parsed
+    output = ['JDAY,NAME,DO,\n', '1.0,a,8.0,\n', '2.0,b,6.0,\n']
+    time, columns = wqdss.scoring.load_output_columns(output, ['DO'])
+    assert time.tolist() == [1.0, 2.0]
+    assert columns['DO'].tolist() == [8.0, 6.0]
+
+    with pytest.raises(wqdss.scoring.MalformedOutputError):
+        wqdss.scoring.load_output_columns(output, ['NAME'])
+
+
+def test_load_output_columns_whitespace():
+    output = ['JDAY, NO3, DO,\r\n', '1.0, 1.0, 8.0, \r\n', '\r\n', '  \n', ' 2.0,3.0 ,6.0,\t\n', '3.0,5.0,4.0']
+    time, columns = wqdss.scoring.load_output_columns(output, ['DO', 'NO3'])
+    assert time.tolist() == [1.0, 2.0, 3.0]
+    assert columns['DO'].tolist() == [8.0, 6.0, 4.0]
+    assert columns['NO3'].tolist() == [1.0, 3.0, 5.0]
+
+    with pytest.raises(wqdss.scoring.MalformedOutputError):
+        wqdss.scoring.load_output_columns(OUTPUT + ['6.0,1.0,,\n'], ['DO'])
+
+
+def test_objectives():
+    assert param_value() == 7.0
+    assert param_value(objective='last') == 7.0
+    assert param_value(objective='mean') == 4.0
+    assert param_value(objective='min') == 1.0
+    assert param_value(objective='max') == 7.0
+    assert param_value(objective='percentile', percentile=50) == 4.0
+    assert param_value(name='DO', objective='min', start=2, end=3) == 4.0
+
+
+def test_time_fraction_objectives():
+    # NO3 is above 2.5 from day 2 to day 5, out of 4 simulated days
+    assert param_value(objective='time_above', threshold=2.5) == 0.75
+    assert param_value(objective='time_below', threshold=2.5) == 0.25
+
+
+def test_rmse_objective():
+    assert param_value(objective='rmse', target_series=[[1, 1], [4, 6]]) == 0.0
+    assert param_value(objective='rmse', target_series=[[1, 2], [3, 7]]) == pytest.approx(2.5 ** 0.5)
+
+    # the target of an rmse defaults to 0, and the score is the distance from it
+    params = {'parameters': [{'name': 'NO3', 'objective': 'rmse', 'target_series': [[1, 2]],
+                              'score_step': '0.5', 'weight': '1'}]}
+    assert wqdss.scoring.score_run(params, OUTPUT)['score'] == pytest.approx(2.0)
+
+
+def test_parameters_of_a_column():
+    params = {'parameters': [
+        {'name': 'NO3', 'target': '4', 'score_step': '1', 'weight': '1'},
+        {'name': 'NO3', 'objective': 'mean', 'target': '4', 'score_step': '1', 'weight': '1'},
+        {'name': 'NO3', 'objective': 'max', 'target': '4', 'score_step': '1', 'weight': '1'},
+        {'name': 'NO3', 'objective': 'percentile', 'percentile': 90, 'start': 2, 'target': '4',
+         'score_step': '1', 'weight': '1'},
+        # a parameter with the same objective shares the value, and is scored against its own target
+        {'name': 'NO3', 'objective': 'max', 'target': '6', 'score_step': '1', 'weight': '1'},
+    ]}
+    record = wqdss.scoring.score_run(params, OUTPUT)
+    assert record['values'] == {'NO3': 7.0, 'NO3:mean': 4.0, 'NO3:max': 7.0,
+                                'NO3:percentile(90)[2:]': pytest.approx(6.6)}
+    assert record['score'] == pytest.approx(3 + 0 + 3 + 2.6 + 1)
+
+    params['parameters'].append({'name': 'NO3', 'objective': 'max', 'start': 2, 'target': '6', 'score_step': '1',
+                                 'weight': '1'})
+    assert wqdss.scoring.score_run(params, OUTPUT)['values']['NO3:max[2:]'] == 7.0
+
+    rmse = [{'name': 'NO3', 'objective': 'rmse', 'target_series': series, 'score_step': '1', 'weight': '1'}
+            for series in ([[1, 1]], [[1, 2]])]
+    with pytest.raises(wqdss.scoring.DuplicateParameterError):
+        wqdss.scoring.score_run({'parameters': rmse}, OUTPUT)
@@ -0,0 +1,58 @@
+import os
+from unittest.mock import patch
+
+import pytest
+
+from wqdss.scratch import ScratchSpace, ScratchSpaceFullError
+
+
+def test_run_dirs_are_reused(tmp_path):
+    scratch = ScratchSpace(str(tmp_path), pool_size=1, min_free=0)
+    with scratch.run_dir() as run_dir:
+        os.mkdir(os.path.join(run_dir, 'sub'))
+        open(os.path.join(run_dir, 'sub', 'file'), 'w').close()
+
+    # the directory is emptied of files, and used by the next run
+    assert os.listdir(os.path.join(run_dir, 'sub')) == []
+    second, third = scratch.acquire(), scratch.acquire()
+    assert second == run_dir
+    assert third != run_dir
+
+    # only pool_size directories are kept
+    scratch.release(third)
+    scratch.release(second)
+    assert os.path.exists(third)
+    assert not os.path.exists(second)
+
+
+def test_failed_runs_are_kept(tmp_path):
+    scratch = ScratchSpace(str(tmp_path), keep_failed=2, min_free=0)
+    for i in range(3):
+        with pytest.raises(RuntimeError):
+            with scratch.run_dir() as run_dir:
+                open(os.path.join(run_dir, 'log'), 'w').write(str(i))
+                os.utime(run_dir, (i, i))
+                raise RuntimeError('run failed')
+
+    failed = [os.path.join(tmp_path, 'failed', d) for d in os.listdir(tmp_path / 'failed')]
+    assert sorted(open(os.path.join(d, 'log')).read() for d in failed) == ['1', '2']
+
+
+def test_orphaned_run_dirs_are_removed(tmp_path):
+    (tmp_path / f"run-{os.getpid()}-alive").mkdir()
+    (tmp_path / "run-999999999-dead").mkdir()
+    scratch = ScratchSpace(str(tmp_path), min_free=0)
+    scratch.release(scratch.acquire())
+    assert 'run-999999999-dead' not in os.listdir(tmp_path)
+    assert f"run-{os.getpid()}-alive" in os.listdir(tmp_path)
+
+
+def test_runs_wait_for_free_space(tmp_path):
+    scratch = ScratchSpace(str(tmp_path), min_free=100, wait_seconds=0.05, poll_interval=0.01)
+    with patch.object(scratch, 'free_space', side_effect=[10, 10, 200]):
+        run_dir = scratch.acquire()
+    assert os.path.isdir(run_dir)
+
+    with patch.object(scratch, 'free_space', return_value=10):
+        with pytest.raises(ScratchSpaceFullError):
+            scratch.acquire()
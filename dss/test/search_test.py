@@ -0,0 +1,148 @@
+import pytest
+from pytest import approx
+
+import wqdss.search
+
+
+def search_params(search, steps=('1', '0.1'), **options):
+    return {
+        'model_analysis': {
+            'parameters': [],
+            "output_file": "tsr_2_seg7.csv",
+        },
+        'model_run': {
+            'type': 'flow',
+            'search': search,
+            'search_options': options,
+            'input_files': [
+                {'name': 'hangq01.csv', 'col_name': 'Q',
+                 'min_val': '1', 'max_val': '10', 'steps': list(steps)},
+                {'name': 'qin_br8.csv', 'col_name': 'QWD',
+                 'min_val': '30', 'max_val': '40', 'steps': list(steps)}
+            ]
+        },
+    }
+
+
+def score(permutation):
+    # a smooth score, with its minimum at (5.3, 34.7)
+    return (permutation.values['hangq01.csv'] - 5.3) ** 2 + (permutation.values['qin_br8.csv'] - 34.7) ** 2
+
+
+def run_search(params, score=score):
+    ''' Drives the strategy the same way Execution.execute does, returns all runs and the best run '''
+    strategy = wqdss.search.get_search_strategy(params)
+    runs = []
+    best_runs = []
+    for iteration in range(1000):
+        permutations = strategy.next_permutations(iteration, list(runs), best_runs)
+        if not permutations:
+            break
+        runs.extend((p, score(p)) for p in permutations)
+        best = min(runs, key=lambda r: r[1])
+        best_runs.append({'params': best[0], 'score': best[1]})
+    return runs, best_runs[-1]
+
+
+def test_grid_is_default():
+    params = search_params('grid')
+    del params['model_run']['search']
+    assert isinstance(wqdss.search.get_search_strategy(params), wqdss.search.GridSearch)
+
+    runs, best = run_search(params)
+    assert len(runs) == 10 * 11 + 11 * 11
+    assert best['score'] == approx(0)
+
+
+def test_unknown_search():
+    with pytest.raises(wqdss.search.UnknownSearchStrategy):
+        wqdss.search.get_search_strategy(search_params('exhaustive'))
+
+
+def test_grid_non_equal_steps():
+    params = search_params('grid')
+    params['model_run']['input_files'][0]['steps'] = ['1']
+    with pytest.raises(wqdss.search.NonEqualStepNumber):
+        wqdss.search.get_search_strategy(params)
+
+
+def test_adaptive_search():
+    runs, best = run_search(search_params('adaptive'))
+    assert len(runs) <= 10 * 11 + 11 * 11
+    assert best['score'] == approx(0)
+
+
+def test_adaptive_search_flat_input():
+    def flat_score(p):
+        return (p.values['hangq01.csv'] - 5.3) ** 2 + 0.001 * abs(p.values['qin_br8.csv'] - 34.7)
+
+    # the score is barely sensitive to qin_br8.csv, so it isn't refined
+    runs, best = run_search(search_params('adaptive'), flat_score)
+    assert len(runs) == 10 * 11 + 10
+    assert best['params'].values['hangq01.csv'] == approx(5.3)
+    assert best['score'] < 0.001
+
+
+def test_coordinate_search():
+    runs, best = run_search(search_params('coordinate'))
+    assert len(runs) < 10 * 11
+    assert best['score'] == approx(0)
+
+
+def test_nelder_mead_search():
+    runs, best = run_search(search_params('nelder-mead', max_runs=60))
+    assert len(runs) <= 60
+    assert best['score'] < 0.1
+
+
+def test_latin_hypercube_search():
+    runs, best = run_search(search_params('latin-hypercube', seed=1))
+    assert len(runs) <= 40
+    assert best['score'] < 1.0
+
+    # all values are on the grid of the finest step, and within the bounds
+    for permutation, _ in runs:
+        assert 1 <= permutation.values['hangq01.csv'] <= 10
+        assert round(permutation.values['qin_br8.csv'] * 10) == approx(permutation.values['qin_br8.csv'] * 10)
+
+
+def test_bayesian_search():
+    runs, best = run_search(search_params('bayesian', seed=1, max_runs=30))
+    assert len(runs) <= 30
+    assert best['score'] < 0.5
+
+    # no permutation is executed twice
+    values = [tuple(p.values.values()) for p, _ in runs]
+    assert len(values) == len(set(values))
+
+
+def test_snap():
+    dim = wqdss.search.SearchDimension({'name': 'a', 'col_name': 'Q', 'min_val': '1', 'max_val': '2',
+                                        'steps': ['0.3']})
+    assert dim.snap(1.4) == approx(1.3)
+    assert dim.snap(5) == approx(1.9)
+    assert dim.snap(-5) == approx(1)
+
+
+def test_beam_search():
+    runs, best = run_search(search_params('beam', beam_width=2))
+    assert len(runs) <= 10 * 11 + 2 * 11 * 11
+    assert best['score'] == approx(0)
+
+
+def test_beam_search_escapes_local_minimum():
+    def two_minima(p):
+        # a wide local minimum at (2, 32), and a narrow global minimum at (8.4, 37.6)
+        x, y = p.values['hangq01.csv'], p.values['qin_br8.csv']
+        return min((x - 2) ** 2 + (y - 32) ** 2 + 0.1, 10 * ((x - 8.4) ** 2 + (y - 37.6) ** 2))
+
+    runs, best = run_search(search_params('grid'), two_minima)
+    assert best['score'] == approx(0.1)
+    runs, best = run_search(search_params('beam', beam_width=2), two_minima)
+    assert best['score'] == approx(0)
+
+
+def test_beam_search_budget():
+    runs, best = run_search(search_params('beam', beam_width=3, max_runs=150))
+    assert len(runs) == 150
+    assert best['score'] < 0.1
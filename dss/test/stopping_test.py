@@ -0,0 +1,57 @@
+from wqdss.stopping import StoppingCriteria
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def criteria(clock=None, **options):
+    return StoppingCriteria({'model_run': {'stopping': options}}, **({'clock': clock} if clock else {}))
+
+
+def test_no_criteria():
+    stopping = StoppingCriteria({'model_run': {}})
+    for score in range(100):
+        stopping.add_run(score)
+    assert stopping.reason() is None
+    assert stopping.time_left() is None
+
+
+def test_score_threshold():
+    stopping = criteria(score_threshold='0.5')
+    stopping.add_run(3.0)
+    assert stopping.reason() is None
+    stopping.add_run(0.5)
+    assert 'threshold' in stopping.reason()
+
+
+def test_patience():
+    stopping = criteria(patience=3)
+    for score in [5.0, 4.0, 4.5, 4.0]:
+        stopping.add_run(score)
+    assert stopping.reason() is None
+    stopping.add_run(6.0)
+    assert 'did not improve in 3 runs' in stopping.reason()
+
+
+def test_max_runs():
+    stopping = criteria(max_runs=2)
+    stopping.add_run(1.0)
+    assert stopping.reason() is None
+    stopping.add_run(1.0)
+    assert stopping.reason() == '2 runs were executed'
+
+
+def test_max_duration():
+    clock = FakeClock()
+    stopping = criteria(clock, max_duration=60)
+    clock.now = 45
+    assert stopping.time_left() == 15
+    assert stopping.reason() is None
+    clock.now = 61
+    assert stopping.time_left() == 0
+    assert 'ran for 60.0 seconds' in stopping.reason()
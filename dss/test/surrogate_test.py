@@ -0,0 +1,63 @@
+from wqdss.model_execution import ModelExecutionPermutation
+from wqdss.search import values_range
+from wqdss.surrogate import get_surrogate_filter, SurrogateFilter
+
+
+def surrogate_params(surrogate):
+    return {
+        'model_run': {
+            'surrogate': surrogate,
+            'input_files': [
+                {'name': 'hangq01.csv', 'col_name': 'Q', 'min_val': '1', 'max_val': '10', 'steps': ['1']},
+                {'name': 'qin_br8.csv', 'col_name': 'QWD', 'min_val': '30', 'max_val': '40', 'steps': ['1']},
+            ]
+        }
+    }
+
+
+def grid():
+    return [ModelExecutionPermutation(['hangq01.csv', 'qin_br8.csv'], ['Q', 'QWD'], [x, y])
+            for x in values_range(1, 10, 1) for y in values_range(30, 40, 1)]
+
+
+def score(permutation):
+    return (permutation.values['hangq01.csv'] - 5) ** 2 + (permutation.values['qin_br8.csv'] - 35) ** 2
+
+
+def run_rounds(surrogate, permutations):
+    runs = []
+    remaining = permutations
+    while remaining:
+        round_permutations, remaining = surrogate.next_round(remaining, runs)
+        runs.extend((p, score(p)) for p in round_permutations)
+    return runs
+
+
+def test_disabled():
+    assert get_surrogate_filter({'model_run': {}}) is None
+    assert isinstance(get_surrogate_filter(surrogate_params(True)), SurrogateFilter)
+
+
+def test_initial_runs_are_spread():
+    surrogate = get_surrogate_filter(surrogate_params({'min_runs': 5}))
+    permutations = grid()
+    round_permutations, remaining = surrogate.next_round(permutations, [])
+    assert len(round_permutations) == 5
+    assert len(remaining) == len(permutations) - 5
+    assert round_permutations[0] is permutations[0]
+    assert round_permutations[-1] is permutations[-1]
+
+
+def test_skips_runs():
+    surrogate = get_surrogate_filter(surrogate_params({'round_size': 8}))
+    runs = run_rounds(surrogate, grid())
+    assert len(runs) < len(grid()) / 2
+    assert min(s for _, s in runs) == 0
+
+
+def test_round_size():
+    surrogate = get_surrogate_filter(surrogate_params({'round_size': 4, 'min_runs': 4}))
+    permutations = grid()
+    runs = [(p, score(p)) for p in permutations[:4]]
+    round_permutations, remaining = surrogate.next_round(permutations[4:], runs)
+    assert len(round_permutations) <= 4
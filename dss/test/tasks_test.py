@@ -0,0 +1,153 @@
+import asyncio
+import base64
+import socket
+import threading
+import time
+from unittest.mock import Mock, patch
+
+import celery
+import pytest
+
+import wqdss.tasks
+
+
+class FakeResultConsumer:
+    ''' Delivers results that were marked as done, the same way the rpc result consumer does '''
+
+    def __init__(self):
+        self.done = {}
+        self.lock = threading.Lock()
+
+    def drain_events(self, timeout=None):
+        with self.lock:
+            ready, self.done = self.done, {}
+        if not ready:
+            time.sleep(timeout)
+            raise socket.timeout()
+        for async_result, value in ready.items():
+            async_result.fire(value)
+
+
+class ThreadLocalBackend:
+    ''' A backend that isn't thread-safe, so the app creates one in every thread, like the rpc backend '''
+    thread_safe = False
+
+    def __init__(self, app=None, url=None):
+        self.result_consumer = FakeResultConsumer()
+
+
+class FakeAsyncResult:
+    def __init__(self, backend):
+        self.backend = backend
+        self.consumer = backend.result_consumer
+        self.callbacks = []
+        self.value = None
+        self.forget = Mock()
+        self.revoke = Mock()
+
+    def then(self, callback, on_error=None):
+        self.callbacks.append(callback)
+
+    def finish(self, value):
+        with self.consumer.lock:
+            self.consumer.done[self] = value
+
+    def fire(self, value):
+        self.value = value
+        for callback in self.callbacks:
+            callback(self)
+
+    def get(self, timeout=None, propagate=True):
+        if isinstance(self.value, Exception):
+            raise self.value
+        return self.value
+
+
+@pytest.fixture
+def listener():
+    app = celery.Celery('tasks_test', backend=f'{__name__}:ThreadLocalBackend')
+    # the results are sent by the backend of this thread, the listener thread has a backend of its own
+    return wqdss.tasks.ResultListener(app, interval=0.01), app.backend
+
+
+@pytest.mark.asyncio
+async def test_result_listener_thread_local_backend(listener):
+    listener, _ = listener
+    # the task was sent by the backend of another thread, whether or not the app creates one per thread
+    backend = ThreadLocalBackend()
+    assert backend is not listener.app.backend
+
+    result = FakeAsyncResult(backend)
+    waiter = asyncio.ensure_future(wqdss.tasks.get_result(result, timeout=1, listener=listener))
+    await asyncio.sleep(0.02)
+    result.finish({"score": 1.0})
+    assert await waiter == {"score": 1.0}
+
+
+@pytest.mark.asyncio
+async def test_result_listener(listener):
+    listener, backend = listener
+    results = [FakeAsyncResult(backend) for _ in range(50)]
+    waiters = [asyncio.ensure_future(wqdss.tasks.get_result(r, listener=listener)) for r in results]
+
+    for i, r in enumerate(results):
+        r.finish({"result": base64.b64encode(f"run {i}".encode()).decode('ascii')})
+
+    assert await asyncio.gather(*waiters) == [{"result": f"run {i}".encode()} for i in range(50)]
+
+
+@pytest.mark.asyncio
+async def test_result_listener_failure(listener):
+    listener, backend = listener
+    result = FakeAsyncResult(backend)
+    waiter = asyncio.ensure_future(wqdss.tasks.get_result(result, listener=listener))
+    result.finish(RuntimeError("run failed"))
+
+    with pytest.raises(RuntimeError):
+        await waiter
+    result.forget.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_result_listener_timeout(listener):
+    listener, backend = listener
+    result = FakeAsyncResult(backend)
+
+    with pytest.raises(wqdss.tasks.TimeoutError):
+        await wqdss.tasks.get_result(result, timeout=0.05, listener=listener)
+
+    # a result that arrives after the timeout is ignored
+    result.finish({"result": ""})
+    await asyncio.sleep(0.05)
+
+
+@pytest.mark.asyncio
+async def test_cancelled_result_is_revoked(listener):
+    listener, backend = listener
+    result = FakeAsyncResult(backend)
+    waiter = asyncio.ensure_future(wqdss.tasks.get_result(result, listener=listener))
+    await asyncio.sleep(0)
+    waiter.cancel()
+
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+    result.revoke.assert_called_once()
+    result.forget.assert_called_once()
+
+
+def test_model_exec_batch():
+    def execute_run(model_run, param_values_as_dict, output_file, model_analysis=None):
+        if param_values_as_dict['values'] == [2.0]:
+            raise RuntimeError('run failed')
+        return {'score': param_values_as_dict['values'][0]}
+
+    with patch('wqdss.tasks.CeleryModelExecution') as model_execution, \
+            patch('wqdss.tasks.execute_run', side_effect=execute_run):
+        model_execution.return_value.process_pool.size = 2
+        records = wqdss.tasks.model_exec_batch('model', [{'files': ['a.csv'], 'columns': ['Q'], 'values': [v]}
+                                                        for v in [1.0, 2.0, 3.0]], 'out.csv', {})
+
+    # the model is prepared once for the whole batch, and a failed run doesn't fail the others.
+    # The runs are executed in parallel, and their records are returned in order
+    model_execution.assert_called_once_with('model', model_version=None)
+    assert records == [{'score': 1.0}, {'error': 'run failed'}, {'score': 3.0}]